@@ -0,0 +1,188 @@
+"""End-to-end latency benchmark for ConversationLogic.chat_gpt against the local mock server.
+
+Measures the local overhead of a turn (loading, trimming, token counting, saving) apart from the HTTP call, across history sizes.
+The "local" phase is the total time minus the time spent in the HTTP call.
+Example: python benchmarks/bench_chat_gpt.py --sizes 10 100 1000 10000 --iterations 50 --latency 0.02
+
+Each history size runs in its own temporary working directory (with its own data/ and configs.json), so real conversations are never touched. """
+
+import argparse, contextlib, io, json, math, os, sys, tempfile, time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from mock_openai_server import start_server
+from configuration import ConfigManager
+from conversation_logic import ConversationLogic
+
+PHASES = ["total", "first_token", "load", "trim", "tokenize", "api", "save", "local"]
+
+class PhaseTimer:
+    """Accumulates the time spent in wrapped functions during one turn."""
+
+    def __init__(self):
+        self.current = defaultdict(float)
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.current[phase] += time.perf_counter() - start
+        return timed
+
+    def wrap_api(self, create):
+        """Times the completions call, including the time spent reading a streamed response."""
+        timed_create = self.wrap("api", create)
+
+        def timed(*args, **kwargs):
+            response = timed_create(*args, **kwargs)
+            if not kwargs.get("stream"):
+                return response
+            return TimedStream(response, self)
+        return timed
+
+    def reset(self):
+        self.current = defaultdict(float)
+
+class TimedStream:
+    """Wraps a streamed response so the time spent waiting for chunks counts as api time."""
+
+    def __init__(self, stream, timer):
+        self.stream = stream
+        self.response = stream.response
+        self.timer = timer
+
+    def __iter__(self):
+        iterator = iter(self.stream)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.timer.current["api"] += time.perf_counter() - start
+            yield chunk
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def make_history(size, message_words):
+    """Builds a conversation of the given number of messages, starting with the system message."""
+    messages = [{"role": "system", "content": "You are an assistant providing help for any task, utilizing context for the best responses"}]
+    for i in range(size - 1):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": " ".join(f"{role}{i}word{j}" for j in range(message_words))})
+    return messages
+
+def instrument(logic, timer):
+    """Wraps the phases of a ConversationLogic instance with the timer."""
+    logic.load_conversation = timer.wrap("load", logic.load_conversation)
+    logic.trim_conversation_history = timer.wrap("trim", logic.trim_conversation_history)
+    logic.count_tokens_in_messages = timer.wrap("tokenize", logic.count_tokens_in_messages)
+    logic.update_conversation = timer.wrap("save", logic.update_conversation)
+    completions = logic.client.chat.completions
+    completions.create = timer.wrap_api(completions.create)
+
+def run_size(size, args, base_url):
+    """Runs the benchmark for one history size and returns {phase: [seconds per turn]}."""
+    samples = defaultdict(list)
+    timer = PhaseTimer()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs("data")
+        config = {
+            "model": args.model,
+            "max_tokens": args.max_tokens,
+            "stream": args.stream,
+            "system_message": "You are an assistant providing help for any task, utilizing context for the best responses",
+            "user_message": "What can you help me with today?",
+            "assistant_message": "Hi there! How can I help you today?",
+            "filename": os.path.join("data", "conversation.json"),
+            "OPENAI_API_KEY": "mock-key",
+            "OPENAI_BASE_URL": base_url,
+        }
+        with open("configs.json", "w") as file:
+            json.dump(config, file)
+        with open(config["filename"], "w") as file:
+            json.dump({"messages": make_history(size, args.message_words)}, file)
+
+        logic = None
+        for iteration in range(args.warmup + args.iterations):
+            if logic is None or args.cold:
+                logic = ConversationLogic(ConfigManager("configs.json")) # a cold turn pays for parsing the file and the token sidecar again
+                instrument(logic, timer)
+
+            timer.reset()
+            start = time.perf_counter()
+            first_token = None
+            with contextlib.redirect_stdout(io.StringIO()): # chat_gpt prints its api log
+                if args.stream:
+                    error = None
+                    for chunk, error in logic.chat_gpt_stream(f"Benchmark prompt {iteration}"):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                else:
+                    response, error = logic.chat_gpt(f"Benchmark prompt {iteration}")
+            total = time.perf_counter() - start
+            if error is not None:
+                raise RuntimeError(f"chat_gpt failed: {error}")
+
+            if iteration < args.warmup:
+                continue
+            samples["total"].append(total)
+            if first_token is not None:
+                samples["first_token"].append(first_token)
+            for phase in ("load", "trim", "tokenize", "api", "save"):
+                samples[phase].append(timer.current[phase])
+            samples["local"].append(total - timer.current["api"])
+
+        os.chdir(args.start_dir)
+    return samples
+
+def report(results, output):
+    """Prints the p50/p95/p99 latency of every phase, in milliseconds."""
+    print(f"{'history':>8} {'phase':>9} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}", file=output)
+    for size, samples in results.items():
+        for phase in PHASES:
+            values = samples[phase]
+            if not values:
+                continue
+            print(f"{size:>8} {phase:>9} {percentile(values, 50) * 1000:>10.3f} {percentile(values, 95) * 1000:>10.3f} "
+                  f"{percentile(values, 99) * 1000:>10.3f}", file=output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ConversationLogic.chat_gpt against a local mock OpenAI server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="history sizes, in messages")
+    parser.add_argument("--iterations", type=int, default=50, help="measured turns per size")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured turns per size")
+    parser.add_argument("--cold", action="store_true", help="use a new ConversationLogic for every turn (no in-memory caches)")
+    parser.add_argument("--stream", action="store_true", help="use chat_gpt_stream and also report time to first token")
+    parser.add_argument("--model", default="gpt-3.5-turbo-1106")
+    parser.add_argument("--max-tokens", type=int, default=4000)
+    parser.add_argument("--message-words", type=int, default=40, help="words per history message")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock server latency, in seconds")
+    parser.add_argument("--response-words", type=int, default=50, help="words per mock completion")
+    parser.add_argument("--json", metavar="PATH", help="also write the raw samples as JSON")
+    args = parser.parse_args()
+    args.start_dir = os.getcwd()
+
+    server, base_url = start_server(latency=args.latency, response_words=args.response_words)
+    try:
+        results = {size: run_size(size, args, base_url) for size in args.sizes}
+    finally:
+        server.shutdown()
+
+    report(results, sys.stdout)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({str(size): samples for size, samples in results.items()}, file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Startup benchmark for the GPT App.
+
+Measures, in fresh interpreter processes so every run pays for the imports:
+    import      importing the app modules (configuration, conversation_logic, and the GUI modules)
+    first_paint the window has been built and painted (with --headless: ConversationLogic is ready to build the window)
+    send_ready  the background warm-up finished: the OpenAI client and the tokenizer of the configured model are loaded
+    first_count the first token count after the warm-up (should be fast, the encoder is already loaded)
+Example: python benchmarks/bench_startup.py --runs 10
+The GUI runs need a display (use xvfb-run on a headless machine), --headless skips the window. """
+
+import argparse, json, math, os, subprocess, sys, tempfile, time
+
+START = time.perf_counter() # taken before any app module is imported
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+PHASES = ["import", "first_paint", "send_ready", "first_count"]
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+def make_history(size):
+    """Builds a conversation of the given number of messages, starting with the system message."""
+    messages = [{"role": "system", "content": "You are an assistant providing help for any task, utilizing context for the best responses"}]
+    for i in range(size - 1):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": " ".join(f"{role}{i}word{j}" for j in range(40))})
+    return messages
+
+def run_child(args):
+    """Starts the app in this process and prints its startup timings (seconds since START) as one JSON line."""
+    sys.path.insert(0, SRC_DIR)
+    os.chdir(args.workdir)
+    timings = {}
+
+    from configuration import ConfigManager
+    from conversation_logic import ConversationLogic
+    if not args.headless:
+        import tkinter as tk
+        from gui import Main
+    timings["import"] = time.perf_counter() - START
+
+    logic = ConversationLogic(ConfigManager("configs.json"))
+    if args.headless:
+        logic.load_conversation(tail=52) # the last page the window shows first
+    else:
+        root = tk.Tk()
+        main = Main(root, logic)
+        main.pack(side="top", fill="both", expand=True)
+        root.update() # same start path as main.py: paint first, then load the conversation and warm up
+        main.start_loading()
+    timings["first_paint"] = time.perf_counter() - START
+
+    logic.start_warm_up()
+    while not logic.ready.wait(0.005):
+        if not args.headless:
+            root.update() # keeps the window responsive while waiting, like the main loop would
+    timings["send_ready"] = time.perf_counter() - START
+
+    count_start = time.perf_counter()
+    logic.count_tokens_in_messages([{"role": "user", "content": "How long did startup take?"}])
+    timings["first_count"] = time.perf_counter() - count_start
+
+    if not args.headless:
+        root.destroy()
+    print(json.dumps(timings))
+
+def run_once(args, workdir):
+    """Runs one startup in a new process and returns its timings."""
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--workdir", workdir]
+    if args.headless:
+        command.append("--headless")
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def report(samples, output):
+    """Prints the p50/p95/max of every phase, in milliseconds."""
+    print(f"{'phase':>12} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}", file=output)
+    for phase in PHASES:
+        values = samples[phase]
+        print(f"{phase:>12} {percentile(values, 50) * 1000:>10.1f} {percentile(values, 95) * 1000:>10.1f} {max(values) * 1000:>10.1f}", file=output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup of the GPT App: time to first paint and until the first send is possible.")
+    parser.add_argument("--runs", type=int, default=10, help="number of measured startups")
+    parser.add_argument("--headless", action="store_true", help="skip the window (no display needed)")
+    parser.add_argument("--history", type=int, default=100, help="messages in the conversation opened at startup")
+    parser.add_argument("--model", default="gpt-3.5-turbo-1106")
+    parser.add_argument("--json", metavar="PATH", help="also write the raw samples as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    samples = {phase: [] for phase in PHASES}
+    with tempfile.TemporaryDirectory() as workdir: # real configs and conversations are never touched
+        os.makedirs(os.path.join(workdir, "data"))
+        config = {
+            "model": args.model,
+            "max_tokens": 4000,
+            "system_message": "You are an assistant providing help for any task, utilizing context for the best responses",
+            "user_message": "What can you help me with today?",
+            "assistant_message": "Hi there! How can I help you today?",
+            "filename": os.path.join("data", "conversation.json"),
+            "OPENAI_API_KEY": "benchmark-key",
+        }
+        with open(os.path.join(workdir, "configs.json"), "w") as file:
+            json.dump(config, file)
+        with open(os.path.join(workdir, config["filename"]), "w") as file:
+            json.dump({"messages": make_history(args.history)}, file)
+
+        run_once(args, workdir) # unmeasured: fills the OS file cache and the conversation index
+        for _ in range(args.runs):
+            for phase, seconds in run_once(args, workdir).items():
+                samples[phase].append(seconds)
+
+    report(samples, sys.stdout)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(samples, file)
+
+if __name__ == "__main__":
+    main()
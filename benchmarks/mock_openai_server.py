@@ -0,0 +1,134 @@
+"""A local stand-in for OpenAI's chat completions endpoint, used to benchmark the app without network time or API costs.
+
+Run it on its own with 'python benchmarks/mock_openai_server.py --port 8765 --latency 0.05' and set
+"OPENAI_BASE_URL": "http://127.0.0.1:8765/v1" in configs.json, or start it from a script with start_server(). """
+
+import argparse, json, random, socket, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockSettings:
+    """Response settings of the mock server.
+
+    Args:
+        latency (float): Seconds to wait before the response (or the first chunk) is sent.
+        jitter (float): Up to this many extra seconds are added to the latency at random.
+        response_words (int): Number of words in each completion.
+        chunk_delay (float): Seconds between chunks of a streamed response. """
+
+    def __init__(self, latency=0.0, jitter=0.0, response_words=50, chunk_delay=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.response_words = response_words
+        self.chunk_delay = chunk_delay
+
+class MockCompletionsHandler(BaseHTTPRequestHandler):
+    """Answers POST .../chat/completions requests with a fixed-size completion, streamed or not."""
+
+    protocol_version = "HTTP/1.1" # keeps connections alive, like the real API
+    settings = MockSettings()
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # no Nagle delay between headers and body
+
+    def log_message(self, format, *args):
+        pass # silence the per-request logging of BaseHTTPRequestHandler
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        settings = self.settings
+        time.sleep(settings.latency + random.uniform(0, settings.jitter))
+
+        words = [f"word{i % 100}" for i in range(settings.response_words)]
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) + 4 for message in body.get("messages", []))
+        model = body.get("model", "gpt-mock")
+
+        if body.get("stream"):
+            self.send_stream(words, model, settings.chunk_delay)
+        else:
+            payload = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)},
+            }
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def send_stream(self, words, model, chunk_delay):
+        """Sends the completion as server-sent events, one word per chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(data):
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+            }
+            write_event(json.dumps(chunk))
+            if chunk_delay:
+                time.sleep(chunk_delay)
+
+        final_chunk = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        write_event(json.dumps(final_chunk))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+def start_server(port=0, **settings):
+    """Starts the mock server on a background thread.
+
+    Args:
+        port (int): The port to listen on, 0 picks a free port.
+        **settings: Response settings, see MockSettings.
+
+    Returns:
+        Tuple[ThreadingHTTPServer, str]: The running server (call shutdown() to stop it) and its base URL for OPENAI_BASE_URL. """
+
+    handler = type("ConfiguredHandler", (MockCompletionsHandler,), {"settings": MockSettings(**settings)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI chat completions endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the response is sent")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, in seconds")
+    parser.add_argument("--response-words", type=int, default=50, help="words per completion")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, latency=args.latency, jitter=args.jitter,
+                                    response_words=args.response_words, chunk_delay=args.chunk_delay)
+    print(f"Mock OpenAI server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,211 @@
+import asyncio, logging, time
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, AuthenticationError
+from conversation_logic import ConversationLogic
+
+class AsyncConversationLogic(ConversationLogic):
+    """Asyncio variant of ConversationLogic, used to run many conversations at once on a single event loop.
+
+    It offers the same chat_gpt / chat_gpt_stream / update_conversation surface as ConversationLogic, as coroutines.
+    Create one instance, then get the instance of each conversation with for_conversation(): they share its AsyncOpenAI client
+    (one per API key and event loop, backed by a single pooled HTTP client), token counter and conversation store, so concurrent conversations reuse
+    the same connections and never hold two copies of a file in memory. Constructing an instance per conversation would give each one
+    its own store. Turns of the same conversation run in order.
+    Blocking file and tokenizer work runs in the default executor so it does not stall the event loop. """
+
+    MAX_CONNECTIONS = 100 # size of the shared connection pool
+    MAX_KEEPALIVE_CONNECTIONS = 20
+    _clients = {} # (event loop, api key, base url) -> AsyncOpenAI client shared by every instance running on the loop
+
+    def __init__(self, config_manager, filename=None):
+        """Initializes the AsyncConversationLogic object.
+
+        Args:
+            config_manager (ConfigManager): The shared configuration manager.
+            filename (str, optional): The conversation handled by this instance. Defaults to the configured filename. """
+
+        super().__init__(config_manager)
+        if filename is not None:
+            self.set_filename(filename)
+        self.turn_lock = asyncio.Lock() # keeps the turns of this conversation in order
+
+    @property
+    def client(self):
+        """The AsyncOpenAI client of the running event loop (see create_client()), unless a client was set explicitly."""
+        if self._client is not None:
+            return self._client
+        return self.create_client(self.api_key)
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def create_client(self, api_key):
+        """Returns the AsyncOpenAI client shared by all instances for the given API key on the running event loop, creating it
+        (and its connection pool) on first use. The connections of an httpx client belong to the loop they were opened on, so every
+        loop gets its own client (a batch may call asyncio.run() several times), and the clients of closed loops are dropped. """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError: # called outside of a coroutine, for example by for_conversation() before the loop starts
+            loop = None
+        for client_key in [client_key for client_key in self._clients if client_key[0] is not None and client_key[0].is_closed()]:
+            del self._clients[client_key]
+
+        client_key = (loop, api_key, self.config.get('OPENAI_BASE_URL'))
+        client = self._clients.get(client_key)
+        if client is None:
+            http_client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.MAX_CONNECTIONS,
+                max_keepalive_connections=self.MAX_KEEPALIVE_CONNECTIONS,
+            ))
+            client = AsyncOpenAI(api_key=api_key, base_url=self.config.get('OPENAI_BASE_URL'), http_client=http_client,
+                                 max_retries=0) # retries are done by the rate limiter
+            self._clients[client_key] = client
+        return client
+
+    def for_conversation(self, filename):
+        """Returns an AsyncConversationLogic for another conversation file, sharing this instance's client, token counter and store."""
+        logic = super().for_conversation(filename)
+        logic.turn_lock = asyncio.Lock() # each conversation keeps its own turn order
+        return logic
+
+    @classmethod
+    async def close_clients(cls):
+        """Closes the shared clients of the running event loop and their connection pools. Call this before the loop shuts down,
+        so the open connections are closed cleanly (the clients of a closed loop are dropped on the next create_client() anyway). """
+        loop = asyncio.get_running_loop()
+        clients = [cls._clients.pop(client_key) for client_key in list(cls._clients) if client_key[0] in (loop, None)]
+        for client in clients:
+            await client.close()
+
+    async def chat_gpt(self, user_input, use_cache=True):
+        """Performs the API call without blocking the event loop. See ConversationLogic.chat_gpt()
+        Args:
+            user_input (str): The user's input for the conversation.
+            use_cache (bool): Set to False to bypass the response cache for this call.
+
+        Returns:
+            Tuple[str, None or str]: A tuple containing the GPT response and any potential error message. The second element is None if there are no errors. """
+
+        async with self.turn_lock:
+            self.loop = asyncio.get_running_loop() # used by request_summary() from the worker thread
+            request_start = time.perf_counter()
+            messages = await asyncio.to_thread(self.prepare_messages, user_input) # loads, trims and appends the user input to the conversation
+
+            cache_key, cached_response = await asyncio.to_thread(self.lookup_cached_response, messages, use_cache)
+            if cached_response is not None:
+                self.log_api_call("Total Time: 0.00s")
+                await self.update_conversation(user_input, cached_response)
+                return cached_response, None
+
+            try:
+                start_time = time.perf_counter()
+                response = await self.create_completion(messages=messages, max_tokens=self.max_tokens)
+                total_time = time.perf_counter() - start_time
+
+                self.record_usage(response)
+                self.log_api_call(f"Total Time: {total_time:.2f}s")
+
+                response = response.choices[0].message.content
+                await asyncio.to_thread(self.store_cached_response, cache_key, response)
+                await self.update_conversation(user_input, response)
+                await asyncio.to_thread(self.record_call_metrics, time.perf_counter() - request_start, total_time)
+
+                return response, None
+            except AuthenticationError as auth_error:
+                logging.error(f"Authentication error: {auth_error}")
+                return None, (str(auth_error))
+            except APIConnectionError as conn_error:
+                logging.error(f"API connection error: {conn_error}")
+                return None, (str(conn_error))
+            except APIStatusError as api_error:
+                logging.error(f"API error: {api_error}")
+                return None, (str(api_error))
+
+    async def chat_gpt_stream(self, user_input, use_cache=True):
+        """Streaming variant of chat_gpt(). See ConversationLogic.chat_gpt_stream()
+        Args:
+            user_input (str): The user's input for the conversation.
+            use_cache (bool): Set to False to bypass the response cache for this call.
+
+        Yields:
+            Tuple[str, None or str]: (chunk, None) for each piece of the response, or (None, error message) if the call fails. """
+
+        async with self.turn_lock:
+            self.loop = asyncio.get_running_loop()
+            request_start = time.perf_counter()
+            messages = await asyncio.to_thread(self.prepare_messages, user_input)
+            cache_key, cached_response = await asyncio.to_thread(self.lookup_cached_response, messages, use_cache)
+            if cached_response is not None:
+                self.log_api_call("Time to First Token: 0.00s | Total Time: 0.00s")
+                yield cached_response, None
+                await self.update_conversation(user_input, cached_response)
+                return
+
+            chunks = []
+            first_token_time = None
+            self.model_type = self.model
+            self.stop_reason = None
+
+            try:
+                start_time = time.perf_counter()
+                stream = await self.create_completion(messages=messages, max_tokens=self.max_tokens, stream=True)
+                try:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        self.model_type = chunk.model
+                        if chunk.choices[0].finish_reason:
+                            self.stop_reason = chunk.choices[0].finish_reason
+                        content = chunk.choices[0].delta.content
+                        if content:
+                            if first_token_time is None:
+                                first_token_time = time.perf_counter() - start_time
+                            chunks.append(content)
+                            yield content, None
+                finally:
+                    await stream.response.aclose() # returns the connection to the pool, even if the caller stops reading early
+            except AuthenticationError as auth_error:
+                logging.error(f"Authentication error: {auth_error}")
+                yield None, (str(auth_error))
+                return
+            except APIConnectionError as conn_error:
+                logging.error(f"API connection error: {conn_error}")
+                yield None, (str(conn_error))
+                return
+            except APIStatusError as api_error:
+                logging.error(f"API error: {api_error}")
+                yield None, (str(api_error))
+                return
+
+            total_time = time.perf_counter() - start_time
+            response = "".join(chunks)
+            await asyncio.to_thread(self.record_stream_usage, messages, response)
+
+            first_token_text = f"{first_token_time:.2f}s" if first_token_time is not None else "n/a"
+            self.log_api_call(f"Time to First Token: {first_token_text} | Total Time: {total_time:.2f}s")
+
+            await asyncio.to_thread(self.store_cached_response, cache_key, response)
+            await self.update_conversation(user_input, response)
+            await asyncio.to_thread(self.record_call_metrics, time.perf_counter() - request_start, total_time, first_token_time)
+
+    def request_summary(self, summary_messages, max_tokens):
+        """Sends a summarization request on the event loop of the current turn. This is called from the worker thread running prepare_messages()."""
+        coroutine = self.create_completion(messages=summary_messages, max_tokens=max_tokens)
+        response = asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+        return response.choices[0].message.content
+
+    async def create_completion(self, messages, max_tokens, **kwargs):
+        """Sends a chat completions request through the rate limiter without blocking the event loop. See ConversationLogic.create_completion()"""
+        tokens = await asyncio.to_thread(self.count_tokens_in_messages, messages) + max_tokens # new messages are encoded
+        try:
+            return await self.rate_limiter.acall(self.model, tokens, lambda: self.client.chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, **kwargs))
+        except Exception as e:
+            self.metrics.increment("gpt_errors_total", model=self.model, type=type(e).__name__)
+            await asyncio.to_thread(self.export_metrics)
+            raise
+
+    async def update_conversation(self, user_input, gpt_response):
+        """Update the conversation state with the latest user input and GPT response. See ConversationLogic.update_conversation()"""
+        await asyncio.to_thread(ConversationLogic.update_conversation, self, user_input, gpt_response)
@@ -0,0 +1,156 @@
+import json, logging, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from conversation_store import ConversationStore
+
+class BatchRunner:
+    """Runs prompt jobs through ConversationLogic without the GUI (headless batch mode).
+
+    Jobs are read from a JSONL file, one {"conversation": "data/<file>.json", "prompt": "..."} object per line, with an optional "id"
+    (the line number by default). Jobs for the same conversation run in file order, while different conversations run in parallel on
+    a pool of workers. Each result is written as one JSON line as soon as it is available, so long (overnight) runs can be followed.
+    A run can be resumed by writing to the same output: the jobs whose id already has a successful result there are skipped
+    (see completed_ids()), failed jobs run again. """
+
+    def __init__(self, conversation_logic, workers=4):
+        """Initializes the BatchRunner.
+
+        Args:
+            conversation_logic (ConversationLogic): The base instance. Each conversation gets its own instance sharing its client and store.
+            workers (int): The number of conversations processed in parallel. """
+
+        self.conversation_logic = conversation_logic
+        self.workers = max(1, workers)
+        self.output_lock = threading.Lock()
+        self.totals = {"jobs": 0, "skipped": 0, "errors": 0, "total_tokens": 0, "input_tokens": 0, "response_tokens": 0}
+
+    @staticmethod
+    def load_jobs(jobs_path):
+        """Reads the jobs of a JSONL file.
+
+        Args:
+            jobs_path (str): The path to the JSONL jobs file.
+
+        Returns:
+            list: The jobs as dictionaries, each with its line number added under "line" and its "id" (the line number if it has none). """
+
+        jobs = []
+        with open(jobs_path, 'r') as file:
+            for line_number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                job = json.loads(line)
+                if "conversation" not in job or "prompt" not in job:
+                    raise ValueError(f"Job on line {line_number} must have 'conversation' and 'prompt' keys.")
+                job["line"] = line_number
+                job.setdefault("id", line_number)
+                jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def completed_ids(output_path):
+        """Reads the results of a previous run and returns the ids of the jobs that succeeded, so a resumed run skips them.
+
+        Args:
+            output_path (str): The path to the JSONL results file. A missing file means nothing was run yet.
+
+        Returns:
+            set: The ids of the jobs with a result and no error. """
+
+        done = set()
+        try:
+            with open(output_path, 'r') as file:
+                for line in file:
+                    try:
+                        result = json.loads(line)
+                    except ValueError: # a line cut short by an interrupted run
+                        continue
+                    if result.get("error") is None and "id" in result:
+                        done.add(result["id"])
+        except FileNotFoundError:
+            pass
+        return done
+
+    def run(self, jobs, output, done=()):
+        """Runs the jobs and streams the results to the output.
+
+        Args:
+            jobs (list): The jobs to run (see load_jobs()).
+            output (file): A writable text stream, each result is written as one JSON line.
+            done (set): The ids of the jobs that already succeeded in a previous run (see completed_ids()), they are skipped.
+
+        Returns:
+            dict: The total number of jobs, skipped jobs, errors and tokens used. """
+
+        conversations = OrderedDict() # canonical conversation path -> its jobs in file order
+        for job in jobs:
+            if job["id"] in done:
+                self.totals["skipped"] += 1
+                continue
+            conversations.setdefault(ConversationStore.canonical_path(job["conversation"]), []).append(job)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.run_conversation, filename, conversation_jobs, output)
+                       for filename, conversation_jobs in conversations.items()]
+            for future in futures:
+                future.result()
+
+        logging.info(f"Batch finished: {self.totals}")
+        return self.totals
+
+    def run_conversation(self, filename, jobs, output):
+        """Runs the jobs of one conversation in order. A job that fails is reported, and the following jobs still run."""
+        try:
+            logic = self.conversation_logic.for_conversation(filename)
+            try:
+                logic.load_conversation()
+            except FileNotFoundError:
+                logic.reset_conversation() # new conversations start from the default prompt
+        except (ValueError, RuntimeError) as e:
+            for job in jobs:
+                self.write_result(output, job, error=str(e))
+            return
+
+        for job in jobs:
+            start_time = time.perf_counter()
+            try:
+                response, error = logic.chat_gpt(job["prompt"])
+            except Exception as e: # any other API error is recorded with the job instead of stopping the batch
+                logging.error(f"Batch job on line {job['line']} failed: {e}")
+                response, error = None, f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - start_time
+
+            if error is not None:
+                self.write_result(output, job, error=error, elapsed=elapsed)
+            else:
+                usage = {
+                    "total_tokens": logic.total_tokens_used,
+                    "input_tokens": logic.input_tokens,
+                    "response_tokens": logic.response_tokens,
+                    "model": logic.model_type,
+                    "stop_reason": logic.stop_reason,
+                }
+                self.write_result(output, job, response=response, usage=usage, elapsed=elapsed)
+
+    def write_result(self, output, job, response=None, error=None, usage=None, elapsed=None):
+        """Writes one result line to the output and updates the totals."""
+        result = {
+            "id": job["id"],
+            "line": job["line"],
+            "conversation": job["conversation"],
+            "response": response,
+            "error": error,
+            "usage": usage,
+            "elapsed": round(elapsed, 3) if elapsed is not None else None,
+        }
+        with self.output_lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+            self.totals["jobs"] += 1
+            if error is not None:
+                self.totals["errors"] += 1
+            if usage is not None:
+                self.totals["total_tokens"] += usage["total_tokens"]
+                self.totals["input_tokens"] += usage["input_tokens"]
+                self.totals["response_tokens"] += usage["response_tokens"]
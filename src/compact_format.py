@@ -0,0 +1,75 @@
+import json, mmap, struct, zlib
+
+class CompactFormat:
+    """Compact binary snapshot format for conversations: zlib-compressed blocks of messages followed by an offset index.
+
+    Layout: MAGIC, then the blocks (each one a compressed JSON list of up to BLOCK_MESSAGES messages), then the index (one BLOCK entry
+    per block: offset, compressed length, message count), then the FOOTER (index offset, block count, total message count, END_MAGIC).
+    Files are read through mmap, so reading the last messages only touches and decompresses the blocks that hold them. """
+
+    MAGIC = b"GPTC\x01\n"
+    END_MAGIC = b"GPTCEND\n"
+    BLOCK = struct.Struct("<QII") # offset, compressed length, message count
+    FOOTER = struct.Struct("<QIQ8s") # index offset, block count, message count, END_MAGIC
+    BLOCK_MESSAGES = 64
+    COMPRESSION_LEVEL = 6
+
+    @classmethod
+    def is_compact(cls, path):
+        """Returns True if a file is in the compact format (it starts with MAGIC), False for JSON files."""
+        with open(path, 'rb') as file:
+            return file.read(len(cls.MAGIC)) == cls.MAGIC
+
+    @classmethod
+    def encode(cls, messages):
+        """Returns the compact encoding of a list of messages."""
+        parts = [cls.MAGIC]
+        offset = len(cls.MAGIC)
+        index = []
+        for start in range(0, len(messages), cls.BLOCK_MESSAGES):
+            block = messages[start:start + cls.BLOCK_MESSAGES]
+            data = zlib.compress(json.dumps(block).encode('utf-8'), cls.COMPRESSION_LEVEL)
+            parts.append(data)
+            index.append(cls.BLOCK.pack(offset, len(data), len(block)))
+            offset += len(data)
+        parts.extend(index)
+        parts.append(cls.FOOTER.pack(offset, len(index), len(messages), cls.END_MAGIC))
+        return b"".join(parts)
+
+    @classmethod
+    def read(cls, path, last=None):
+        """Reads the messages of a compact file.
+
+        Args:
+            path (str): The path to the file.
+            last (int, optional): Only read the last messages, at least this many (whole blocks are returned, the caller slices).
+
+        Returns:
+            tuple: (messages, total message count, bytes read from the file). Raises ValueError if the file is not a valid compact file. """
+
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if len(view) < len(cls.MAGIC) + cls.FOOTER.size or view[:len(cls.MAGIC)] != cls.MAGIC:
+                raise ValueError(f"Not a compact conversation file: {path}")
+            index_offset, block_count, total, end_magic = cls.FOOTER.unpack_from(view, len(view) - cls.FOOTER.size)
+            if end_magic != cls.END_MAGIC or index_offset + block_count * cls.BLOCK.size != len(view) - cls.FOOTER.size:
+                raise ValueError(f"Truncated or corrupt compact conversation file: {path}")
+
+            # walk the index backwards until enough messages are covered
+            blocks = []
+            covered = 0
+            for i in reversed(range(block_count)):
+                if last is not None and covered >= last:
+                    break
+                blocks.append(cls.BLOCK.unpack_from(view, index_offset + i * cls.BLOCK.size))
+                covered += blocks[-1][2]
+
+            messages = []
+            bytes_read = len(cls.MAGIC) + cls.FOOTER.size + len(blocks) * cls.BLOCK.size
+            for offset, length, count in reversed(blocks):
+                try:
+                    block = json.loads(zlib.decompress(view[offset:offset + length]))
+                except zlib.error as e:
+                    raise ValueError(f"Corrupt block in compact conversation file {path}: {e}") from e
+                messages.extend(block)
+                bytes_read += length
+        return messages, total, bytes_read
@@ -1,7 +1,8 @@
-import json, os
-from openai import OpenAI
+import atexit, json, logging, os, threading
 
 class ConfigManager:
+    SAVE_DELAY = 1.0 # seconds without changes before the configs are written to disk
+
     def __init__(self, config_path):
         """
         Initializes the ConfigManager instance.
@@ -17,6 +18,10 @@ class ConfigManager:
             default_config = {
                 "model": "gpt-3.5-turbo-1106",
                 "max_tokens": 500,
+                "stream": True,
+                "response_cache": False,
+                "summarize": False,
+                "summary_max_tokens": 300,
                 "system_message": "You are an assistant providing help for any task, utilizing context for the best responses",
                 "user_message": "What can you help me with today?",
                 "assistant_message": "Hi there! How can I help you today?",
@@ -32,6 +37,12 @@ class ConfigManager:
             
         # Load the configuration settings
         self.config = self.load_config()
+        self.saved_config = dict(self.config) # the configs as they are on disk, used to find the changed fields
+
+        # Changes are written in batches: a timer restarts on every change, and pending changes are flushed at exit
+        self.save_timer = None
+        self.save_lock = threading.Lock()
+        atexit.register(self.flush)
 
     def load_config(self):
         """
@@ -45,9 +56,44 @@ class ConfigManager:
         
     def save_config(self):
         """
-        Saves the current configuration settings to the configs.json file. """
-        with open(self.config_path, 'w') as file:
-            json.dump(self.config, file)
+        Saves the current configuration settings to the configs.json file. The file is written to a temporary file first and then
+        renamed over configs.json, so a crash never leaves a half-written config. """
+        with self.save_lock:
+            config = dict(self.config)
+            temp_path = self.config_path + ".tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(config, file)
+            os.replace(temp_path, self.config_path)
+            self.saved_config = config
+
+    def changed_fields(self):
+        """
+        Returns the names of the configuration settings that differ from the saved configs.json. """
+        keys = set(self.config) | set(self.saved_config)
+        return {key for key in keys if self.config.get(key) != self.saved_config.get(key)}
+
+    def schedule_save(self):
+        """
+        Writes the configs after SAVE_DELAY seconds without further changes, so a burst of changes (for example spinbox clicks) costs one write. """
+        with self.save_lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+            self.save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        """
+        Writes pending changes to configs.json now. Does nothing if the configs are unchanged. """
+        with self.save_lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+        if self.changed_fields():
+            try:
+                self.save_config()
+            except OSError as e:
+                logging.error(f"Could not save configs to {self.config_path}: {e}")
 
     def create_initial_files(self, default_config, default_messages):
         """
@@ -87,14 +133,21 @@ class ConfigManager:
 
     def update_configs(self, new_configs):
         """
-        Updates the configuration settings with new values and saves the changes locally (configs.json) .
+        Updates the configuration settings with new values. Changed settings are saved locally (configs.json) shortly after, in one batched write.
 
         Parameters:
-        - new_configs (dict): Dictionary containing any set of new configuration values. """
+        - new_configs (dict): Dictionary containing any set of new configuration values.
+
+        Returns:
+        - set: The names of the settings that differ from the saved configs. """
 
         # Update Configs 
         self.config['model'] = new_configs.get('model', self.config['model'])
         self.config['max_tokens'] = new_configs.get('max_tokens', self.config['max_tokens'])
+        self.config['stream'] = new_configs.get('stream', self.config.get('stream', True))
+        self.config['response_cache'] = new_configs.get('response_cache', self.config.get('response_cache', False))
+        self.config['summarize'] = new_configs.get('summarize', self.config.get('summarize', False))
+        self.config['summary_max_tokens'] = new_configs.get('summary_max_tokens', self.config.get('summary_max_tokens', 300))
         self.config['system_message'] = new_configs.get('system_message', self.config['system_message'])
         self.config['user_message'] = new_configs.get('user_message', self.config['user_message'])
         self.config['assistant_message'] = new_configs.get('assistant_message', self.config['assistant_message'])
@@ -102,4 +155,7 @@ class ConfigManager:
         self.config['filename'] = new_configs.get('filename', self.config['filename'])
 
         # Update and add other settings as needed
-        self.save_config()
\ No newline at end of file
+        changed = self.changed_fields()
+        if changed:
+            self.schedule_save()
+        return changed
\ No newline at end of file
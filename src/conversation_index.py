@@ -0,0 +1,165 @@
+import logging, os, sqlite3, threading
+
+class ConversationIndex:
+    """Persistent metadata index of the conversations in the data/ directory (a SQLite file, data/index.sqlite3).
+
+    For each conversation it stores the file's mtime and size, the message count, the total tokens, a short title and the last-updated time.
+    Rows are updated directly once a turn is written to disk, and refresh() only re-reads files whose mtime or size changed, so the conversation
+    list can be shown and sorted without opening every file. """
+
+    SORT_COLUMNS = ("filename", "message_count", "total_tokens", "updated_at")
+    TITLE_LENGTH = 60
+
+    def __init__(self, path):
+        """Initializes the ConversationIndex.
+
+        Args:
+            path (str): The path to the SQLite index file. """
+
+        self.path = path
+        self.connection = None # opened on first use
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # Opens the database and creates the table the first time the index is used
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL") # the index can always be rebuilt from the files
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, message_count INTEGER, "
+                "total_tokens INTEGER, title TEXT, updated_at REAL)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    @staticmethod
+    def file_state(signature):
+        """Combines a ConversationStore signature (snapshot and log stats) into a single (mtime, size) pair."""
+        stats = [stat for stat in signature if stat is not None]
+        return max(stat[0] for stat in stats), sum(stat[1] for stat in stats)
+
+    def title_for(self, messages):
+        """Returns a short title for a conversation: the start of its first user message after the default prompt."""
+        for message in messages[3:]:
+            if message.get("role") == "user":
+                return " ".join(message.get("content", "").split())[:self.TITLE_LENGTH]
+        return ""
+
+    def record(self, filename, messages, signature, total_tokens):
+        """Stores the metadata of a conversation that was just written.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The full list of messages in the conversation.
+            signature (tuple): The store signature of the file after the write.
+            total_tokens (int): The total number of tokens in the messages. """
+
+        mtime_ns, size = self.file_state(signature)
+        with self.lock:
+            connection = self.connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filename, mtime_ns, size, len(messages), total_tokens, self.title_for(messages), mtime_ns / 1e9),
+            )
+            connection.commit()
+
+    def record_append(self, filename, messages, signature, count_tokens):
+        """Updates the metadata of a conversation after messages were appended and written, without re-counting the whole conversation.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The messages of the conversation that are on disk, including the appended ones.
+            signature (tuple): The store signature of the file after the write.
+            count_tokens (callable): Returns the total number of tokens of a list of messages, called with the messages
+                appended since the row was written.
+
+        Returns:
+            bool: False if the conversation is not indexed yet, or not the one indexed (refresh() will re-read it). """
+
+        with self.lock:
+            row = self.connect().execute("SELECT total_tokens, title, message_count FROM conversations WHERE filename = ?", (filename,)).fetchone()
+        if row is None or row[2] > len(messages):
+            return False # not indexed yet, or replaced since, refresh() will pick it up
+
+        total_tokens, title, message_count = row
+        new_tokens = count_tokens(messages[message_count:])
+        mtime_ns, size = self.file_state(signature)
+        updated_at = mtime_ns / 1e9
+        with self.lock:
+            self.connection.execute(
+                "UPDATE conversations SET mtime_ns = ?, size = ?, message_count = ?, total_tokens = ?, title = ?, updated_at = ? "
+                "WHERE filename = ?",
+                (mtime_ns, size, len(messages), total_tokens + new_tokens, title or self.title_for(messages), updated_at, filename),
+            )
+            self.connection.commit()
+        return True
+
+    def refresh(self, directory, store, count_tokens):
+        """Brings the index up to date with the conversation files in a directory. Only files whose mtime or size changed are read.
+
+        Args:
+            directory (str): The data directory holding the conversation files.
+            store (ConversationStore): Used to read changed conversations and to get file signatures.
+            count_tokens (callable): Returns the total number of tokens of a conversation: count_tokens(filename, messages). """
+
+        with self.lock:
+            indexed = {filename: (mtime_ns, size) for filename, mtime_ns, size
+                       in self.connect().execute("SELECT filename, mtime_ns, size FROM conversations")}
+
+        present = set()
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            filename = store.canonical_path(os.path.join(directory, entry.name)) # the key used everywhere for the file
+            present.add(filename)
+
+            signature = store.signature(filename)
+            if signature[0] is None or indexed.get(filename) == self.file_state(signature):
+                continue
+            try:
+                messages = store.load(filename, cache=False) # indexing does not keep every conversation in memory
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable conversation {filename} while indexing: {e}")
+                continue
+            self.record(filename, messages, signature, count_tokens(filename, messages))
+
+        removed = [filename for filename in indexed if filename not in present]
+        if removed:
+            with self.lock:
+                self.connection.executemany("DELETE FROM conversations WHERE filename = ?", [(filename,) for filename in removed])
+                self.connection.commit()
+
+    def list(self, sort_by="updated_at", descending=True):
+        """Returns the indexed conversations, sorted.
+
+        Args:
+            sort_by (str): One of SORT_COLUMNS.
+            descending (bool): Sort order.
+
+        Returns:
+            list: Tuples of (filename, message_count, total_tokens, title, updated_at). """
+
+        if sort_by not in self.SORT_COLUMNS:
+            raise ValueError(f"Cannot sort conversations by '{sort_by}'.")
+        order = "DESC" if descending else "ASC"
+        with self.lock:
+            return self.connect().execute(
+                f"SELECT filename, message_count, total_tokens, title, updated_at FROM conversations ORDER BY {sort_by} {order}"
+            ).fetchall()
+
+    def rename(self, old_filename, new_filename):
+        """Moves the row of a renamed conversation."""
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM conversations WHERE filename = ?", (new_filename,))
+            connection.execute("UPDATE conversations SET filename = ? WHERE filename = ?", (new_filename, old_filename))
+            connection.commit()
+
+    def remove(self, filename):
+        """Removes the row of a deleted conversation."""
+        with self.lock:
+            connection = self.connect()
+            connection.execute("DELETE FROM conversations WHERE filename = ?", (filename,))
+            connection.commit()
@@ -1,6 +1,19 @@
-import logging, json, tiktoken, os, time
-from openai import OpenAI, APIConnectionError, AuthenticationError
+import copy, logging, os, threading, time
 from configuration import ConfigManager
+from token_counter import TokenCounter
+from tokenizer_service import TokenizerService
+from conversation_store import ConversationStore
+from message_store import MessageStore
+from response_cache import ResponseCache
+from summarizer import ConversationSummarizer
+from trimming import TokenPrefixIndex
+from conversation_index import ConversationIndex
+from search_index import SearchIndex
+from prompt_library import PromptLibrary
+from pricing import ModelPricing
+from rate_limiter import RateLimiter
+from metrics import Metrics
+from profiler import Profiler
 
 class ConversationLogic:
     def __init__(self, config_manager):
@@ -12,9 +25,11 @@ class ConversationLogic:
         self.config=self.config_manager.config # set default config 
         self.directory = os.path.join("data", "")
 
-        # starts an instance of OpenAI's API client using the api key
+        # OpenAI's API client uses the api key. It is created on first use or by warm_up(), so loading the openai package does not delay startup
         self.api_key=self.config.get('OPENAI_API_KEY', 'YOUR_DEFAULT_API_KEY_HERE')
-        self.client = OpenAI(api_key=self.api_key) 
+        self.client_lock = threading.Lock()
+        self.client = None
+        self.ready = threading.Event() # set once warm_up() has loaded the client and the tokenizer
 
         # sets the filename given from the configs. This will initially be conversation.json in data/
         self.filename=self.config.get('filename', os.path.join('data', 'conversation.json')) 
@@ -23,16 +38,125 @@ class ConversationLogic:
         self.user_message = self.config.get('user_message','What can you help me with today?') 
         self.assistant_message = self.config.get('assistant_message', 'Hi, how can I help you today?')
         self.max_tokens = self.config.get('max_tokens', 750)
+        self.stream = self.config.get('stream', True) # stream responses chunk by chunk to the GUI
+
+        # counters and histograms of the hot path (latencies, bytes, tokens, errors). The optional 'metrics_export' config is a path prefix:
+        # after every call the metrics are written to <prefix>.json and <prefix>.prom (Prometheus text format)
+        self.metrics = Metrics()
+        self.metrics_path = self.config.get('metrics_export')
+
+        # opt-in profiling of the phases of a turn. The 'profile' config ("spans" or "cprofile", or the GPT_APP_PROFILE environment variable)
+        # writes collapsed-stack files for flame graphs to data/profiles/
+        self.profiler = Profiler(self.config.get('profile'), os.path.join(self.directory, 'profiles'))
+
+        # per-message token counts are memoized (and saved next to each conversation), so only new messages are tokenized each turn.
+        # New messages are encoded in batches, large batches on a thread pool (the optional 'tokenizer_workers' config sets its size)
+        self.tokenizer = TokenizerService(workers=self.config.get('tokenizer_workers'))
+        self.token_counter = TokenCounter(self.tokenizer)
+        self.prefix_indexes = {} # (canonical path, model) -> TokenPrefixIndex, cumulative token counts used by trimming
+        self.trim_lock = threading.Lock() # the prefix indexes are shared with the GUI's cost estimate, which runs on another thread
+
+        # conversations are kept in memory and turns are appended to a log, instead of rewriting the whole file each turn.
+        # The optional 'storage_format' config ("json" or "compact") is the snapshot format of new conversations. Turns are written
+        # and synced in the background every 'flush_interval' seconds (0 writes each turn before returning), and on exit.
+        # With the opt-in 'deduplicate_messages' config, snapshots in data/ refer to their messages by hash, each unique message body being
+        # stored once in data/messages.sqlite3. The message store is also opened when the option was turned off, to read the files
+        # that still hold references (they are written inline again on their next rewrite, or all at once by main.py --inline)
+        self.deduplicate = self.config.get('deduplicate_messages', False)
+        message_store_path = os.path.join(self.directory, 'messages.sqlite3')
+        message_store = None
+        if self.deduplicate or os.path.exists(message_store_path):
+            message_store = MessageStore(message_store_path)
+        self.store = ConversationStore(metrics=self.metrics, snapshot_format=self.config.get('storage_format', 'json'),
+                                       flush_interval=self.config.get('flush_interval', 1.0), message_store=message_store,
+                                       deduplicate=self.deduplicate)
+
+        # metadata of every conversation in data/ (message count, tokens, ...), so the history list does not open every file
+        self.index = ConversationIndex(os.path.join(self.directory, 'index.sqlite3'))
+        self.store.add_flush_listener(self.on_conversation_flushed)
+
+        # full-text index of every message in data/, updated as turns are saved
+        self.search_index = SearchIndex(os.path.join(self.directory, 'search.sqlite3'))
+
+        # prompt templates of the GUI's prompt buttons (data/prompts.json), the token counts of their text are precomputed per model
+        self.prompts = PromptLibrary(os.path.join(self.directory, 'prompts.json'), self.tokenizer)
+
+        # optional cache of responses to repeated requests (same model, trimmed messages and max_tokens)
+        self.use_response_cache = self.config.get('response_cache', False)
+        self.response_cache = ResponseCache(max_disk_bytes=self.config.get('response_cache_max_mb', 50) * 1024 * 1024)
+        self.cache_status = "off"
+
+        # optional rolling summary that replaces the messages dropped by trimming (stored next to each conversation)
+        self.summarize_history = self.config.get('summarize', False)
+        self.summarizer = ConversationSummarizer(self.token_counter, summary_max_tokens=self.config.get('summary_max_tokens', 300))
+
+        # paces the completions calls within the per-model rate limits and retries throttled calls, the optional 'rate_limits' config
+        # ({model: [requests per minute, tokens per minute]}) overrides the default limits
+        self.rate_limiter = RateLimiter(self.config.get('rate_limits'), max_retries=self.config.get('max_retries', 3), metrics=self.metrics)
+
+        # model prices used by the token cost calculator, the optional 'pricing' config overrides them ({model: [input, output]} per 1K tokens)
+        self.pricing = ModelPricing(self.config.get('pricing'))
+
+    def create_client(self, api_key):
+        """Creates the OpenAI API client used for completions. Subclasses override this to use a different client.
+        The optional 'OPENAI_BASE_URL' config points the client at another server (for example the local mock server used by the benchmarks). """
+        from openai import OpenAI # imported on first use, loading the package takes a few hundred milliseconds
+        return OpenAI(api_key=api_key, base_url=self.config.get('OPENAI_BASE_URL'), max_retries=0) # retries are done by the rate limiter
+
+    @property
+    def client(self):
+        """The OpenAI API client, created with the configured api key the first time it is needed."""
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    self._client = self.create_client(self.api_key)
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def warm_up(self):
+        """Loads the slow dependencies: the OpenAI client and the tokenizer of the configured model. Run in the background at startup
+        (see start_warm_up()), so neither the window nor the first call has to wait for them. Sets self.ready when done. """
+        try:
+            self.client
+            self.token_counter.get_encoding(self.model)
+            self.prompts.precompute(self.model)
+        except Exception as e: # a failed warm-up is retried on first use, where the error is reported as usual
+            logging.warning(f"Warm-up failed: {e}")
+        finally:
+            self.ready.set()
+
+    def start_warm_up(self):
+        """Starts warm_up() on a background thread and returns the thread."""
+        thread = threading.Thread(target=self.warm_up, daemon=True)
+        thread.start()
+        return thread
+
+    def for_conversation(self, filename):
+        """Returns a ConversationLogic for another conversation file. It shares this instance's configs, API client, token counter
+        and conversation store, but keeps its own filename and usage information, so several conversations can run side by side.
+
+        Args:
+            filename (str): The path to the conversation JSON file (must be within data/). """
+
+        self.client # created before copying, so every copy shares the same client
+        logic = copy.copy(self)
+        logic.set_filename(filename)
+        return logic
 
     def setup_logging(self):
         """ Logging config for ConversationLogic"""
         logging.getLogger(__name__).info("Conversation logic logging setup.")
         # add logging configs as needed 
 
-    def chat_gpt(self, user_input):
+    @Profiler.profiled("chat_gpt")
+    def chat_gpt(self, user_input, use_cache=True):
         """Performs the API call, and inputs the given user input from the GUI to perform the call.
         Args:
             user_input (str): The user's input for the conversation, from the gui input.
+            use_cache (bool): Set to False to bypass the response cache for this call (the fresh response is still cached).
 
         Returns:
             Tuple[str, None or str]: A tuple containing the GPT response and any potential error message. The second element is None if there are no errors.
@@ -63,44 +187,31 @@ class ConversationLogic:
             }  
         """
 
-        messages = self.load_conversation().get('messages', []) 
-        new_input_tokens = self.count_tokens_in_messages([{"role": "user", "content": user_input}]) # calculates the ~amount of input tokens prior to the API call
-        remaining_tokens = self.max_tokens - new_input_tokens # This is a prompt safeguard that handles (all) large user inputs. If the user's prompt is large, the conversation is truncated more harshly to fit within the token limit. This helps reduce costs slightly, at the cost of reducing prior context for the GPT. 
-        print(f"\n~ input tokens: {new_input_tokens} ~ remaining tokens: {remaining_tokens}")
+        from openai import APIConnectionError, APIStatusError, AuthenticationError
+        request_start = time.perf_counter()
+        messages = self.prepare_messages(user_input) # loads, trims and appends the user input to the conversation
 
-        messages = self.trim_conversation_history(messages, remaining_tokens) # Performs the conversation truncation, sends in conversation and the tokens left to use. This new message holds what the api call can handle, and omits the oldest message according to the tokens allowed
-        messages.append({"role": "user", "content": user_input }) # appends the newest message to the conversation
-        # IMPORTANT: Due to the trim function, chatGPT may lose context of the system message and early context. In the future, introduce better truncation methods (such as summation) 
+        cache_key, cached_response = self.lookup_cached_response(messages, use_cache)
+        if cached_response is not None: # the same request was answered before, no API call is needed
+            self.log_api_call("Total Time: 0.00s")
+            self.update_conversation(user_input, cached_response)
+            return cached_response, None
 
         try:
-            response = self.client.chat.completions.create( # This is the client API call to OpenAI
-                model=self.model, # inputs current model type 
+            start_time = time.perf_counter()
+            response = self.create_completion( # This is the client API call to OpenAI, paced by the rate limiter
                 messages=messages, # inputs the given conversation (truncated)
                 max_tokens=self.max_tokens, # a "limiter" that helps truncate conversations
             )
+            total_time = time.perf_counter() - start_time
 
-            # These are return statements from the API (look at documentation for more info). These are helpful for logging and debugging. 
-            self.total_tokens_used = response.usage.total_tokens
-            self.input_tokens = response.usage.prompt_tokens
-            self.response_tokens = response.usage.completion_tokens
-            self.model_type = response.model
-            self.stop_reason = response.choices[0].finish_reason
-            
-            # Log API and ChatGPT Information 
-            api_log = (
-                f"Total tokens used: {self.total_tokens_used} | "
-                f"Total tokens allowed: {self.max_tokens} | " 
-                f"Total Input: {self.input_tokens} | "
-                f"Total Response: {self.response_tokens}\n"
-                f"Model Used: {self.model_type} | "
-                f"API Stop Reason: {self.stop_reason} | "
-                f"Current Json File: {self.filename}"
-            )
-            logging.info(api_log)
-            print(api_log)
+            self.record_usage(response) # usage information returned by the API, helpful for logging and debugging
+            self.log_api_call(f"Total Time: {total_time:.2f}s") # Log API and ChatGPT Information 
             
             response = response.choices[0].message.content # this is the API call to get the latest gpt response 
+            self.store_cached_response(cache_key, response)
             self.update_conversation(user_input, response) # updates the conversation with the latest input and response
+            self.record_call_metrics(time.perf_counter() - request_start, total_time)
 
             return response, None # response is returned to display in gui, None is returned to signal no errors. 
         except AuthenticationError as auth_error:
@@ -109,6 +220,268 @@ class ConversationLogic:
         except APIConnectionError as conn_error:
             logging.error(f"API connection error: {conn_error}")
             return None, (str(conn_error))
+        except APIStatusError as api_error: # rate limits and server errors that were still failing after the retries
+            logging.error(f"API error: {api_error}")
+            return None, (str(api_error))
+
+    @Profiler.profiled("chat_gpt_stream")
+    def chat_gpt_stream(self, user_input, use_cache=True):
+        """Streaming variant of chat_gpt(). Performs the API call with stream=True and yields the response as it arrives.
+        Args:
+            user_input (str): The user's input for the conversation, from the gui input.
+            use_cache (bool): Set to False to bypass the response cache for this call.
+
+        Yields:
+            Tuple[str, None or str]: (chunk, None) for each piece of the response, or (None, error message) if the call fails.
+
+        The finished response is saved to the conversation once, after the last chunk. Streamed responses do not include a usage block,
+        so token usage is counted locally. Time to first token and total time are recorded in the api log. """
+
+        from openai import APIConnectionError, APIStatusError, AuthenticationError
+        request_start = time.perf_counter()
+        messages = self.prepare_messages(user_input)
+        cache_key, cached_response = self.lookup_cached_response(messages, use_cache)
+        if cached_response is not None: # a cached response is returned as a single chunk
+            self.log_api_call("Time to First Token: 0.00s | Total Time: 0.00s")
+            yield cached_response, None
+            self.update_conversation(user_input, cached_response)
+            return
+
+        chunks = []
+        first_token_time = None
+        self.model_type = self.model
+        self.stop_reason = None
+
+        try:
+            start_time = time.perf_counter()
+            stream = self.create_completion(
+                messages=messages,
+                max_tokens=self.max_tokens,
+                stream=True, # the response is returned as a series of chunks (server-sent events)
+            )
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    self.model_type = chunk.model
+                    if chunk.choices[0].finish_reason:
+                        self.stop_reason = chunk.choices[0].finish_reason
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter() - start_time
+                        chunks.append(content)
+                        yield content, None
+            finally:
+                stream.response.close() # releases the connection, even if the caller stops reading early
+        except AuthenticationError as auth_error:
+            logging.error(f"Authentication error: {auth_error}")
+            yield None, (str(auth_error))
+            return
+        except APIConnectionError as conn_error:
+            logging.error(f"API connection error: {conn_error}")
+            yield None, (str(conn_error))
+            return
+        except APIStatusError as api_error: # rate limits and server errors that were still failing after the retries
+            logging.error(f"API error: {api_error}")
+            yield None, (str(api_error))
+            return
+
+        total_time = time.perf_counter() - start_time
+        response = "".join(chunks)
+
+        self.record_stream_usage(messages, response)
+        first_token_text = f"{first_token_time:.2f}s" if first_token_time is not None else "n/a"
+        self.log_api_call(f"Time to First Token: {first_token_text} | Total Time: {total_time:.2f}s")
+
+        self.store_cached_response(cache_key, response)
+        self.update_conversation(user_input, response) # the finished message is saved once, at the end of the stream
+        self.record_call_metrics(time.perf_counter() - request_start, total_time, first_token_time)
+
+    def prepare_messages(self, user_input):
+        """Builds the message list sent to the API: the loaded conversation, trimmed to fit the token limit, followed by the user input.
+        Args:
+            user_input (str): The user's input for the conversation.
+
+        Returns:
+            list: The (truncated) conversation with the newest user message appended. """
+
+        with self.metrics.timer("gpt_phase_seconds", phase="load"):
+            messages = self.load_conversation().get('messages', []) 
+        with self.metrics.timer("gpt_phase_seconds", phase="tokenize"):
+            new_input_tokens = self.count_tokens_in_messages([{"role": "user", "content": user_input}]) # calculates the ~amount of input tokens prior to the API call
+        remaining_tokens = self.max_tokens - new_input_tokens # This is a prompt safeguard that handles (all) large user inputs. If the user's prompt is large, the conversation is truncated more harshly to fit within the token limit. This helps reduce costs slightly, at the cost of reducing prior context for the GPT. 
+        print(f"\n~ input tokens: {new_input_tokens} ~ remaining tokens: {remaining_tokens}")
+
+        with self.metrics.timer("gpt_phase_seconds", phase="trim"):
+            trimmed_messages = self.trim_conversation_history(messages, remaining_tokens) # Performs the conversation truncation, sends in conversation and the tokens left to use. This new message holds what the api call can handle, and omits the oldest messages (but never the system message) according to the tokens allowed
+        if self.summarize_history and len(trimmed_messages) < len(messages):
+            trimmed_messages = self.compact_history(messages, remaining_tokens) # the dropped messages are replaced by the rolling summary
+        trimmed_messages.append({"role": "user", "content": user_input }) # appends the newest message to the conversation
+        return trimmed_messages
+
+    def compact_history(self, messages, remaining_tokens):
+        """Trims the conversation and replaces the dropped messages with the conversation's rolling summary. The summary is only updated
+        (one summarization call) when messages that it does not cover yet fall out of the window.
+        Args:
+            messages (list): The full list of messages in the conversation.
+            remaining_tokens (int): The maximum number of tokens allowed within the conversation.
+
+        Returns:
+            list: The system message with the summary added to it, followed by the newest messages that fit within the token limit. """
+
+        # Room is reserved for the summary, so the prompt stays within the limit when the summary grows
+        summary_reserve = self.summarizer.summary_max_tokens + 16
+        pinned, cut = self.find_trim_cut(messages, remaining_tokens - summary_reserve)
+
+        try:
+            summary = self.summarizer.compact(self.filename, messages, cut, self.model, self.request_summary, first=len(pinned))
+        except Exception: # an unreadable summary or any other failure of the optional summary never fails the turn
+            logging.exception(f"Summarizing {self.filename} failed, falling back to plain trimming")
+            summary = None
+        if summary is None:
+            return pinned + messages[cut:]
+        start = max(cut, summary["covered"]) # messages folded ahead of the cut are already part of the summary
+        return [self.summarizer.system_message(pinned, summary)] + messages[start:] # one system message, holding the summary
+
+    def request_summary(self, summary_messages, max_tokens):
+        """Sends a summarization request with the current model and returns the summary text."""
+        response = self.create_completion(messages=summary_messages, max_tokens=max_tokens)
+        return response.choices[0].message.content
+
+    @Profiler.profiled("create_completion")
+    def create_completion(self, messages, max_tokens, **kwargs):
+        """Sends a chat completions request with the current model through the rate limiter, which paces it within the model's
+        requests/tokens per minute limits and retries it on rate limit, server and connection errors.
+        Args:
+            messages (list): The messages to send.
+            max_tokens (int): The maximum number of tokens in the response.
+            **kwargs: Other arguments of the completions call (for example stream=True).
+
+        Returns:
+            The completions response (or stream). """
+
+        tokens = self.count_tokens_in_messages(messages) + max_tokens # what the call counts against the tokens per minute limit
+        try:
+            return self.rate_limiter.call(self.model, tokens, lambda: self.client.chat.completions.create(
+                model=self.model, messages=messages, max_tokens=max_tokens, **kwargs))
+        except Exception as e:
+            self.metrics.increment("gpt_errors_total", model=self.model, type=type(e).__name__)
+            self.export_metrics()
+            raise
+
+    def record_call_metrics(self, request_time, api_time, first_token_time=None):
+        """Records the latency and token usage of a finished call, and exports the metrics if enabled.
+        Args:
+            request_time (float): The time of the whole turn, from the user input to the saved response, in seconds.
+            api_time (float): The time spent in the completions call (reading the whole stream for streamed calls), in seconds.
+            first_token_time (float): The time to the first streamed token, in seconds. """
+
+        model = self.model
+        self.metrics.increment("gpt_requests_total", model=model, stream=str(first_token_time is not None).lower())
+        self.metrics.observe("gpt_request_seconds", request_time, model=model)
+        self.metrics.observe("gpt_api_seconds", api_time, model=model)
+        self.metrics.observe("gpt_local_seconds", request_time - api_time, model=model) # overhead of the app itself
+        if first_token_time is not None:
+            self.metrics.observe("gpt_first_token_seconds", first_token_time, model=model)
+        self.metrics.increment("gpt_tokens_total", self.input_tokens, model=model, kind="prompt")
+        self.metrics.increment("gpt_tokens_total", self.response_tokens, model=model, kind="completion")
+        self.export_metrics()
+
+    def export_metrics(self):
+        """Writes the metrics to the 'metrics_export' files, if the config sets them."""
+        if not self.metrics_path:
+            return
+        try:
+            self.metrics.export(self.metrics_path)
+        except OSError as e:
+            logging.warning(f"Could not export metrics to {self.metrics_path}: {e}")
+
+    def lookup_cached_response(self, messages, use_cache=True):
+        """Looks up the response cache for the request about to be sent. On a hit, the cached usage information is restored.
+        Args:
+            messages (list): The (trimmed) messages of the request.
+            use_cache (bool): False skips the lookup (the response of the call is still cached).
+
+        Returns:
+            Tuple[str or None, str or None]: The cache key (None when the cache is disabled) and the cached response (None on a miss). """
+
+        if not self.use_response_cache:
+            self.cache_status = "off"
+            return None, None
+
+        cache_key = ResponseCache.make_key(self.model, messages, self.max_tokens)
+        if not use_cache:
+            self.cache_status = "bypass"
+            return cache_key, None
+
+        entry = self.response_cache.get(cache_key)
+        if entry is None:
+            self.cache_status = "miss"
+            self.metrics.increment("gpt_response_cache_total", status="miss")
+            return cache_key, None
+
+        self.cache_status = "hit"
+        self.metrics.increment("gpt_response_cache_total", status="hit")
+        self.export_metrics()
+        self.total_tokens_used = entry["usage"]["total_tokens"]
+        self.input_tokens = entry["usage"]["prompt_tokens"]
+        self.response_tokens = entry["usage"]["completion_tokens"]
+        self.model_type = entry["model"]
+        self.stop_reason = entry["stop_reason"]
+        return cache_key, entry["content"]
+
+    def store_cached_response(self, cache_key, response):
+        """Caches a response with the usage information of the latest call. Does nothing if the cache is disabled."""
+        if cache_key is None:
+            return
+        self.response_cache.put(cache_key, {
+            "content": response,
+            "model": self.model_type,
+            "stop_reason": self.stop_reason,
+            "usage": {
+                "total_tokens": self.total_tokens_used,
+                "prompt_tokens": self.input_tokens,
+                "completion_tokens": self.response_tokens,
+            },
+        })
+
+    def record_usage(self, response):
+        """Stores the usage information of a (non-streamed) API response."""
+
+        # These are return statements from the API (look at documentation for more info). These are helpful for logging and debugging. 
+        self.total_tokens_used = response.usage.total_tokens
+        self.input_tokens = response.usage.prompt_tokens
+        self.response_tokens = response.usage.completion_tokens
+        self.model_type = response.model
+        self.stop_reason = response.choices[0].finish_reason
+
+    def record_stream_usage(self, messages, response):
+        """Stores the usage information of a streamed response. Streamed responses do not include a usage block, so the tokens are counted locally.
+        The prompt is already counted (and cached) by the trimming step. """
+
+        self.input_tokens = self.count_tokens_in_messages(messages)
+        self.response_tokens = self.tokenizer.count_text(response, self.model)
+        self.total_tokens_used = self.input_tokens + self.response_tokens
+
+    def log_api_call(self, timing_info):
+        """Logs the API and ChatGPT information of the latest call.
+        Args:
+            timing_info (str): Timing details of the call, appended to the log line. """
+
+        api_log = (
+            f"Total tokens used: {self.total_tokens_used} | "
+            f"Total tokens allowed: {self.max_tokens} | " 
+            f"Total Input: {self.input_tokens} | "
+            f"Total Response: {self.response_tokens}\n"
+            f"Model Used: {self.model_type} | "
+            f"API Stop Reason: {self.stop_reason} | "
+            f"Current Json File: {self.filename} | "
+            f"Response Cache: {self.cache_status} | "
+            f"{timing_info}"
+        )
+        logging.info(api_log)
+        print(api_log)
         
     def set_filename(self, new_filename):
         """ Method used to set/change filenames. Error handling ensures
@@ -131,7 +504,13 @@ class ConversationLogic:
     
         # Try renaming the file
         try:
-            os.rename(old_filename, new_filename)
+            self.store.rename(old_filename, new_filename)
+            self.invalidate_prefix_indexes(old_filename)
+            self.invalidate_prefix_indexes(new_filename)
+            self.token_counter.rename_sidecar(old_filename, new_filename)
+            self.summarizer.rename_sidecar(old_filename, new_filename)
+            self.index.rename(self.index_key(old_filename), self.index_key(new_filename))
+            self.search_index.rename(self.index_key(old_filename), self.index_key(new_filename))
         except OSError as e:
             logging.error(f"Error: {e}")
             raise ValueError(f"There was an error renaming the file: {e}")
@@ -171,25 +550,73 @@ class ConversationLogic:
     
     def get_conversation_files(self):
         # Retrieves all current conversation files in the data/ directory and holds its as a list.
-        convo_files = [f for f in os.listdir(self.directory) if f.endswith('.json')]
+        convo_files = [os.path.basename(row[0]) for row in self.list_conversations(sort_by="filename", descending=False)]
         return convo_files
 
-    def load_conversation(self, filename=None): 
+    def list_conversations(self, sort_by="updated_at", descending=True):
+        """Lists the conversations in the data/ directory with their metadata, from the conversation index.
+        The index is refreshed first, which only re-reads files whose mtime or size changed.
+
+        Args:
+            sort_by (str): "filename", "message_count", "total_tokens" or "updated_at".
+            descending (bool): Sort order.
+
+        Returns:
+            list: Tuples of (filename, message_count, total_tokens, title, updated_at). """
+
+        self.index.refresh(self.directory, self.store, self.count_conversation_tokens)
+        return self.index.list(sort_by, descending)
+
+    def search_conversations(self, query, limit=50):
+        """Searches the messages of every conversation in the data/ directory.
+        The search index is refreshed first, which only re-reads files whose mtime or size changed.
+
+        Args:
+            query (str): Terms and "quoted phrases". Every one of them must match, a trailing * matches a prefix.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: Tuples of (filename, position, role, snippet), best matches first. """
+
+        with self.metrics.timer("gpt_search_seconds"):
+            self.search_index.refresh(self.directory, self.store)
+            return self.search_index.search(query, limit)
+
+    def count_conversation_tokens(self, filename, messages):
+        """Returns the total number of tokens in a conversation, reusing the counts saved next to it."""
+        self.token_counter.load_sidecar(filename)
+        return self.token_counter.count(messages, self.model)
+
+    def index_key(self, filename):
+        """Returns the conversation and search index key of a file (its canonical path, see ConversationStore.canonical_path()),
+        or None if the file is not directly in the data/ directory. """
+        key = ConversationStore.canonical_path(filename)
+        if os.path.dirname(key) != os.path.abspath(self.directory):
+            return None
+        return key
+
+    @Profiler.profiled("load_conversation")
+    def load_conversation(self, filename=None, tail=None): 
         """Attempts to load the conversation from a given .json file 
         Args:
             filename (str, optional): The path to the conversation JSON file. Defaults to None.
+            tail (int, optional): Only load the last messages. Compact files then only decompress the blocks holding them.
 
         Returns:
-            dict: The loaded conversation data held as a dictionary. """
+            dict: The loaded conversation data held as a dictionary. With tail, "message_count" holds the full length. """
 
         if filename is None:
             filename = self.filename # if there is no file found, it is given the configured path. Its default value is data\conversation.json 
 
         try:
-            with open(filename, 'r') as file: 
-                loaded_conversation = json.load(file) 
-                self.set_filename(filename)  # Update the filepath if a different file is loaded (uses setter method)
-                return loaded_conversation
+            if tail is not None:
+                messages, message_count = self.store.load_tail(filename, tail)
+                self.set_filename(filename)
+                return {"messages": messages, "message_count": message_count}
+            messages = self.store.load(filename) # parses the file (and its append log) only if it changed since the last load
+            self.token_counter.load_sidecar(filename) # reuse token counts saved by a previous session
+            self.set_filename(filename)  # Update the filepath if a different file is loaded (uses setter method)
+            return {"messages": messages} # the store returns a copy
         except FileNotFoundError as e:  
             logging.error(f"File not found error: {e}")
             raise FileNotFoundError(f"Conversation file not found: {filename}") from e
@@ -197,6 +624,7 @@ class ConversationLogic:
             logging.error(f"Error while loading conversation: {e}")
             raise RuntimeError(f"Error loading conversation from file: {filename}") from e 
 
+    @Profiler.profiled("update_conversation")
     def update_conversation(self, user_input, gpt_response):
         """Update the conversation state with the latest user input and GPT response.
 
@@ -204,23 +632,64 @@ class ConversationLogic:
             user_input (str): The user's input.
             gpt_response (str): The GPT response.
         """
-        messages = self.load_conversation().get('messages', [])
+        new_messages = [
+            {"role": "user", "content": user_input},
+            {"role": "assistant", "content": gpt_response}
+        ]
 
-        # Update with new information
-        messages.append({"role": "user", "content": user_input})
-        messages.append({"role": "assistant", "content": gpt_response})
+        with self.metrics.timer("gpt_phase_seconds", phase="save"):
+            # Append only the new pair to the conversation, in memory. The store writes it to the log in the background,
+            # then on_conversation_flushed() saves the token counts and updates the indexes
+            self.store.append(self.filename, new_messages)
 
-        # Save the updated state
-        self.save_conversation_to_file(self.filename, messages)
+    def on_conversation_flushed(self, filename, signature, message_count):
+        """Called by the store once the pending messages of a conversation are on disk (on the store's flush thread).
+        The conversation and search indexes are only updated here, with the messages that were written, so a crash
+        never leaves index rows for messages that are not in the file.
+
+        Args:
+            filename (str): The canonical path of the conversation file.
+            signature (tuple): The store signature of the file after the write.
+            message_count (int): The number of messages on disk. """
+
+        try:
+            messages = self.store.load(filename)[:message_count]
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read {filename} after writing it: {e}")
+            return
+        try:
+            self.token_counter.save_sidecar(filename, messages) # persist token counts so a reload does not retokenize the history
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not save the token counts of {filename}: {e}")
 
+        # Update the conversation's rows in the indexes incrementally
+        index_key = self.index_key(filename)
+        if index_key is not None:
+            self.index.record_append(index_key, messages, signature, lambda new_messages: self.token_counter.count(new_messages, self.model))
+            self.search_index.add_messages(index_key, messages, signature)
+
+    def flush(self):
+        """Writes every conversation turn that is still only in memory to disk. Called on exit."""
+        self.store.flush()
+
+    @Profiler.profiled("save_conversation_to_file")
     def save_conversation_to_file(self, filename, messages): 
-        """Save the conversation to a JSON file.
+        """Save the conversation to a JSON file. This writes a full snapshot in the {"messages": [...]} format (and clears the file's append log).
+        The snapshot is written to a temporary file and renamed over the old one, so a crash never leaves a truncated conversation.
+        With deduplicate_messages, files in data/ refer to their messages in the message store; files saved elsewhere always hold
+        the messages themselves.
         Args:
             filename (str): The path to save the conversation JSON file.
             messages (list): The list of messages to be saved. """
 
-        with open(filename, 'w') as file:
-            json.dump({"messages": messages}, file)
+        index_key = self.index_key(filename)
+        self.store.save(filename, messages, by_reference=self.deduplicate and index_key is not None)
+        self.invalidate_prefix_indexes(filename)
+
+        if index_key is not None:
+            signature = self.store.signature(filename)
+            self.index.record(index_key, messages, signature, self.count_conversation_tokens(filename, messages))
+            self.search_index.index_conversation(index_key, messages, signature)
 
     def remove_conversation_from_file(self, filename):
         """ Remove the selected JSON file from data directory"""
@@ -234,10 +703,15 @@ class ConversationLogic:
                 if filename == os.path.join('data', 'conversation.json'):
                     print("Cannot Delete Conversation File")
                 # Check if the file being deleted is the currently loaded conversation
-                if filename == self.filename:
+                if ConversationStore.canonical_path(filename) == ConversationStore.canonical_path(self.filename):
                     self.set_filename(self.config.get('filename')) # Reset to the base conversation.json
                 conversation = self.load_conversation() 
-                os.remove(filename)
+                self.store.remove(filename)
+                self.invalidate_prefix_indexes(filename)
+                self.token_counter.remove_sidecar(filename)
+                self.summarizer.remove_sidecar(filename)
+                self.index.remove(self.index_key(filename))
+                self.search_index.remove(self.index_key(filename))
                 return conversation # return current conversation state 
         except FileNotFoundError:  
             print(f"Conversation file not found.")
@@ -256,6 +730,7 @@ class ConversationLogic:
         curr_conv = self.load_conversation(self.filename)
         return curr_conv
 
+    @Profiler.profiled("count_tokens")
     def count_tokens_in_messages(self, messages):
         """Count the number of tokens in a list of messages. This method is provided by tiktoken (import)
         Args:
@@ -266,28 +741,14 @@ class ConversationLogic:
             int: The total number of tokens in the given messages. """
         
         model = self.model # change this value to test specific model costs 
+
+        num_tokens = self.token_counter.count(messages, model) # cached per message and model, only new messages are encoded (in one batch)
+        num_tokens += 2  # Every reply is primed with <im_start>assistant
+        return num_tokens
         
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("cl100k_base")
-
-        if model == model: # change model type here if testing a specific model 
-            num_tokens = 0
-            for message in messages:
-                num_tokens += 4  # Every message follows <im_start>{role/name}\n{content}<im_end>\n
-                for key, value in message.items():
-                    num_tokens += len(encoding.encode(value))
-                    if key == "name":  # If there's a name, the role is omitted
-                        num_tokens += -1  # Role is always required and always 1 token
-            num_tokens += 2  # Every reply is primed with <im_start>assistant
-            return num_tokens
-        else:
-            raise NotImplementedError(f"""count_tokens_in_messages() is not presently implemented for model {model}.
-    See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
-        
+    @Profiler.profiled("trim_conversation_history")
     def trim_conversation_history(self, messages, remaining_tokens):
-        """Trims the last message to fit within the maximum token limit if token limit is hit.
+        """Trims the oldest messages to fit within the maximum token limit if token limit is hit. The system message is always kept.
 
         Args:
             messages (list): List of messages in the conversation.
@@ -295,18 +756,81 @@ class ConversationLogic:
 
         Returns:
             list: The trimmed list of messages that fits within the token limit. """
-        tokens_used = 0 # initial token amount
-        truncated_messages = [] # new list to hold conversation 
- 
-        for message in reversed(messages): # REVERSES order of reading messages, looking at the newest information in the conversation first. (appends newest -> oldest in the conversation)
-            message_tokens = self.count_tokens_in_messages([message]) # calculates the current ~amount of tokens in the current message, using the model type (different amount of token costs)
-            if tokens_used + message_tokens <= remaining_tokens: # if the tokens used (tokens in the conversation that accumulate during the loop) + the amount of the current message is less than the max_tokens allowed by the api call, that message is added to this conversation
-                truncated_messages.insert(0, message) #inserts the newest message to the new conversation list 
-                tokens_used += message_tokens # increases the tokens used (in the conversation) per message added to the list (Reversed)
-            else:
-                break # stops adding messages if the next message were to exceed the token limit provided
 
-        return truncated_messages
+        pinned, cut = self.find_trim_cut(messages, remaining_tokens)
+        return pinned + messages[cut:]
+
+    def find_trim_cut(self, messages, remaining_tokens):
+        """Finds where the conversation is cut by trimming. Cumulative token counts (prefix sums) are kept per conversation and extended
+        as messages are appended, so the cut point is found with a binary search instead of walking the history.
+
+        Args:
+            messages (list): List of messages in the conversation.
+            remaining_tokens (int): The maximum number of tokens allowed within the conversation.
+
+        Returns:
+            Tuple[list, int]: The pinned messages (the system message, if the conversation starts with one) and the index of the
+            first message kept after them. """
+
+        with self.trim_lock:
+            index = self.prefix_indexes.setdefault((ConversationStore.canonical_path(self.filename), self.model), TokenPrefixIndex())
+            index.sync(messages, lambda new_messages: self.token_counter.count_each(new_messages, self.model), self.token_counter.digest,
+                       self.store.generation(self.filename))
+
+            # The system message is pinned: it is always sent, and its tokens are taken out of the budget first
+            pinned = messages[:1] if messages and messages[0].get("role") == "system" else []
+            budget = remaining_tokens - index.tokens(0, len(pinned)) - 2 # Every reply is primed with <im_start>assistant
+
+            return pinned, index.cut_index(len(pinned), len(messages), budget)
+
+    def invalidate_prefix_indexes(self, filename):
+        """Drops the trimming prefix sums of a conversation whose messages were replaced, renamed or removed (for every model)."""
+        key = ConversationStore.canonical_path(filename)
+        with self.trim_lock:
+            for index_key in [index_key for index_key in self.prefix_indexes if index_key[0] == key]:
+                self.prefix_indexes.pop(index_key).invalidate()
+
+    def render_prompt(self, index, values):
+        """Fills in a prompt template for the current model. Its token count is computed from the precomputed counts of the template
+        text and cached, so sending the message does not encode the template again.
+        Args:
+            index (int): The position of the template (its prompt button).
+            values (dict): The value of each parameter of the template, "input" being the user's message.
+
+        Returns:
+            str: The message to send. """
+
+        text, content_tokens = self.prompts.render(index, values, self.model)
+        self.token_counter.remember({"role": "user", "content": text}, self.model, content_tokens)
+        return text
+
+    def estimate_prompt(self, input_tokens):
+        """Estimates the prompt the next call would send for a user input, without calling the API. Used by the token cost calculator.
+        Args:
+            input_tokens (int): The number of tokens in the text of the user input.
+
+        Returns:
+            dict: "input_tokens" (the user message), "context_tokens" and "kept_messages" (the trimmed conversation), "total_messages",
+            "prompt_tokens" (the whole prompt), "input_cost" and "max_response_cost" (USD, None if the model's price is unknown). """
+
+        messages = self.store.load(self.filename)
+        new_input_tokens = self.count_tokens_in_messages([{"role": "user", "content": ""}]) + input_tokens # message overhead and reply priming
+        remaining_tokens = self.max_tokens - new_input_tokens # same budget as prepare_messages()
+
+        pinned, cut = self.find_trim_cut(messages, remaining_tokens)
+        kept = pinned + messages[cut:]
+        context_tokens = self.token_counter.count(kept, self.model)
+        prompt_tokens = context_tokens + new_input_tokens
+
+        return {
+            "input_tokens": new_input_tokens,
+            "context_tokens": context_tokens,
+            "kept_messages": len(kept),
+            "total_messages": len(messages),
+            "prompt_tokens": prompt_tokens,
+            "input_cost": self.pricing.cost(self.model, prompt_tokens),
+            "max_response_cost": self.pricing.cost(self.model, 0, self.max_tokens),
+        }
     
     def update_configs(self, new_settings):
         """Abstract class for updating the configs through the config manager
@@ -314,11 +838,16 @@ class ConversationLogic:
         Config file is changed within configuration.py. 
         Add new or updated self. variables here to implement the config changes.
         """
-        self.config_manager.update_configs(new_settings)
-        self.client = OpenAI(api_key=self.config.get('OPENAI_API_KEY')) # client is initiated with new API key. 
+        self.config_manager.update_configs(new_settings) # the configs file is written shortly after, in the background
+        if self.config.get('OPENAI_API_KEY') != self.api_key: # the client (and its connection pool) is only replaced when the key changes
+            self.api_key = self.config.get('OPENAI_API_KEY')
+            self.client = None # client is initiated with new API key on next use
         self.model = self.config.get('model') 
         self.system_message = self.config.get('system_message') 
         self.max_tokens = self.config.get('max_tokens')
+        self.stream = self.config.get('stream', True)
+        self.use_response_cache = self.config.get('response_cache', False)
+        self.summarize_history = self.config.get('summarize', False)
 
         # Update any other logic in ConversationLogic as needed
         
@@ -0,0 +1,463 @@
+import atexit, itertools, json, logging, os, threading, time
+from compact_format import CompactFormat
+from metrics import Metrics
+
+class ConversationStore:
+    """Append-only, write-behind storage engine for conversation files.
+
+    Each conversation is a JSON snapshot in the existing {"messages": [...]} format plus an append log next to it
+    (<conversation>.log, one JSON line per message, tagged with the message's position in the conversation). The messages are
+    kept in memory: a turn is acknowledged as soon as it is appended there, and a background thread writes the new lines to the
+    logs every flush_interval seconds, with one fsync per file (group commit). The log is folded back into the snapshot once it
+    outgrows it, which keeps the amortized write cost of a turn independent of the conversation length.
+
+    Snapshots are written to a temporary file, synced and renamed over the old one, so a crash leaves either the old or the new
+    snapshot. Log lines whose position is already in the snapshot are skipped on load, so a crash between folding a log and removing
+    it does not duplicate messages. A partially written last line is ignored, and two different messages logged at the same position
+    make the load fail instead of one of them being dropped.
+
+    Conversations are keyed by their canonical path (see canonical_path()), so data/a.json, ./data/a.json and the absolute path
+    of the same file share one set of messages in memory and one append log.
+
+    Snapshots are JSON by default. They can also be in the CompactFormat (compressed blocks with an offset index), detected by the
+    file's first bytes, so a conversation keeps its data/<name>.json path in either format. With a MessageStore and deduplicate set,
+    snapshots refer to the messages by hash and each unique message body is stored once across all conversations (logs keep their
+    messages inline until they are folded). Without deduplicate, the message store is only used to read snapshots that still hold
+    references, and each rewrite puts their messages back inline. """
+
+    LOG_EXT = '.log'
+    TEMP_EXT = '.tmp'
+    MIN_COMPACT_BYTES = 64 * 1024 # logs smaller than this are never compacted
+    FORMATS = ("json", "compact")
+
+    def __init__(self, metrics=None, snapshot_format="json", flush_interval=1.0, message_store=None, deduplicate=False):
+        """Initializes the ConversationStore.
+
+        Args:
+            metrics (Metrics): Optional, receives the number of bytes read and written.
+            snapshot_format (str): The format of new snapshots, "json" or "compact". Existing files keep their format.
+            flush_interval (float): Seconds between background flushes of the appended messages. 0 writes and syncs every append
+                before it returns.
+            message_store (MessageStore, optional): Content-addressed storage for the messages of the snapshots. Without it,
+                snapshots hold the messages themselves.
+            deduplicate (bool): True writes the messages of new snapshots to the message store and refers to them by hash.
+                False writes them inline (existing references are still read). """
+
+        if snapshot_format not in self.FORMATS:
+            raise ValueError(f"Unknown conversation format '{snapshot_format}', expected one of {self.FORMATS}.")
+        self.conversations = {} # canonical path -> {"messages": [...], "signature": (...), "snapshot_size": int, "log_size": int, "generation": int}
+        self.generations = itertools.count(1) # numbers the in-memory versions of the conversations, see generation()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.snapshot_format = snapshot_format
+        self.flush_interval = flush_interval
+        self.message_store = message_store
+        self.deduplicate = deduplicate and message_store is not None
+        self.pending = {} # canonical path -> log lines appended in memory but not written yet
+        self.checked_logs = set() # logs known to end with a complete line
+        self.flush_listeners = []
+        self.lock = threading.RLock() # guards the in-memory state
+        self.io_lock = threading.RLock() # serializes the writes, always taken before self.lock
+        self.flusher = None # background thread, started by the first append
+        atexit.register(self.flush)
+
+    @staticmethod
+    def canonical_path(filename):
+        """Returns the key a conversation file is known by: its absolute, normalized path. Everything that tracks conversations
+        by file (the store, the tabs, the request queues, the indexes) uses it, so one file is never open under two names. """
+        return os.path.abspath(os.path.normpath(filename))
+
+    def log_path(self, filename):
+        """Returns the path of the append log for a conversation file."""
+        return filename + self.LOG_EXT
+
+    def signature(self, filename):
+        """Returns (mtime, size) of the snapshot and the log, used to detect changes made outside of this store."""
+        signature = []
+        for path in (filename, self.log_path(filename)):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def add_flush_listener(self, listener):
+        """Registers a callable run after the pending messages of a conversation were written and synced:
+        listener(filename, signature, message_count). The filename is the conversation's canonical path, and the first
+        message_count messages of the conversation are on disk (messages appended since the write are still pending). """
+        self.flush_listeners.append(listener)
+
+    def load(self, filename, cache=True):
+        """Returns the messages of a conversation, reading the files only if they changed since the last load.
+
+        Args:
+            filename (str): The path to the conversation JSON file.
+            cache (bool): False reads the conversation without keeping it in memory (unless it already is).
+
+        Returns:
+            list: A copy of the messages of the conversation. The list held in memory is only changed by the store.
+
+        Raises:
+            ValueError: If the files are invalid, for example when two different messages are logged at the same position. """
+
+        with self.lock:
+            return list(self.cached_messages(self.canonical_path(filename), cache))
+
+    def cached_messages(self, filename, cache=True):
+        # Returns the list of messages held in memory for a conversation, reading the files if they changed (call with the
+        # canonical path and the lock held). Only the store itself may modify the list
+        signature = self.signature(filename)
+        cached = self.conversations.get(filename)
+        if cached is not None and (cached["signature"] == signature or filename in self.pending):
+            return cached["messages"] # messages that are not written yet only exist in memory
+
+        if signature[0] is None:
+            raise FileNotFoundError(f"Conversation file not found: {filename}")
+
+        messages = self.read_snapshot(filename)
+        messages.extend(self.read_log(filename, len(messages)))
+        self.metrics.increment("gpt_store_bytes_read_total", signature[0][1], file="snapshot")
+        if signature[1] is not None:
+            self.metrics.increment("gpt_store_bytes_read_total", signature[1][1], file="log")
+        if not cache:
+            return messages
+
+        self.conversations[filename] = {
+            "messages": messages,
+            "signature": signature,
+            "snapshot_size": signature[0][1],
+            "log_size": signature[1][1] if signature[1] else 0,
+            "generation": next(self.generations),
+        }
+        return messages
+
+    def generation(self, filename):
+        """Returns a number that changes whenever the messages of a conversation are replaced rather than appended to: when they are
+        read from the files (first load or a change made outside of this store) and when a snapshot is saved (reset, import, compaction).
+        Caches derived from the messages, like the trimming prefix sums, are rebuilt when it changes. None if the conversation
+        is not in memory. """
+        with self.lock:
+            cached = self.conversations.get(self.canonical_path(filename))
+            return cached["generation"] if cached is not None else None
+
+    def snapshot_format_of(self, filename):
+        """Returns the format of an existing snapshot ("json" or "compact")."""
+        return "compact" if CompactFormat.is_compact(filename) else "json"
+
+    def read_snapshot(self, filename):
+        # Reads all the messages of a snapshot, in either format
+        if self.snapshot_format_of(filename) == "compact":
+            return self.resolve(CompactFormat.read(filename)[0])
+        with open(filename, 'r') as file:
+            return self.resolve(json.load(file).get('messages', []))
+
+    def resolve(self, messages):
+        # Replaces the message references of a snapshot by the stored messages
+        if self.message_store is None:
+            return messages
+        return self.message_store.dereference(messages)
+
+    def load_tail(self, filename, count):
+        """Returns the last messages of a conversation. For compact snapshots only the blocks holding them are decompressed, and the
+        conversation is not kept in memory by this call. JSON snapshots are parsed whole, so the conversation is then kept in memory
+        like load() does, and a following load() does not read it again.
+
+        Args:
+            filename (str): The path to the conversation file.
+            count (int): The number of messages to return.
+
+        Returns:
+            tuple: (the last count messages, the total number of messages in the conversation). """
+
+        filename = self.canonical_path(filename)
+        with self.lock:
+            signature = self.signature(filename)
+            cached = self.conversations.get(filename)
+            if cached is not None and (cached["signature"] == signature or filename in self.pending):
+                return cached["messages"][-count:] if count else [], len(cached["messages"])
+
+            if signature[0] is None:
+                raise FileNotFoundError(f"Conversation file not found: {filename}")
+
+            if self.snapshot_format_of(filename) != "compact":
+                messages = self.cached_messages(filename)
+                return messages[-count:] if count else [], len(messages)
+
+            messages, total, bytes_read = CompactFormat.read(filename, last=count)
+            messages = self.resolve(messages)
+            log_messages = self.read_log(filename, total)
+            self.metrics.increment("gpt_store_bytes_read_total", bytes_read, file="snapshot")
+            if signature[1] is not None:
+                self.metrics.increment("gpt_store_bytes_read_total", signature[1][1], file="log")
+
+            messages.extend(log_messages)
+            return messages[-count:] if count else [], total + len(log_messages)
+
+    def read_log(self, filename, snapshot_count):
+        """Reads the messages appended to a conversation since its last snapshot. A partially written last line
+        (for example after a crash) is ignored, and so are lines already folded into the snapshot. A line repeating the
+        message of a position already read (a write retried after a partial failure) is skipped.
+
+        Args:
+            filename (str): The path to the conversation file.
+            snapshot_count (int): The number of messages in the snapshot.
+
+        Raises:
+            ValueError: If a position is taken by two different messages, or positions are missing from the log. """
+
+        messages = []
+        try:
+            with open(self.log_path(filename), 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        position, message = entry["position"], entry["message"]
+                    except (ValueError, KeyError, TypeError):
+                        logging.warning(f"Skipping incomplete entry in {self.log_path(filename)}")
+                        continue
+                    expected = snapshot_count + len(messages)
+                    if position == expected:
+                        messages.append(message)
+                    elif position > expected:
+                        raise ValueError(f"Messages {expected} to {position - 1} are missing from {self.log_path(filename)}")
+                    elif position >= snapshot_count and messages[position - snapshot_count] != message:
+                        raise ValueError(f"Position {position} of {self.log_path(filename)} holds two different messages")
+        except FileNotFoundError:
+            pass
+        return messages
+
+    def append(self, filename, new_messages):
+        """Appends messages to a conversation. They are kept in memory right away and written to the log by the next flush.
+
+        Args:
+            filename (str): The path to the conversation JSON file.
+            new_messages (list): The messages to append (for example the latest user/assistant pair). """
+
+        filename = self.canonical_path(filename)
+        with self.lock:
+            messages = self.cached_messages(filename)
+            lines = self.pending.setdefault(filename, [])
+            for message in new_messages:
+                lines.append(json.dumps({"position": len(messages), "message": message}) + "\n")
+                messages.append(message)
+
+        if self.flush_interval <= 0:
+            self.flush(filename)
+            return
+        if self.flusher is None:
+            with self.lock:
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+                    self.flusher.start()
+
+    def run_flusher(self):
+        # Background thread: flushes the pending messages every flush_interval seconds
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception: # keep flushing later, the messages stay pending
+                logging.exception("Flushing conversations failed")
+
+    def flush(self, filename=None):
+        """Writes the pending messages to the logs and syncs them to disk, one fsync per file. Logs that outgrew their
+        snapshot are folded into it.
+
+        Args:
+            filename (str, optional): Only flush this conversation. Defaults to all of them. """
+
+        if filename is not None:
+            filename = self.canonical_path(filename)
+        with self.io_lock:
+            with self.lock:
+                if filename is None:
+                    batch, self.pending = self.pending, {}
+                else:
+                    batch = {filename: self.pending.pop(filename)} if filename in self.pending else {}
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            flushed = []
+            for name, lines in batch.items():
+                try:
+                    written = self.write_log(name, "".join(lines))
+                except OSError as e:
+                    logging.error(f"Could not write the log of {name}, retrying on the next flush: {e}")
+                    with self.lock: # put the lines back in front of those appended since
+                        self.pending[name] = lines + self.pending.get(name, [])
+                    continue
+                self.metrics.increment("gpt_store_bytes_written_total", written, file="log")
+
+                with self.lock:
+                    cached = self.conversations.get(name)
+                    if cached is None:
+                        continue # removed or renamed since the append
+                    cached["log_size"] += written
+                    cached["signature"] = self.signature(name)
+                    if cached["log_size"] > max(cached["snapshot_size"], self.MIN_COMPACT_BYTES):
+                        self.compact(name)
+                    durable = len(cached["messages"]) - len(self.pending.get(name, ()))
+                flushed.append((name, durable))
+            self.metrics.observe("gpt_store_flush_seconds", time.perf_counter() - start)
+
+        for name, durable in flushed:
+            signature = self.signature(name)
+            for listener in self.flush_listeners:
+                try:
+                    listener(name, signature, durable)
+                except Exception:
+                    logging.exception(f"Flush listener failed for {name}")
+
+    def write_log(self, filename, text):
+        # Appends lines to a log and syncs it. A log left with a partial last line by a crash first gets a newline,
+        # so the new lines are not glued to it
+        path = self.log_path(filename)
+        with open(path, 'ab+') as file:
+            if path not in self.checked_logs:
+                file.seek(0, os.SEEK_END)
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        text = "\n" + text
+                self.checked_logs.add(path)
+            data = text.encode('utf-8')
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return len(data)
+
+    def write_snapshot(self, filename, messages, snapshot_format):
+        # Writes a snapshot atomically: temporary file, fsync, rename over the old snapshot, fsync of the directory
+        if snapshot_format == "compact":
+            data = CompactFormat.encode(messages)
+        else:
+            data = json.dumps({"messages": messages}).encode('utf-8')
+        temp_path = filename + self.TEMP_EXT
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filename)
+        self.sync_directory(filename)
+        return len(data)
+
+    @staticmethod
+    def sync_directory(filename):
+        # Makes a rename in the file's directory durable (not possible, and not needed, on Windows)
+        if os.name == 'nt':
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def remove_log(self, filename):
+        # Deletes the append log of a conversation, if any
+        if os.path.exists(self.log_path(filename)):
+            os.remove(self.log_path(filename))
+        self.checked_logs.discard(self.log_path(filename))
+
+    def save(self, filename, messages, snapshot_format=None, folds_log=False, by_reference=None):
+        """Writes a full snapshot of a conversation and discards its append log and pending messages.
+        Used to import/export conversations and for resets.
+
+        Args:
+            filename (str): The path to save the conversation JSON file.
+            messages (list): The list of messages to be saved.
+            snapshot_format (str, optional): "json" ({"messages": [...]}) or "compact". Defaults to the format of the existing
+                file, or the store's format for new files.
+            folds_log (bool): True if the messages are the conversation's own messages, log included (compaction). The log is then
+                removed after the new snapshot is in place, otherwise before, so a crash in between never mixes an old log into
+                a different conversation.
+            by_reference (bool, optional): True refers to the messages in the message store, False writes them inline (exports).
+                Defaults to the store's deduplicate setting. """
+
+        filename = self.canonical_path(filename)
+        with self.io_lock, self.lock:
+            messages = list(messages)
+            if snapshot_format is None:
+                snapshot_format = self.snapshot_format_of(filename) if os.path.exists(filename) else self.snapshot_format
+            self.pending.pop(filename, None)
+            if not folds_log:
+                self.remove_log(filename)
+            stored = messages
+            if by_reference is None:
+                by_reference = self.deduplicate
+            if self.message_store is not None and by_reference:
+                stored = self.message_store.reference(filename, messages) # the bodies are stored before the snapshot refers to them
+            written = self.write_snapshot(filename, stored, snapshot_format)
+            if folds_log:
+                self.remove_log(filename)
+            if self.message_store is not None: # bodies only the previous snapshot referred to are deleted
+                self.metrics.increment("gpt_store_bodies_collected_total", self.message_store.retain(filename, stored))
+
+            self.metrics.increment("gpt_store_bytes_written_total", written, file="snapshot")
+            signature = self.signature(filename)
+            self.conversations[filename] = {
+                "messages": messages,
+                "signature": signature,
+                "snapshot_size": signature[0][1],
+                "log_size": 0,
+                "generation": next(self.generations),
+            }
+
+    def compact(self, filename):
+        """Folds the append log of a conversation back into its snapshot."""
+        filename = self.canonical_path(filename)
+        with self.io_lock, self.lock:
+            self.save(filename, self.cached_messages(filename), folds_log=True)
+            logging.info(f"Compacted conversation log for {filename}")
+
+    def export(self, filename, destination):
+        """Exports a conversation (snapshot and log) as a single {"messages": [...]} JSON file."""
+        self.save(destination, self.load(filename), snapshot_format="json", by_reference=False)
+
+    def convert(self, filename, snapshot_format=None, by_reference=None):
+        """Rewrites a conversation (snapshot and log) in the given format, "json" or "compact".
+
+        Args:
+            filename (str): The path to the conversation file.
+            snapshot_format (str, optional): The new format. Defaults to the file's current format.
+            by_reference (bool, optional): False puts the messages of the snapshot inline, undoing the deduplication
+                (see save()). Defaults to the store's deduplicate setting.
+
+        Returns:
+            tuple: (size before, size after) in bytes, the log included. """
+
+        if snapshot_format is not None and snapshot_format not in self.FORMATS:
+            raise ValueError(f"Unknown conversation format '{snapshot_format}', expected one of {self.FORMATS}.")
+        with self.io_lock, self.lock:
+            before = sum(stat[1] for stat in self.signature(filename) if stat is not None)
+            self.save(filename, self.load(filename, cache=False), snapshot_format, folds_log=True, by_reference=by_reference)
+            return before, self.signature(filename)[0][1]
+
+    def rename(self, old_filename, new_filename):
+        """Moves a conversation file and its append log."""
+        old_filename, new_filename = self.canonical_path(old_filename), self.canonical_path(new_filename)
+        self.flush(old_filename)
+        with self.io_lock, self.lock:
+            os.rename(old_filename, new_filename)
+            if os.path.exists(self.log_path(old_filename)):
+                os.replace(self.log_path(old_filename), self.log_path(new_filename))
+            self.checked_logs.discard(self.log_path(old_filename))
+            self.conversations.pop(old_filename, None)
+            self.conversations.pop(new_filename, None)
+            if self.message_store is not None:
+                self.message_store.rename(old_filename, new_filename)
+
+    def remove(self, filename):
+        """Deletes a conversation file and its append log. With a message store, the bodies no other conversation refers to
+        are garbage collected. """
+
+        filename = self.canonical_path(filename)
+        with self.io_lock, self.lock:
+            self.pending.pop(filename, None)
+            os.remove(filename)
+            self.remove_log(filename)
+            self.conversations.pop(filename, None)
+            if self.message_store is not None:
+                collected = self.message_store.release(filename)
+                self.metrics.increment("gpt_store_bodies_collected_total", collected)
+                logging.info(f"Removed {filename}, {collected} message bodies no longer referenced were deleted")
@@ -0,0 +1,144 @@
+import threading, tkinter as tk
+from profiler import Profiler
+
+class ConversationTab(tk.Frame):
+    """One open conversation in the GUI's notebook: its text field, scroll bar and windowed rendering state.
+
+    Only the latest PAGE_SIZE messages are rendered at first, older pages are rendered as the user scrolls to the top. Pages are formatted
+    on a background thread and handed to the Tk thread through the post callable. A tab can first be shown the tail of a conversation
+    (see show_conversation()) and be given the older messages once they are read (see extend_history()). A tab keeps its text while
+    other tabs are shown, so switching back to it does not read or render the conversation again. """
+
+    PAGE_SIZE = 50 # number of messages rendered at a time in the conversation text field
+
+    def __init__(self, parent, filename, post, profiler, **kwargs):
+        """Initializes the ConversationTab.
+
+        Args:
+            parent (ttk.Notebook): The notebook holding the tab.
+            filename (str): The path to the conversation file shown in the tab.
+            post (callable): Runs a callable on the Tk thread (the GUI's ui_queue.put), used by the page formatting threads.
+            profiler (Profiler): Times the formatting and insertion of pages, when profiling is enabled. """
+
+        super().__init__(parent, **kwargs)
+        self.filename = filename
+        self.post = post
+        self.profiler = profiler
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        # Windowed rendering state of the conversation text field
+        self.rendered_messages = [] # the displayed messages of the conversation
+        self.rendered_start = 0 # index in rendered_messages of the oldest message shown
+        self.render_generation = 0 # bumped on every load, so pages of a previous load are dropped
+        self.page_loading = False
+
+        # Display the conversation text section
+        self.text = tk.Text(self, wrap="word", height=30, font=("Helvetica", 12))
+        self.text.grid(row=0, column=0, padx=10, pady=10, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        # Scroll Bar:
+        self.scroll = tk.Scrollbar(self, command=self.text.yview)
+        self.scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.text['yscrollcommand'] = self.on_scroll # also loads older pages when the top is reached
+        self.text.tag_configure("search_match", background="#fff3a3") # the message a search result jumped to
+
+    def show_conversation(self, conversation, focus=None):
+        """Replaces the text of the tab with a conversation.
+
+        Args:
+            conversation (dict): The loaded conversation. With "message_count" (see ConversationLogic.load_conversation(tail=...)),
+                its messages are the last ones of the conversation and scrolling to the top stops at them until extend_history().
+            focus (int, optional): The position of a message to scroll to and highlight (a search result). The first page then
+                starts at that message. """
+
+        messages = conversation.get('messages', [])
+        first_position = conversation.get('message_count', len(messages)) - len(messages) # position of messages[0] in the conversation
+        self.text.delete(1.0, tk.END)
+
+        self.render_generation += 1
+        self.rendered_messages = messages[max(0, 2 - first_position):] # Assuming you want to skip the system and user messages to be displayed in the text-field
+        self.rendered_start = len(self.rendered_messages)
+        self.page_loading = False
+        if focus is None:
+            self.load_older_messages()
+        else:
+            self.load_older_messages(focus=max(0, min(focus - 2, len(self.rendered_messages) - 1)))
+
+    def extend_history(self, conversation, generation):
+        """Gives the tab the whole conversation after it was shown its tail, so older pages can be rendered when the user scrolls up.
+
+        Args:
+            conversation (dict): The whole conversation.
+            generation (int): The tab's render_generation when the tail was shown. Nothing changes if another conversation
+                was shown since. """
+
+        messages = conversation.get('messages', [])[2:]
+        added = len(messages) - len(self.rendered_messages)
+        if generation != self.render_generation or added < 0:
+            return
+        self.rendered_messages = messages
+        self.rendered_start += added
+        if float(self.text.yview()[0]) <= 0.0: # the top was reached while the older messages were read
+            self.load_older_messages()
+
+    def append(self, text):
+        """Appends text at the end of the conversation (a streamed response) and scrolls to it."""
+        self.text.insert(tk.END, text)
+        self.text.see(tk.END)
+
+    def load_older_messages(self, focus=None):
+        # Formats the page of messages before the oldest displayed one on a background thread, then inserts it at the top.
+        # With focus (an index in rendered_messages), the page reaches back to that message at least
+        if self.page_loading or self.rendered_start == 0:
+            return
+        self.page_loading = True
+        start = max(0, self.rendered_start - self.PAGE_SIZE)
+        if focus is not None:
+            start = min(start, focus)
+        page = self.rendered_messages[start:self.rendered_start]
+        generation = self.render_generation
+
+        def format_page():
+            with self.profiler.span("format_page"):
+                text = self.format_messages(page)
+                focus_lines = None
+                if focus is not None: # first and last line of the focused message in the page
+                    first_line = self.format_messages(page[:focus - start]).count('\n') + 1
+                    focus_lines = (first_line, first_line + self.format_messages(page[focus - start:focus - start + 1]).count('\n'))
+            self.post(lambda: self.insert_page(text, start, generation, focus_lines))
+
+        threading.Thread(target=format_page, daemon=True).start()
+
+    @Profiler.profiled("insert_page")
+    def insert_page(self, text, start, generation, focus_lines=None):
+        # Inserts a formatted page at the top of the conversation text field, keeping the current view in place
+        # (or showing the focused message, if any)
+        if generation != self.render_generation or not self.winfo_exists():
+            return # the conversation was reloaded or the tab was closed in the meantime
+
+        first_page = self.rendered_start == len(self.rendered_messages)
+        top_line = int(self.text.index("@0,0").split('.')[0])
+        self.text.insert("1.0", text)
+        self.rendered_start = start
+        self.page_loading = False
+
+        if focus_lines is not None:
+            self.text.tag_add("search_match", f"{focus_lines[0]}.0", f"{focus_lines[1]}.0")
+            self.text.yview(f"{focus_lines[0]}.0")
+        elif first_page:
+            self.text.see(tk.END)
+        else:
+            added_lines = text.count('\n')
+            self.text.yview(f"{top_line + added_lines}.0")
+
+    @staticmethod
+    def format_messages(messages):
+        """Returns the display text of a list of messages."""
+        return "".join(f"{message['role'].capitalize()}: {message['content']}\n" for message in messages)
+
+    def on_scroll(self, first, last):
+        # Updates the scroll bar, and loads the previous page once the top of the conversation is visible
+        self.scroll.set(first, last)
+        if float(first) <= 0.0 and self.rendered_start > 0:
+            self.load_older_messages()
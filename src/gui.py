@@ -1,13 +1,21 @@
-import threading, json, os, tkinter as tk
+import threading, json, logging, os, queue, tkinter as tk
 from tkinter import filedialog, messagebox, ttk, simpledialog as simpledialog, messagebox as messagebox
 from datetime import datetime
 from threading import Thread
 from conversation_logic import ConversationLogic
+from conversation_store import ConversationStore
 from configuration import ConfigManager
+from request_dispatcher import RequestDispatcher
+from conversation_tab import ConversationTab
+from text_token_counter import TextTokenCounter
+from profiler import Profiler
 
 class Main(tk.Frame): 
     """A class that creates the main GUI frame for the ChatGPTApp"""
 
+    ESTIMATE_DELAY_MS = 300 # the token cost estimate is updated once typing pauses for this long
+    UI_POLL_MS = 30 # how often work posted by background threads is applied to the widgets
+
     def __init__(self, parent, conversation_logic, *args, **kwargs): 
         """Initializes the GUI frame
 
@@ -20,6 +28,7 @@ class Main(tk.Frame):
         super().__init__(parent, **kwargs) 
         self.parent = parent 
         self.conversation_logic = conversation_logic 
+        self.profiler = conversation_logic.profiler # spans of the GUI's own work (rendering), when profiling is enabled
         self.filename = os.path.join('data', 'conversation.json') # initial conversation path
 
         # Tkinter variables for getting/setting dynamic information 
@@ -27,12 +36,76 @@ class Main(tk.Frame):
         self.max_tokens_var = tk.IntVar(value=self.conversation_logic.max_tokens)
         self.filename_var = tk.StringVar(value=self.conversation_logic.filename)
 
+        # Widgets may only be changed from the Tk thread, background threads post callables to this queue instead
+        self.ui_queue = queue.Queue()
+
+        # Open conversations, one notebook tab each. The tab of conversation_logic.filename is the selected one
+        self.tabs = {} # canonical path of the conversation (see ConversationStore.canonical_path()) -> ConversationTab
+
+        # Conversation search state: results of the latest query, (filename, position, role, snippet)
+        self.search_results = []
+        self.search_generation = 0
+
+        # Token cost calculator state: the estimate is debounced, counted on a background thread, and only changed text is re-encoded
+        self.text_counter = TextTokenCounter(self.conversation_logic.tokenizer)
+        self.estimate_after_id = None
+        self.estimate_generation = 0
+        self.selected_prompt = None # index of the prompt template the next message is sent with, if any
+        self.initial_generation = None # render generation of the initial conversation's tab once its last page is shown
+
+        # API calls run on the dispatcher's workers (in order within a conversation, in parallel across tabs), their results come back through ui_queue
+        self.dispatcher = RequestDispatcher(self.conversation_logic, self.post_request_event)
+
         self.init_gui()
+        self.process_ui_queue()
+        self.parent.protocol("WM_DELETE_WINDOW", self.exit_application) # closing the window also flushes the conversations
+
+        # The config's initial conversation gets an empty tab now, its messages and the prompt templates are read by
+        # start_loading() once the window is shown
+        self.conversation_logic.set_filename(self.filename)
+        self.open_tab(self.filename)
+
+    def start_loading(self):
+        """Reads the initial conversation and the prompt templates on a background thread. Call it once the window is shown.
+        The last page of the conversation is read and shown first (compact files only decompress the blocks holding it),
+        then the whole conversation is read so the user can scroll back. Returns the thread. """
+
+        filename = self.filename
+        store = self.conversation_logic.store
+
+        def load():
+            try:
+                messages, message_count = store.load_tail(filename, ConversationTab.PAGE_SIZE + 2)
+                tail = {"messages": messages, "message_count": message_count}
+                self.ui_queue.put(lambda: self.show_initial_conversation(filename, tail))
+                if message_count > len(messages):
+                    conversation = {"messages": store.load(filename)[:message_count]} # without turns sent since, the tab shows them already
+                    self.ui_queue.put(lambda: self.extend_initial_conversation(filename, conversation))
+            except (OSError, ValueError) as e:
+                logging.error(f"Could not load the initial conversation {filename}: {e}")
+                self.ui_queue.put(lambda: self.status_var.set(f"Could not load {filename}: {e}"))
+            self.conversation_logic.prompts.load()
+            self.ui_queue.put(self.update_prompt_buttons)
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    def show_initial_conversation(self, filename, conversation):
+        # Shows the tail of the initial conversation, unless the user opened another one while it was read
+        tab = self.tabs.get(ConversationStore.canonical_path(filename))
+        if tab is None or tab.render_generation != 0:
+            return
+        tab.show_conversation(conversation)
+        self.initial_generation = tab.render_generation
+        self.update_title_labels()
+        self.on_user_input_modified() # the cost estimate depends on the conversation
 
-        # load the config's initial conversation file if found 
-        loaded_conversation = self.conversation_logic.load_conversation(filename=self.filename)
-        if loaded_conversation:
-            self.conversation_text.yview(tk.END, self.load_conversation_text(loaded_conversation))
+    def extend_initial_conversation(self, filename, conversation):
+        # Gives the initial conversation's tab the older messages, once the whole conversation was read
+        tab = self.tabs.get(ConversationStore.canonical_path(filename))
+        if tab is not None and self.initial_generation is not None:
+            tab.extend_history(conversation, self.initial_generation)
 
     def init_gui(self):
         """Initializes the graphical user interface (GUI) elements. Has 3 columns, 1 row structure. Split into more rows as needed.
@@ -62,6 +135,7 @@ class Main(tk.Frame):
         file_menu.add_command(label="New Conversation", command=self.new_conversation)
         file_menu.add_command(label="Open Conversation", command=self.load_conversation_from_file)
         file_menu.add_command(label="Save As...", command=self.save_conversation)
+        file_menu.add_command(label="Close Tab", command=lambda: self.close_tab(self.conversation_logic.filename))
         file_menu.add_separator()
         file_menu.add_command(label="Settings", command=self.open_settings_menu)
         file_menu.add_command(label="Exit", command=self.exit_application)
@@ -145,12 +219,34 @@ class Main(tk.Frame):
         # Creates a Treeview within the history frame
         self.conversation_treeview = ttk.Treeview(history_frame)
         self.conversation_treeview.grid(row=1, column=0, padx=10, pady=10, sticky=(tk.N, tk.S, tk.W))
-        self.conversation_treeview["columns"] = ("filename") # define columns + column configs below 
+        self.conversation_treeview["columns"] = ("filename", "message_count", "total_tokens", "updated_at") # define columns + column configs below 
         self.conversation_treeview.column("#0", width=0, minwidth=0, stretch=False) # Defines the structure of the treeview as a parent-child relationship. Stretch=false hides this branch structure
         self.conversation_treeview.column("filename", width=200, minwidth=150, stretch=True)
-        self.conversation_treeview.heading("filename", text="Filename:", anchor=tk.W)
+        self.conversation_treeview.column("message_count", width=50, minwidth=40, stretch=False, anchor=tk.E)
+        self.conversation_treeview.column("total_tokens", width=60, minwidth=50, stretch=False, anchor=tk.E)
+        self.conversation_treeview.column("updated_at", width=110, minwidth=90, stretch=False)
+        self.treeview_sort = ("updated_at", True) # (column, descending), changed by clicking a heading
+        for column, text in (("filename", "Filename:"), ("message_count", "Msgs"), ("total_tokens", "Tokens"), ("updated_at", "Updated")):
+            self.conversation_treeview.heading(column, text=text, anchor=tk.W, command=lambda column=column: self.sort_treeview(column))
         self.configure_conversation_treeview() # calls config method for conversation state management in the gui 
 
+        # Search Frame: full-text search over every conversation, a result opens its conversation at the matching message
+        search_frame = tk.Frame(left_frame, bd=1, relief="raised", bg=active_color)
+        search_frame.grid(row=2, column=0, padx=10, pady=10, sticky=(tk.W, tk.E))
+        search_frame.columnconfigure(0, weight=1)
+
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(search_frame, textvariable=self.search_var, font=("Helvetica", 12))
+        self.search_entry.grid(row=0, column=0, padx=10, pady=10, sticky=(tk.W, tk.E))
+        self.search_entry.bind("<Return>", self.on_search)
+        search_button = tk.Button(search_frame, width=8, text="Search", command=self.on_search)
+        search_button.grid(row=0, column=1, padx=(0, 10), pady=10)
+
+        self.search_listbox = tk.Listbox(search_frame, height=6, font=("Helvetica", 10), bg=active_color, fg='#ffffff')
+        self.search_listbox.grid(row=1, column=0, columnspan=2, padx=10, pady=(0, 10), sticky=(tk.W, tk.E))
+        self.search_listbox.bind("<Double-1>", self.on_search_result_selected)
+        self.search_listbox.bind("<Return>", self.on_search_result_selected)
+
         self.update_title_labels()
 
     def configure_conversation_treeview(self):
@@ -164,6 +260,7 @@ class Main(tk.Frame):
                 full_path = os.path.join("data", selected_filename) 
                 if messagebox.askyesno("Remove Conversation", f"Are you sure you want to remove '{selected_filename}'?"):
                     curr_conversation = self.conversation_logic.remove_conversation_from_file(full_path)
+                    self.close_tab(full_path, force=True)
                     self.load_conversation_text(curr_conversation)
                     self.refresh_treeview()
 
@@ -184,6 +281,7 @@ class Main(tk.Frame):
 
                 # Rename the file (unless it is conversation.json)
                 self.conversation_logic.rename_filename(selected_filename, new_filename)
+                self.rename_tab(selected_filename, new_filename)
                 
                 # If renaming the currently open file, reload it in the GUI
                 if selected_filename == self.conversation_logic.filename:
@@ -214,6 +312,10 @@ class Main(tk.Frame):
             item_id = self.conversation_treeview.focus() # holds ID of selected item 
             selected_filename = self.conversation_treeview.item(item_id, "values")[0] # retrieve filename of given id's associated value (file) 
             full_path = os.path.join("data", selected_filename) 
+            tab = self.tabs.get(ConversationStore.canonical_path(full_path))
+            if tab is not None: # already open, its tab holds the conversation
+                self.notebook.select(tab)
+                return
             curr_conversation = self.conversation_logic.load_conversation(full_path)
             self.load_conversation_text(curr_conversation)
         
@@ -226,14 +328,23 @@ class Main(tk.Frame):
         middle_frame.columnconfigure(0, weight=1)
         middle_frame.rowconfigure(0, weight=1)
 
-        # Display the conversation text section
-        self.conversation_text = tk.Text(middle_frame, wrap="word", height=30,  font=("Helvetica", 12))
-        self.conversation_text.grid(row=0, column=0, padx=10, pady=10, sticky=(tk.W, tk.E, tk.N, tk.S))
-        
-        # Scroll Bar:     
-        conversation_scroll = tk.Scrollbar(middle_frame, command=self.conversation_text.yview)
-        conversation_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        self.conversation_text['yscrollcommand'] = conversation_scroll.set
+        # Conversation tabs, each open conversation keeps its own text and rendering state (see ConversationTab)
+        self.notebook = ttk.Notebook(middle_frame)
+        self.notebook.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
+        # Right-click a tab to close it
+        tab_menu = tk.Menu(self.notebook, tearoff=0)
+        def on_tab_right_click(event):
+            try:
+                index = self.notebook.index(f"@{event.x},{event.y}")
+            except tk.TclError: # not on a tab
+                return
+            tab = self.nametowidget(self.notebook.tabs()[index])
+            tab_menu.delete(0, tk.END)
+            tab_menu.add_command(label="Close Tab", command=lambda: self.close_tab(tab.filename))
+            tab_menu.post(event.x_root, event.y_root)
+        self.notebook.bind("<Button-3>", on_tab_right_click) # <Button-2> or <Button-3> depending on platform
 
     def create_right_frame(self):
         # Right Frame
@@ -247,27 +358,32 @@ class Main(tk.Frame):
         self.prompt_frame.grid(row=0, column=0, padx=10, pady=10, sticky=(tk.W, tk.E, tk.N, tk.S))
         self.prompt_frame.columnconfigure([0, 1], weight=1)  # Stretch columns as needed
 
-        self.prompt_1 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 1")
+        self.prompt_1 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 1", command=lambda: self.on_prompt_button_click(0))
         self.prompt_1.grid(row=0, column=0, padx=5, pady=10, sticky=(tk.W, tk.E))
 
-        self.prompt_2 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 2")
+        self.prompt_2 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 2", command=lambda: self.on_prompt_button_click(1))
         self.prompt_2.grid(row=0, column=1, padx=5, pady=10, sticky=(tk.W, tk.E))
 
-        self.prompt_3 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 3")
+        self.prompt_3 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 3", command=lambda: self.on_prompt_button_click(2))
         self.prompt_3.grid(row=1, column=0, padx=5, pady=10, sticky=(tk.W, tk.E))
 
-        self.prompt_4 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 4")
+        self.prompt_4 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 4", command=lambda: self.on_prompt_button_click(3))
         self.prompt_4.grid(row=1, column=1, padx=5, pady=10, sticky=(tk.W, tk.E))
 
-        self.prompt_5 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 5")
+        self.prompt_5 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 5", command=lambda: self.on_prompt_button_click(4))
         self.prompt_5.grid(row=2, column=0, padx=5, pady=10, sticky=(tk.W, tk.E))
 
-        self.prompt_6 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 6")
+        self.prompt_6 = tk.Button(self.prompt_frame, width=10, height=3, text="Prompt 6", command=lambda: self.on_prompt_button_click(5))
         self.prompt_6.grid(row=2, column=1, padx=5, pady=10, sticky=(tk.W, tk.E))
 
         self.prompt_text = tk.Text(self.prompt_frame, wrap="word", width=38, height=8,  font=("Helvetica", 12))
         self.prompt_text.grid(row=3, columnspan=2, padx=10, pady=10, sticky=(tk.W, tk.E, tk.N, tk.S))
 
+        # The buttons are bound to the templates of data/prompts.json, the selected template is shown in prompt_text
+        self.prompt_buttons = [self.prompt_1, self.prompt_2, self.prompt_3, self.prompt_4, self.prompt_5, self.prompt_6]
+        for button in self.prompt_buttons: # labeled by update_prompt_buttons() once start_loading() read the templates
+            button.config(state=tk.DISABLED)
+
         #self.MAX_BUTTON_WIDTH = 15  # Maximum button width, adjust as necessary
 
         # Token Calculator Frame
@@ -279,6 +395,54 @@ class Main(tk.Frame):
         self.token_calc_label = tk.Label(self.token_calc_frame, text="Token Cost Calculator", font=("Helvetica", 16))
         self.token_calc_label.grid(row=0, column=0, padx=10, pady=10, sticky=tk.W)
 
+        # Live estimate of the next call, updated as the user types
+        self.token_estimate_var = tk.StringVar(value="Type a message to see its cost.")
+        token_estimate = tk.Label(self.token_calc_frame, textvariable=self.token_estimate_var, justify=tk.LEFT, anchor=tk.NW, font=("Helvetica", 11))
+        token_estimate.grid(row=1, column=0, padx=10, pady=5, sticky=(tk.W, tk.E, tk.N))
+
+    def update_prompt_buttons(self):
+        # Labels the prompt buttons with the template names (buttons without a template are disabled) and shows the selected template
+        templates = self.conversation_logic.prompts.load()
+        if self.selected_prompt is not None and self.selected_prompt >= len(templates):
+            self.selected_prompt = None
+        for index, button in enumerate(self.prompt_buttons):
+            if index < len(templates):
+                button.config(text=templates[index]["name"], state=tk.NORMAL,
+                              relief=tk.SUNKEN if index == self.selected_prompt else tk.RAISED)
+            else:
+                button.config(text=f"Prompt {index + 1}", state=tk.DISABLED, relief=tk.RAISED)
+
+        self.prompt_text.config(state=tk.NORMAL)
+        self.prompt_text.delete("1.0", tk.END)
+        if self.selected_prompt is None:
+            self.prompt_text.insert("1.0", "Select a prompt to send your next message with it. Prompts are edited in "
+                                           f"{self.conversation_logic.prompts.path}.")
+        else:
+            self.prompt_text.insert("1.0", templates[self.selected_prompt]["text"])
+        self.prompt_text.config(state=tk.DISABLED)
+
+    def on_prompt_button_click(self, index):
+        """Selects the prompt template of a button for the next message (or unselects it), and shows its cost in the calculator."""
+        self.selected_prompt = None if self.selected_prompt == index else index
+        self.update_prompt_buttons()
+        self.update_token_estimate()
+
+    def ask_prompt_parameters(self, template):
+        """Asks for the parameters of a template, other than {input} (the user's message).
+
+        Returns:
+            dict or None: The value of each parameter, or None if the user cancelled. """
+
+        values = {}
+        for name in template["parameters"]:
+            if name == self.conversation_logic.prompts.INPUT:
+                continue
+            value = simpledialog.askstring(template["name"], f"{name.replace('_', ' ').capitalize()}:", parent=self)
+            if value is None:
+                return None
+            values[name] = value
+        return values
+
     def create_toolbar_frame(self):
         """Create the Toolbar Section"""
 
@@ -295,6 +459,7 @@ class Main(tk.Frame):
         input_scroll = tk.Scrollbar(toolbar, command=self.user_input_entry.yview)
         input_scroll.grid(row=0, column=1, sticky=(tk.N, tk.S))
         self.user_input_entry['yscrollcommand'] = input_scroll.set
+        self.user_input_entry.bind("<<Modified>>", self.on_user_input_modified) # updates the token cost calculator
 
         # Button Frame and associated Buttons 
         button_frame = tk.Frame(toolbar, bg="grey")
@@ -306,6 +471,9 @@ class Main(tk.Frame):
         self.reset_button = tk.Button(button_frame, text="Reset Conversation", command=self.on_reset_button_click, width=15, height=2)
         self.reset_button.grid(row=1, column=0, padx=5, pady=10)
 
+        cancel_button = tk.Button(button_frame, text="Cancel Request", command=self.on_cancel_button_click, width=15, height=2)
+        cancel_button.grid(row=2, column=0, padx=5, pady=10)
+
         # Status Bar
         self.status_var = tk.StringVar()
         current_time = datetime.now().strftime("%H:%M")
@@ -313,41 +481,168 @@ class Main(tk.Frame):
         self.status_bar = tk.Label(toolbar, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W )
         self.status_bar.grid(row=1, column=0, columnspan=2, sticky=tk.W + tk.E, padx=5, pady=5)
 
+        # Queue depth (requests waiting or in flight)
+        self.queue_var = tk.StringVar()
+        queue_label = tk.Label(toolbar, textvariable=self.queue_var, anchor=tk.E, width=12)
+        queue_label.grid(row=1, column=2, sticky=tk.E, padx=5, pady=5)
+
     def on_send_button_click(self):
         """Handles the action when the Send button is clicked.
         
-        Performs and creates a threead to handle API call """
+        Queues the user input on the request dispatcher, which performs the API call on its worker thread """
 
         user_input = self.user_input_entry.get("1.0", "end-1c") # takes in the user input 
+        template = None
+        if self.selected_prompt is not None: # the message is sent in the selected prompt template, filled in on the worker
+            templates = self.conversation_logic.prompts.load()
+            if self.selected_prompt < len(templates):
+                values = self.ask_prompt_parameters(templates[self.selected_prompt])
+                if values is None:
+                    return
+                template = (self.selected_prompt, values)
+        request = self.dispatcher.submit(user_input, self.conversation_logic.filename, template)
+        if request is None:
+            self.status_var.set("Too many requests waiting in this conversation, please wait for the current ones to finish.")
+            return
         self.user_input_entry.delete("1.0", tk.END) 
-        threading.Thread(target=self.perform_api_call, args=(user_input,)).start()
+        if template is not None: # templates are used for one message
+            self.selected_prompt = None
+            self.update_prompt_buttons()
         self.status_var.set("API call in progress...")
+        self.update_queue_depth()
 
-    def perform_api_call(self, user_input):
-        """Handles the API call by calling the necessary logic, and uses user-inputs 
-        to update and display conversation information to the GUI """
-        gpt_response, error_response = self.conversation_logic.chat_gpt(user_input)
+    def on_cancel_button_click(self):
+        # Cancels the request in flight and the queued ones of the current conversation
+        if self.dispatcher.cancel(self.conversation_logic.filename):
+            self.status_var.set("Cancelling requests...")
+
+    def post_request_event(self, event, request, data):
+        # Called by the dispatcher's worker thread, hands the event over to the Tk thread
+        self.ui_queue.put(lambda: self.handle_request_event(event, request, data))
+
+    def handle_request_event(self, event, request, data):
+        """Updates the GUI with an event of a request, on the Tk thread.
+
+        Args:
+            event (str): "started", "chunk", "done" or "cancelled" (see RequestDispatcher).
+            request (dict): The request the event belongs to.
+            data: The chunk for "chunk", the (response, error) tuple for "done". """
+
+        # The text goes to the tab of the conversation the request was sent in (if it is still open), the status bar only
+        # follows the selected conversation
+        tab = self.tabs.get(request["filename"]) # the dispatcher gives the canonical path
+        visible = request["filename"] == ConversationStore.canonical_path(self.conversation_logic.filename)
+        user_input = request["user_input"]
+
+        if event == "started":
+            request["shown"] = False
+        elif event == "chunk":
+            if tab is not None:
+                if not request["shown"]: # the user input is shown once the first chunk arrives
+                    tab.append(f"User: {user_input}\nGPT: ")
+                    request["shown"] = True
+                tab.append(data)
+            if visible:
+                self.status_var.set("Receiving response...")
+        elif event == "cancelled":
+            if tab is not None and request.get("shown"):
+                tab.append(" [cancelled]\n\n")
+            if visible:
+                self.status_var.set(f"Request cancelled. Time: {datetime.now().strftime('%H:%M')}")
+        elif event == "done":
+            gpt_response, error_response = data
+            if gpt_response is not None and tab is not None:
+                # Updates conversation to the conversation tab
+                if not request.get("shown"):
+                    tab.append(f"User: {user_input}\nGPT: {gpt_response}")
+                tab.append("\n\n")
+            if visible or error_response is not None:
+                self.show_call_status(request["logic"], gpt_response, error_response)
+
+        self.update_queue_depth()
+
+    def show_call_status(self, logic, gpt_response, error_response):
+        # Shows the result of an API call in the status bar
         current_time = datetime.now().strftime("%H:%M")
-        
+
         # Check if response is an error message
         if gpt_response is not None:
-            # Updates conversation to the conversation_text field
-            self.conversation_text.insert(tk.END, f"User: {user_input}\n")
-            self.conversation_text.insert(tk.END, f"GPT: {gpt_response}\n\n")
-            self.conversation_text.see(tk.END)
-            
             # Status bar information  
-            self.status_var.set(f"Call Successful! "
-                f"Tokens Used: {self.conversation_logic.total_tokens_used} | "
-                f"Input Tokens: {self.conversation_logic.input_tokens} | "
-                f"Stop Reason: {self.conversation_logic.stop_reason} | "
-                f"Model: {self.conversation_logic.model} | "
+            call_status = "Cached Response! (no API call)" if logic.cache_status == "hit" else "Call Successful!"
+            self.status_var.set(f"{call_status} "
+                f"Tokens Used: {logic.total_tokens_used} | "
+                f"Input Tokens: {logic.input_tokens} | "
+                f"Stop Reason: {logic.stop_reason} | "
+                f"Model: {logic.model} | "
                 f"Time: {current_time}")
         else:
             # Display the error message in the GUI
-            if "401" or "APIConnectionError" in error_response:
+            if "401" in error_response or "APIConnectionError" in error_response:
                 messagebox.showinfo("Authentication Error", "Invalid or expired API key. Please check your API key.")
                 self.status_var.set(f"API Call Failed! Please check your API Key, or other settings. Time: {current_time} ")
+            else: # for example rate limits or server errors that persisted after the retries
+                self.status_var.set(f"API Call Failed! {error_response} Time: {current_time} ")
+
+    def on_user_input_modified(self, event=None):
+        # Restarts the debounce timer of the token cost estimate on every change of the user input
+        self.user_input_entry.edit_modified(False) # re-arms the <<Modified>> event
+        if self.estimate_after_id is not None:
+            self.after_cancel(self.estimate_after_id)
+        self.estimate_after_id = self.after(self.ESTIMATE_DELAY_MS, self.update_token_estimate)
+
+    def update_token_estimate(self):
+        # Counts the user input and estimates the prompt on a background thread, then shows the result in the calculator
+        self.estimate_after_id = None
+        self.estimate_generation += 1
+        generation = self.estimate_generation
+        text = self.user_input_entry.get("1.0", "end-1c")
+        logic = self.conversation_logic
+        selected_prompt = self.selected_prompt
+
+        def estimate():
+            try:
+                input_tokens = self.text_counter.count(text, logic.model)
+                template_name = None
+                if selected_prompt is not None: # the template's own tokens are precomputed, its parameters are not counted yet
+                    input_tokens += logic.prompts.static_tokens(selected_prompt, logic.model)
+                    template_name = logic.prompts.load()[selected_prompt]["name"]
+                result = logic.estimate_prompt(input_tokens)
+                result["template"] = template_name
+            except (OSError, ValueError, IndexError) as e: # for example the conversation file was removed
+                result = {"error": str(e)}
+            self.ui_queue.put(lambda: self.show_token_estimate(result, generation))
+
+        threading.Thread(target=estimate, daemon=True).start()
+
+    def show_token_estimate(self, estimate, generation):
+        # Displays a token estimate, unless a newer one was requested in the meantime
+        if generation != self.estimate_generation:
+            return
+        if "error" in estimate:
+            self.token_estimate_var.set(f"No estimate: {estimate['error']}")
+            return
+
+        def format_cost(cost):
+            return f"${cost:.4f}" if cost is not None else "unknown price"
+
+        template_line = f"Prompt: {estimate['template']} (+ its parameters)\n" if estimate["template"] else ""
+        self.token_estimate_var.set(
+            f"Model: {self.conversation_logic.model}\n"
+            f"{template_line}"
+            f"Your message: {estimate['input_tokens']} tokens\n"
+            f"Context: {estimate['context_tokens']} tokens "
+            f"({estimate['kept_messages']} of {estimate['total_messages']} messages)\n"
+            f"Prompt total: {estimate['prompt_tokens']} tokens\n"
+            f"Prompt cost: {format_cost(estimate['input_cost'])}\n"
+            f"Max response cost: {format_cost(estimate['max_response_cost'])}"
+        )
+
+    def update_queue_depth(self):
+        # Shows the number of requests waiting or in flight, and marks the tabs of the conversations that are generating
+        depth = self.dispatcher.depth()
+        self.queue_var.set(f"Requests: {depth}" if depth else "")
+        for key, tab in self.tabs.items():
+            self.notebook.tab(tab, text=os.path.basename(key) + (" \u2022" if self.dispatcher.depth(key) else ""))
 
     def on_reset_button_click(self):
         """Handles the action when the Reset Conversation button is clicked.
@@ -359,17 +654,77 @@ class Main(tk.Frame):
             #self.conversation_text.delete("1.0", tk.END)
             self.load_conversation_text(curr_conv)
 
-    def load_conversation_text(self, conversation):
-        """Updates the conversation text in the GUI based on the loaded conversation from a file"""
+    @Profiler.profiled("load_conversation_text")
+    def load_conversation_text(self, conversation, focus=None):
+        """Updates the conversation text in the GUI based on the loaded conversation from a file.
 
-        messages = conversation.get('messages', [])
-        self.conversation_text.delete(1.0, tk.END)
-        self.update_title_labels()
+        The conversation is shown in the tab of the current conversation (conversation_logic.filename), which is opened if needed.
+        Only the latest messages are rendered at first, older pages are rendered as the user scrolls to the top,
+        so opening a conversation takes the same time whatever its length.
+
+        Args:
+            conversation (dict): The loaded conversation.
+            focus (int, optional): The position of a message to scroll to and highlight (a search result). """
 
-        for message in messages[2:]:  # Assuming you want to skip the system and user messages to be displayed in the text-field
-            role = message["role"]
-            content = message["content"]
-            self.conversation_text.insert(tk.END, f"{role.capitalize()}: {content}\n")
+        tab = self.open_tab(self.conversation_logic.filename)
+        tab.show_conversation(conversation, focus)
+        self.update_title_labels()
+        self.on_user_input_modified() # the cost estimate depends on the conversation
+
+    def open_tab(self, filename):
+        """Returns the tab of a conversation, adding an empty one if the conversation is not open yet, and selects it.
+        Tabs are keyed by canonical path, so a file opened as data/a.json and by its absolute path shares one tab. """
+        key = ConversationStore.canonical_path(filename)
+        tab = self.tabs.get(key)
+        if tab is None:
+            tab = self.tabs[key] = ConversationTab(self.notebook, filename, self.ui_queue.put, self.profiler)
+            self.notebook.add(tab, text=os.path.basename(filename))
+        self.notebook.select(tab)
+        return tab
+
+    def close_tab(self, filename, force=False):
+        """Closes the tab of a conversation. The last open tab is only closed with force (its conversation was removed).
+        Requests already sent in the conversation still finish and are saved. """
+
+        key = ConversationStore.canonical_path(filename)
+        tab = self.tabs.get(key)
+        if tab is None or (len(self.tabs) == 1 and not force):
+            return
+        del self.tabs[key]
+        self.notebook.forget(tab) # selects another tab, if any
+        tab.destroy()
+
+    def rename_tab(self, old_filename, new_filename):
+        # Moves the tab of a renamed conversation to its new name
+        tab = self.tabs.pop(ConversationStore.canonical_path(old_filename), None)
+        if tab is not None:
+            tab.filename = new_filename
+            self.tabs[ConversationStore.canonical_path(new_filename)] = tab
+            self.notebook.tab(tab, text=os.path.basename(new_filename))
+
+    def on_tab_changed(self, event=None):
+        # Makes the selected tab's conversation the current one. Its text is already in the tab, so nothing is read from disk
+        if not self.notebook.select():
+            return
+        tab = self.nametowidget(self.notebook.select())
+        if ConversationStore.canonical_path(tab.filename) != ConversationStore.canonical_path(self.conversation_logic.filename):
+            self.conversation_logic.set_filename(tab.filename)
+            self.update_title_labels()
+            self.on_user_input_modified() # the cost estimate depends on the conversation
+
+    def process_ui_queue(self):
+        # Runs the callables posted by background threads on the Tk thread. A failing callback (a closed tab, a bad response)
+        # is logged and skipped, so the queue keeps being polled and the next results still reach the widgets
+        while True:
+            try:
+                callback = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback()
+            except Exception:
+                logging.exception("A UI update failed")
+        self.after(self.UI_POLL_MS, self.process_ui_queue)
 
     def load_conversation_from_file(self):
         """ Opens the data/ directory to view and load a .json conversation.
@@ -507,17 +862,84 @@ class Main(tk.Frame):
         self.filename_label.config(text=current_file_text)
 
     def refresh_treeview(self):
-        # Refresh the treeview after add/remove/rename operations
+        # Refresh the treeview after add/remove/rename operations. The metadata comes from the conversation index, so only changed files are read.
+        # Indexing new files needs the tokenizer, so the list is read on a background thread and shown through the ui_queue
+        sort_by, descending = self.treeview_sort
+
+        def list_conversations():
+            try:
+                conversations = self.conversation_logic.list_conversations(sort_by, descending)
+            except Exception as e: # the list keeps its previous content, the next refresh tries again
+                logging.exception("Listing the conversations failed")
+                error = str(e)
+                self.ui_queue.put(lambda: self.status_var.set(f"Could not list the conversations: {error}"))
+                return
+            self.ui_queue.put(lambda: self.populate_treeview(conversations))
+
+        threading.Thread(target=list_conversations, daemon=True).start()
+
+    def populate_treeview(self, conversations):
+        # Populating the treeview with given filenames and their metadata
         self.conversation_treeview.delete(*self.conversation_treeview.get_children())
-        convo_files = self.conversation_logic.get_conversation_files()
-
-        # Populating the treeview with given filenames 
-        for filename in convo_files:
-            self.conversation_treeview.insert("", tk.END, values=(filename,))
+        for filename, message_count, total_tokens, title, updated_at in conversations:
+            updated = datetime.fromtimestamp(updated_at).strftime("%m/%d %H:%M")
+            self.conversation_treeview.insert("", tk.END, values=(os.path.basename(filename), message_count, total_tokens, updated))
+
+    def on_search(self, event=None):
+        # Searches every conversation on a background thread (refreshing the search index may read changed files)
+        query = self.search_var.get().strip()
+        self.search_generation += 1
+        generation = self.search_generation
+        if not query:
+            self.show_search_results([], generation)
+            return
+
+        def search():
+            try:
+                results = self.conversation_logic.search_conversations(query)
+            except Exception as e:
+                error = str(e)
+                self.ui_queue.put(lambda: self.status_var.set(f"Search failed: {error}"))
+                return
+            self.ui_queue.put(lambda: self.show_search_results(results, generation))
+
+        threading.Thread(target=search, daemon=True).start()
+
+    def show_search_results(self, results, generation):
+        # Lists the results of the latest query, older queries that finish late are dropped
+        if generation != self.search_generation:
+            return
+        self.search_results = results
+        self.search_listbox.delete(0, tk.END)
+        for filename, position, role, snippet in results:
+            self.search_listbox.insert(tk.END, f"{os.path.basename(filename)} #{position} {role}: {' '.join(snippet.split())}")
+        if not results and self.search_var.get().strip():
+            self.search_listbox.insert(tk.END, "No matches")
+
+    def on_search_result_selected(self, event=None):
+        # Opens the conversation of the selected result and scrolls to the matching message
+        selection = self.search_listbox.curselection()
+        if not selection or selection[0] >= len(self.search_results):
+            return
+        filename, position, role, snippet = self.search_results[selection[0]]
+        try:
+            curr_conversation = self.conversation_logic.load_conversation(filename)
+        except (FileNotFoundError, RuntimeError) as e:
+            messagebox.showerror("Error", str(e))
+            return
+        self.filename_var.set(filename)
+        self.load_conversation_text(curr_conversation, focus=position)
+
+    def sort_treeview(self, column):
+        # Sorts the conversation list by a column, clicking the same heading again reverses the order
+        sort_by, descending = self.treeview_sort
+        self.treeview_sort = (column, not descending if column == sort_by else column != "filename")
+        self.refresh_treeview()
 
     def exit_application(self):
-        # Save if needed, then exit
-        self.conversation_logic.save_conversation_to_file(self.conversation_logic.filename, self.messages)
+        # Writes the turns that are still only in memory, then exits. Requests in progress are cancelled
+        self.dispatcher.cancel()
+        self.conversation_logic.flush()
         self.parent.quit()
 
 
@@ -528,5 +950,9 @@ if __name__ == "__main__":
     #root.geometry('800x600') # sets size of the window 
     conversation_logic = ConversationLogic(ConfigManager(config_path='configs.json'))
 
-    Main(root, conversation_logic).pack(side="top", fill="both", expand=True)
+    main = Main(root, conversation_logic)
+    main.pack(side="top", fill="both", expand=True)
+    root.update()
+    main.start_loading()
+    conversation_logic.start_warm_up()
     root.mainloop()
\ No newline at end of file
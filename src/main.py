@@ -1,18 +1,80 @@
-import logging, os
-import tkinter as tk
+import argparse, contextlib, logging, os, sys
 from conversation_logic import ConversationLogic
 from configuration import ConfigManager
-from gui import Main
 
-if __name__ == "__main__": #main start method for the program 
-    logging.basicConfig(filename='gpt_app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # Initialize python logging. 
-    
+def parse_args():
+    parser = argparse.ArgumentParser(description="GPT App. Starts the GUI, or runs a batch of prompts headless with --batch.")
+    parser.add_argument("--batch", metavar="JOBS.jsonl", help='run the jobs of a JSONL file without the GUI, one {"conversation": ..., "prompt": ...} per line')
+    parser.add_argument("--workers", type=int, default=4, help="number of conversations processed in parallel in batch mode (default: 4)")
+    parser.add_argument("--output", metavar="RESULTS.jsonl",
+                        help="where batch results are streamed, one JSON line per job (default: stdout). Jobs that already succeeded "
+                             "in this file are skipped, so an interrupted run can be resumed")
+    parser.add_argument("--convert", choices=("json", "compact"), help="rewrite every conversation in data/ in this format, then exit")
+    parser.add_argument("--inline", action="store_true",
+                        help="rewrite every conversation in data/ with its messages inline instead of references to data/messages.sqlite3, then exit")
+    return parser.parse_args()
+
+def run_batch(conversation_logic, args):
+    """Runs the headless batch mode and streams the results to the output file (or stdout)."""
+    from batch import BatchRunner
+
+    runner = BatchRunner(conversation_logic, workers=args.workers)
+    jobs = runner.load_jobs(args.batch)
+    done = runner.completed_ids(args.output) if args.output else set() # resumes a previous run writing to the same file
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr): # keeps the api log prints out of the results stream
+            totals = runner.run(jobs, output, done)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Batch finished: {totals}", file=sys.stderr)
+
+def run_convert(conversation_logic, snapshot_format=None, by_reference=None):
+    """Rewrites every conversation in the data/ directory in the given format ("json" or "compact", None keeps each file's format).
+    by_reference=False puts the messages deduplicated in the message store back in the files (migration away from deduplicate_messages). """
+    store = conversation_logic.store
+    total_before = total_after = 0
+    for name in sorted(os.listdir(conversation_logic.directory)):
+        if not name.endswith('.json'):
+            continue
+        filename = os.path.join(conversation_logic.directory, name)
+        try:
+            before, after = store.convert(filename, snapshot_format, by_reference)
+        except (OSError, ValueError) as e:
+            print(f"Skipped {filename}: {e}", file=sys.stderr)
+            continue
+        total_before += before
+        total_after += after
+        print(f"{filename}: {before} -> {after} bytes")
+    print(f"Converted to {snapshot_format or 'the same format'}{' with inline messages' if by_reference is False else ''}: "
+          f"{total_before} -> {total_after} bytes")
+
+def run_gui(conversation_logic):
+    import tkinter as tk # the GUI is only imported when it is used, so batch mode runs without a display
+    from gui import Main
+
     root = tk.Tk() # assembles the tkinter root
     root.title("GPT App") # change title here
 
-    config_manager = ConfigManager(config_path=os.path.join("", 'configs.json')) # change initial config path if necessaary. Creates instance of ConfigManager 
+    main = Main(root, conversation_logic) # Creates an instance of Main (GUI)
+    main.pack(side="top", fill="both", expand=True)
+    root.update() # paints the window before the conversation and the slow dependencies are loaded
+    main.start_loading() # reads the initial conversation (its last page first) and the prompt templates in the background
+    conversation_logic.start_warm_up() # loads the OpenAI client and the tokenizer in the background
+    root.mainloop() # starts GUI
+
+if __name__ == "__main__": #main start method for the program
+    args = parse_args()
+    logging.basicConfig(filename='gpt_app.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s') # Initialize python logging.
+
+    config_manager = ConfigManager(config_path=os.path.join("", 'configs.json')) # change initial config path if necessaary. Creates instance of ConfigManager
 
     conversation_logic = ConversationLogic(config_manager) # creates an instance of ConversationLogic(), with config file path sent in.
 
-    Main(root, conversation_logic).pack(side="top", fill="both", expand=True) # Creates an instance of Main (GUI) 
-    root.mainloop() # starts GUI  
+    if args.convert or args.inline:
+        run_convert(conversation_logic, args.convert, False if args.inline else None)
+    elif args.batch:
+        run_batch(conversation_logic, args)
+    else:
+        run_gui(conversation_logic)
@@ -0,0 +1,157 @@
+import hashlib, json, os, sqlite3, threading
+from conversation_store import ConversationStore
+
+class MessageStore:
+    """Content-addressed storage for the messages of the conversation snapshots (a SQLite file, data/messages.sqlite3).
+
+    Each unique message body is stored once, keyed by a hash of the message. Snapshots hold {"ref": <hash>} in place of the messages
+    (see reference() and dereference()), so the default system/user/assistant messages of every new conversation and repeated canned
+    prompts are stored a single time. Messages whose body is shorter than a reference stay inline.
+
+    The store also records which hashes each conversation file refers to. When the references of a file change or the file is removed,
+    the bodies no longer referenced by any file are deleted (garbage collection). Bodies and references are written before the snapshot
+    referring to them, and dropped only after it was replaced, so a crash can leak bodies but never lose one a file still refers to. """
+
+    REF_KEY = "ref"
+    HASH_BYTES = 16 # 128-bit BLAKE2b digests, 32 hex characters
+    BATCH_SIZE = 500 # hashes per query, below SQLite's limit on the number of parameters
+
+    def __init__(self, path):
+        """Initializes the MessageStore.
+
+        Args:
+            path (str): The path to the SQLite message store file. """
+
+        self.path = path
+        self.connection = None # opened on first use
+        self.lock = threading.Lock()
+        self.reference_size = len(json.dumps({self.REF_KEY: "0" * self.HASH_BYTES * 2}))
+
+    def connect(self):
+        # Opens the database and creates the tables the first time the store is used
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL") # unlike the indexes, the bodies cannot be rebuilt from the conversation files
+            connection.execute("CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, body TEXT)") # rowid table, bodies can be large
+            connection.execute("CREATE TABLE IF NOT EXISTS refs (filename TEXT, hash TEXT, PRIMARY KEY (filename, hash)) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash)")
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    @staticmethod
+    def key(filename):
+        # Files are recorded by their canonical path, the key the rest of the app knows them by
+        return ConversationStore.canonical_path(filename)
+
+    def is_reference(self, message):
+        """Returns True if a message read from a snapshot is a reference to a stored body."""
+        return len(message) == 1 and self.REF_KEY in message
+
+    def reference(self, filename, messages):
+        """Stores the bodies of messages about to be written to a snapshot, and returns the messages to write in their place.
+
+        Args:
+            filename (str): The path to the conversation file the snapshot is written to.
+            messages (list): The messages of the conversation.
+
+        Returns:
+            list: The messages, with {"ref": <hash>} in place of every message whose body is longer than its reference. """
+
+        stored = []
+        bodies = {}
+        for message in messages:
+            body = json.dumps(message)
+            if len(body) <= self.reference_size:
+                stored.append(message)
+                continue
+            digest = hashlib.blake2b(body.encode('utf-8'), digest_size=self.HASH_BYTES).hexdigest()
+            bodies[digest] = body
+            stored.append({self.REF_KEY: digest})
+
+        if bodies:
+            with self.lock:
+                connection = self.connect()
+                known = self.existing(connection, list(bodies)) # shared bodies are usually stored already, only new ones are inserted
+                connection.executemany("INSERT INTO bodies VALUES (?, ?)", ((digest, body) for digest, body in bodies.items() if digest not in known))
+                connection.executemany("INSERT OR IGNORE INTO refs VALUES (?, ?)", ((self.key(filename), digest) for digest in bodies))
+                connection.commit()
+        return stored
+
+    def dereference(self, messages):
+        """Replaces the references of messages read from a snapshot by the stored messages.
+
+        Returns:
+            list: The messages, in order. Messages that are not references are returned as they are.
+
+        Raises:
+            ValueError: If a referenced body is missing from the store. """
+
+        digests = list({message[self.REF_KEY] for message in messages if self.is_reference(message)})
+        if not digests:
+            return messages
+
+        with self.lock:
+            bodies = dict(self.select(self.connect(), "hash, body", digests))
+
+        missing = [digest for digest in digests if digest not in bodies]
+        if missing:
+            raise ValueError(f"{len(missing)} referenced messages are missing from {self.path}, for example {missing[0]}")
+        return [json.loads(bodies[message[self.REF_KEY]]) if self.is_reference(message) else message for message in messages]
+
+    def select(self, connection, columns, digests):
+        # Yields the rows of the bodies with the given hashes, querying them in batches (call with the lock held)
+        for start in range(0, len(digests), self.BATCH_SIZE):
+            batch = digests[start:start + self.BATCH_SIZE]
+            yield from connection.execute(f"SELECT {columns} FROM bodies WHERE hash IN ({','.join('?' * len(batch))})", batch)
+
+    def existing(self, connection, digests):
+        # Returns the set of hashes among digests that have a stored body (call with the lock held)
+        return {row[0] for row in self.select(connection, "hash", digests)}
+
+    def retain(self, filename, stored):
+        """Records the references of a snapshot once it replaced the previous one, and deletes the bodies that are no longer referenced.
+
+        Args:
+            filename (str): The path to the conversation file.
+            stored (list): The messages as written to the snapshot (see reference()).
+
+        Returns:
+            int: The number of bodies deleted. """
+
+        digests = {message[self.REF_KEY] for message in stored if self.is_reference(message)}
+        with self.lock:
+            connection = self.connect()
+            previous = {row[0] for row in connection.execute("SELECT hash FROM refs WHERE filename = ?", (self.key(filename),))}
+            dropped = previous - digests
+            connection.executemany("DELETE FROM refs WHERE filename = ? AND hash = ?", ((self.key(filename), digest) for digest in dropped))
+            collected = self.collect(connection, dropped)
+            connection.commit()
+        return collected
+
+    def release(self, filename):
+        """Drops the references of a deleted conversation file, and deletes the bodies no other file refers to.
+
+        Returns:
+            int: The number of bodies deleted. """
+
+        return self.retain(filename, [])
+
+    def collect(self, connection, candidates):
+        # Deletes the bodies among candidates that no file refers to anymore (call with the lock held)
+        collected = 0
+        for digest in candidates:
+            if connection.execute("SELECT 1 FROM refs WHERE hash = ? LIMIT 1", (digest,)).fetchone() is None:
+                collected += connection.execute("DELETE FROM bodies WHERE hash = ?", (digest,)).rowcount
+        return collected
+
+    def rename(self, old_filename, new_filename):
+        """Moves the references of a renamed conversation file. The references of a file it replaced are dropped."""
+        with self.lock:
+            connection = self.connect()
+            replaced = {row[0] for row in connection.execute("SELECT hash FROM refs WHERE filename = ?", (self.key(new_filename),))}
+            connection.execute("DELETE FROM refs WHERE filename = ?", (self.key(new_filename),))
+            connection.execute("UPDATE refs SET filename = ? WHERE filename = ?", (self.key(new_filename), self.key(old_filename)))
+            self.collect(connection, replaced)
+            connection.commit()
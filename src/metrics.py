@@ -0,0 +1,155 @@
+import json, os, threading, time
+from contextlib import contextmanager
+
+class Metrics:
+    """In-process counters and histograms for the hot path of ConversationLogic (latencies, bytes, tokens, errors).
+
+    Each metric is identified by its name and a set of labels, like Prometheus. Histograms use fixed buckets, so recording
+    a value is a short loop under a lock and memory does not grow with the number of observations. The metrics can be exported
+    as a JSON snapshot or in the Prometheus text format (for example for the node_exporter textfile collector). """
+
+    # Upper bounds of the histogram buckets, in seconds
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counters = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> {"counts": [per bucket, last is +Inf], "sum": float, "count": int}
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock() # exports share their temporary files
+
+    @staticmethod
+    def key(name, labels):
+        # Labels are stored as a sorted tuple, so the same labels always give the same key
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def increment(self, name, value=1, **labels):
+        """Adds a value to a counter.
+
+        Args:
+            name (str): The counter name, for example "gpt_errors_total".
+            value (int or float): The amount to add.
+            **labels: The labels of the counter, for example type="RateLimitError". """
+
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Records a value (usually a duration in seconds) in a histogram.
+
+        Args:
+            name (str): The histogram name, for example "gpt_request_seconds".
+            value (float): The observed value.
+            **labels: The labels of the histogram, for example model="gpt-4". """
+
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"counts": [0] * (len(self.BUCKETS) + 1), "sum": 0.0, "count": 0}
+            index = len(self.BUCKETS)
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    index = i
+                    break
+            histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the body of a with statement into a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def quantile(self, counts, total, q):
+        # Estimates a quantile from the bucket counts, interpolating linearly inside the bucket
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.0
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else self.BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def snapshot(self):
+        """Returns the current value of every metric as a JSON-serializable dictionary.
+
+        Returns:
+            dict: {"timestamp", "counters": {name: [{"labels", "value"}]}, "histograms": {name: [{"labels", "count", "sum", "p50",
+            "p95", "p99", "buckets": {upper bound: count}}]}}. Histogram buckets are not cumulative in the snapshot. """
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: {"counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]}
+                          for key, value in self.histograms.items()}
+
+        snapshot = {"timestamp": time.time(), "counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items()):
+            snapshot["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), histogram in sorted(histograms.items()):
+            bounds = [str(bound) for bound in self.BUCKETS] + ["+Inf"]
+            snapshot["histograms"].setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": histogram["count"],
+                "sum": histogram["sum"],
+                "p50": self.quantile(histogram["counts"], histogram["count"], 0.50),
+                "p95": self.quantile(histogram["counts"], histogram["count"], 0.95),
+                "p99": self.quantile(histogram["counts"], histogram["count"], 0.99),
+                "buckets": dict(zip(bounds, histogram["counts"])),
+            })
+        return snapshot
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        # Formats labels as {name="value",...} for the Prometheus text format
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (f'{label}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for label, value in pairs)
+        return "{" + ",".join(escaped) + "}"
+
+    def to_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, {"counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]})
+                                for key, value in self.histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in self.BUCKETS] + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_file(path, text):
+        # Writes a file atomically, so a scraper never reads a half-written export
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+    def export(self, path):
+        """Writes the metrics to <path>.json (snapshot) and <path>.prom (Prometheus text format)."""
+        with self.export_lock:
+            self.write_file(path + ".json", json.dumps(self.snapshot(), indent=2))
+            self.write_file(path + ".prom", self.to_prometheus())
@@ -0,0 +1,48 @@
+class ModelPricing:
+    """Prices of the OpenAI chat models, used to estimate the cost of a call before it is sent.
+
+    Prices are in USD per 1,000 tokens, as (input, output). A model is matched on the longest known prefix of its name,
+    so dated snapshots (for example gpt-4-0613) use the price of their family. """
+
+    PRICES = {
+        "gpt-3.5-turbo": (0.0010, 0.0020),
+        "gpt-3.5-turbo-16k": (0.0030, 0.0040),
+        "gpt-3.5-turbo-0613": (0.0015, 0.0020),
+        "gpt-3.5-turbo-instruct": (0.0015, 0.0020),
+        "gpt-4": (0.03, 0.06),
+        "gpt-4-32k": (0.06, 0.12),
+        "gpt-4-turbo": (0.01, 0.03),
+        "gpt-4-1106": (0.01, 0.03),
+        "gpt-4-0125": (0.01, 0.03),
+        "gpt-4-vision": (0.01, 0.03),
+    }
+
+    def __init__(self, prices=None):
+        """Initializes the ModelPricing.
+
+        Args:
+            prices (dict): Optional prices that replace or extend the defaults: {model: [input, output]} per 1,000 tokens. """
+
+        self.prices = dict(self.PRICES)
+        for model, (input_price, output_price) in (prices or {}).items():
+            self.prices[model] = (float(input_price), float(output_price))
+
+    def prices_for(self, model):
+        """Returns the (input, output) price per 1,000 tokens of a model, or None if the model is unknown."""
+        matches = [name for name in self.prices if model == name or model.startswith(name + "-")]
+        if not matches:
+            return None
+        return self.prices[max(matches, key=len)]
+
+    def cost(self, model, input_tokens, output_tokens=0):
+        """Returns the cost in USD of a call, or None if the model's price is unknown.
+
+        Args:
+            model (str): The GPT model being used.
+            input_tokens (int): The number of prompt tokens.
+            output_tokens (int): The number of response tokens. """
+
+        prices = self.prices_for(model)
+        if prices is None:
+            return None
+        return (input_tokens * prices[0] + output_tokens * prices[1]) / 1000
@@ -0,0 +1,234 @@
+import atexit, cProfile, functools, inspect, logging, os, pstats, threading, time
+from contextlib import contextmanager, nullcontext
+from metrics import Metrics
+
+class Profiler:
+    """Opt-in profiling of the phases of a turn (loading, tokenizing, trimming, the API call, saving, rendering), written as flame graphs.
+
+    Methods are wrapped in named spans (see profiled()). Spans nest per thread, and the time spent in each stack of spans, minus the time
+    of the spans nested in it, is summed up and written to <directory>/spans.folded in the collapsed-stack format ("a;b;c <microseconds>"
+    per line) read by flamegraph.pl, speedscope or inferno. The files are written by a background thread every EXPORT_INTERVAL seconds
+    while spans finish, and on exit. In "cprofile" mode the outermost span of each thread also runs cProfile, and the
+    function calls are written to functions.folded (call stacks rebuilt from cProfile's caller/callee times) and functions.pstats.
+
+    Profiling is off by default. It is switched on by the 'profile' config or the GPT_APP_PROFILE environment variable (which takes
+    precedence): "spans" (or true, "1") for spans only, "cprofile" for spans and function calls. When off, spans do nothing. """
+
+    ENV_VAR = "GPT_APP_PROFILE"
+    EXPORT_INTERVAL = 2.0 # seconds between two writes of the files by the background exporter, they are also written on exit
+    MIN_MICROSECONDS = 10 # call stacks rebuilt from cProfile taking less time than this are dropped
+
+    def __init__(self, setting=None, directory=os.path.join("data", "profiles")):
+        """Initializes the Profiler.
+
+        Args:
+            setting (bool or str, optional): The 'profile' config: None/False (off), True/"spans" or "cprofile".
+            directory (str): The directory the collapsed-stack files are written to. """
+
+        setting = os.environ.get(self.ENV_VAR, setting)
+        if isinstance(setting, str):
+            setting = setting.strip().lower()
+            setting = False if setting in ("", "0", "false", "off", "no") else setting
+        self.enabled = bool(setting)
+        self.use_cprofile = setting == "cprofile"
+        self.directory = directory
+
+        self.span_times = {} # tuple of span names -> microseconds spent in the innermost span itself
+        self.function_stats = None # pstats.Stats of the merged cProfile runs
+        self.profiles = {} # thread id -> the thread's cProfile run, paused between spans
+        self.active_profiles = set() # ids of the threads whose run is recording
+        self.local = threading.local() # .stack: the open spans of the thread, as [name, start, time of the nested spans]
+        self.lock = threading.Lock()
+        self.export_lock = threading.Lock()
+        self.changed = threading.Event() # set when spans finished since the last export
+        self.exporter = None # background thread writing the files, started by the first span
+        if self.enabled:
+            logging.info(f"Profiling enabled ({'cprofile' if self.use_cprofile else 'spans'}), writing to {self.directory}")
+            atexit.register(self.export)
+
+    @staticmethod
+    def profiled(name):
+        """Decorator wrapping a method in a span. The method's instance must have a profiler attribute. Generator methods are wrapped
+        as generators, so the span covers the time spent producing each item (but not the time the caller spends between items). """
+
+        def decorator(method):
+            if inspect.isgeneratorfunction(method):
+                @functools.wraps(method)
+                def generator_wrapper(self, *args, **kwargs):
+                    generator = method(self, *args, **kwargs)
+                    if not self.profiler.enabled:
+                        return (yield from generator)
+                    try:
+                        while True:
+                            with self.profiler.span(name):
+                                try:
+                                    item = next(generator)
+                                except StopIteration as stop:
+                                    return stop.value
+                            yield item
+                    finally:
+                        generator.close()
+                return generator_wrapper
+
+            @functools.wraps(method)
+            def wrapper(self, *args, **kwargs):
+                if not self.profiler.enabled:
+                    return method(self, *args, **kwargs)
+                with self.profiler.span(name):
+                    return method(self, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def span(self, name):
+        """Returns a context manager timing its body as a span nested in the open spans of the thread (a no-op if profiling is off)."""
+        if not self.enabled:
+            return nullcontext()
+        return self.timed_span(name)
+
+    @contextmanager
+    def timed_span(self, name):
+        # Times a span, and runs cProfile around it if it is the outermost span of the thread
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        profile = self.start_cprofile() if not stack and self.use_cprofile else None
+        frame = [name, time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            depth = next(i for i, span in enumerate(stack) if span is frame) # the top of the stack, unless a generator was left open
+            path = tuple(span[0] for span in stack[:depth + 1])
+            del stack[depth]
+            if stack:
+                stack[-1][2] += elapsed
+            with self.lock:
+                self.span_times[path] = self.span_times.get(path, 0) + int((elapsed - frame[2]) * 1_000_000)
+            if profile is not None:
+                self.stop_cprofile(profile)
+            if not stack: # the files are written by the exporter thread, never on the thread that was timed
+                self.changed.set()
+                if self.exporter is None:
+                    self.start_exporter()
+
+    def start_exporter(self):
+        # Starts the background thread that writes the files every EXPORT_INTERVAL seconds while spans keep finishing
+        with self.lock:
+            if self.exporter is not None:
+                return
+            self.exporter = threading.Thread(target=self.run_exporter, name="profiler-export", daemon=True)
+        self.exporter.start()
+
+    def run_exporter(self):
+        # Exporter thread: waits for finished spans, writes the files, and sleeps so they are written at most every EXPORT_INTERVAL
+        while True:
+            self.changed.wait()
+            time.sleep(self.EXPORT_INTERVAL)
+            self.changed.clear()
+            try:
+                self.export()
+            except Exception: # keep exporting later
+                logging.exception("Writing the profiles failed")
+
+    def start_cprofile(self):
+        # Resumes the cProfile run of the current thread. From Python 3.12 cProfile can only run on one thread at a time,
+        # the spans of the other threads are then only timed
+        thread_id = threading.get_ident()
+        with self.lock:
+            profile = self.profiles.get(thread_id)
+            if profile is None:
+                profile = self.profiles[thread_id] = cProfile.Profile()
+            self.active_profiles.add(thread_id)
+        try:
+            profile.enable()
+        except ValueError:
+            with self.lock:
+                self.active_profiles.discard(thread_id)
+            return None
+        return profile
+
+    def stop_cprofile(self, profile):
+        # Pauses the cProfile run of the current thread, its calls are added to the function statistics by export()
+        profile.disable()
+        with self.lock:
+            self.active_profiles.discard(threading.get_ident())
+
+    def merge_profiles(self):
+        # Adds the calls of the paused cProfile runs to the function statistics (call with the lock held).
+        # The merged runs are dropped, their threads start new ones
+        for thread_id in [thread_id for thread_id in self.profiles if thread_id not in self.active_profiles]:
+            profile = self.profiles.pop(thread_id)
+            try:
+                if self.function_stats is None:
+                    self.function_stats = pstats.Stats(profile)
+                else:
+                    self.function_stats.add(profile)
+            except TypeError: # the run recorded no calls
+                pass
+
+    @staticmethod
+    def frame_label(function):
+        # Formats a cProfile function key (file, line, name) as a flame graph frame
+        filename, line, name = function
+        label = name if filename == "~" else f"{name} ({os.path.basename(filename)}:{line})"
+        return label.replace(";", ":")
+
+    def function_stacks(self, stats):
+        """Rebuilds collapsed call stacks from cProfile statistics.
+
+        cProfile keeps the time of each caller -> callee pair, not whole stacks, so the time of a function is shared among its stacks in
+        proportion to the time each caller spent in it (like flameprof does). Recursive calls are cut at the first repeated function.
+
+        Args:
+            stats (dict): The stats attribute of a pstats.Stats: {function: (calls, primitive calls, own time, total time, callers)}.
+
+        Returns:
+            dict: Tuple of frame labels -> microseconds spent in the innermost function itself. """
+
+        callees = {}
+        for function, (_, _, _, _, callers) in stats.items():
+            for caller, (_, _, _, caller_time) in callers.items():
+                callees.setdefault(caller, []).append((function, caller_time))
+
+        stacks = {}
+        def visit(function, path, seen, total_time):
+            # total_time is the time of the function along this stack, a share of its total time
+            own_time, function_total = stats[function][2], stats[function][3]
+            share = total_time / function_total if function_total else 0.0
+            stacks[path] = stacks.get(path, 0) + int(own_time * share * 1_000_000)
+            for callee, caller_time in callees.get(function, ()):
+                callee_time = caller_time * share
+                if callee in seen or callee_time * 1_000_000 < self.MIN_MICROSECONDS:
+                    continue
+                visit(callee, path + (self.frame_label(callee),), seen | {callee}, callee_time)
+
+        for function, (_, _, _, total_time, callers) in stats.items():
+            if not callers: # entry points of the profiled spans
+                visit(function, (self.frame_label(function),), {function}, total_time)
+        return stacks
+
+    @staticmethod
+    def collapsed(stacks):
+        # Formats stacks as collapsed-stack lines, "frame;frame;frame microseconds"
+        return "".join(f"{';'.join(path)} {value}\n" for path, value in sorted(stacks.items()) if value > 0)
+
+    def export(self):
+        """Writes spans.folded (and functions.folded and functions.pstats in cprofile mode) to the profile directory."""
+        if not self.enabled:
+            return
+        with self.export_lock:
+            with self.lock:
+                span_times = dict(self.span_times)
+                self.merge_profiles()
+                function_stats = self.function_stats
+                stats = dict(function_stats.stats) if function_stats is not None else None
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                Metrics.write_file(os.path.join(self.directory, "spans.folded"), self.collapsed(span_times))
+                if stats is not None:
+                    Metrics.write_file(os.path.join(self.directory, "functions.folded"), self.collapsed(self.function_stacks(stats)))
+                    with self.lock:
+                        function_stats.dump_stats(os.path.join(self.directory, "functions.pstats"))
+            except OSError as e:
+                logging.warning(f"Could not write the profiles to {self.directory}: {e}")
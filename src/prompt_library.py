@@ -0,0 +1,215 @@
+import json, logging, os, string, threading
+from tokenizer_service import TokenizerService
+
+class PromptLibrary:
+    """Prompt templates for the GUI's prompt buttons, stored in data/prompts.json, with the token counts of their text precomputed per model.
+
+    A template has a name and a text with {parameter} placeholders ({{ and }} are literal braces). The {input} parameter is filled with
+    the user's message (templates without it are followed by the message), the other parameters are asked for when the template is sent.
+    The static text of a template is split right after the newlines that are followed by a non-space character, where tiktoken never
+    joins text (see TokenizerService), and the count of each piece is computed once per model and saved next to the templates
+    (prompts.json.tokens). Rendering a template then only encodes the parameters and the pieces they touch, and still gives exactly
+    the count of encoding the whole text. """
+
+    INPUT = "input" # the parameter filled with the user's message
+    SIDECAR_EXT = '.tokens'
+    DEFAULT_TEMPLATES = [
+        {"name": "Explain", "text": "Explain the following step by step, in simple terms:\n{input}"},
+        {"name": "Summarize", "text": "Summarize the following text in {count} bullet points, keeping every number and name:\n{input}"},
+        {"name": "Review Code", "text": "Review the following {language} code. Point out bugs, unclear names and missing error handling, "
+                                        "then suggest fixes:\n{input}"},
+        {"name": "Translate", "text": "Translate the following text to {language}. Keep the formatting and do not add comments:\n{input}"},
+        {"name": "Proofread", "text": "Correct the spelling and grammar of the following text, then list the changes you made:\n{input}"},
+        {"name": "Write Tests", "text": "Write unit tests for the following {language} code. Cover the edge cases and the error paths:\n{input}"},
+    ]
+
+    def __init__(self, path, tokenizer=None):
+        """Initializes the PromptLibrary.
+
+        Args:
+            path (str): The path to the templates file. It is created with DEFAULT_TEMPLATES if it does not exist.
+            tokenizer (TokenizerService, optional): Encodes the template pieces and the parameters. """
+
+        self.path = path
+        self.tokenizer = tokenizer if tokenizer is not None else TokenizerService()
+        self.templates = [] # {"name", "text", "pieces": [(literal, parameter name or None)], "parameters": [names]}
+        self.signature = None # (mtime, size) of the loaded templates file
+        self.counts = None # model -> {static piece: token count}, read from the sidecar on first use
+        self.saved_counts = 0 # number of counts in the sidecar file
+        self.lock = threading.Lock()
+
+    def sidecar_path(self):
+        """Returns the path of the file holding the precomputed token counts."""
+        return self.path + self.SIDECAR_EXT
+
+    def load(self):
+        """Returns the templates, reading the templates file again only if it changed. Templates with invalid placeholders are skipped.
+
+        Returns:
+            list: The templates, as dicts with "name", "text", "pieces" and "parameters" (the parameter names, in order). """
+
+        with self.lock:
+            if not os.path.exists(self.path):
+                try:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path, 'w') as file:
+                        json.dump({"templates": self.DEFAULT_TEMPLATES}, file, indent=2)
+                except OSError as e:
+                    logging.warning(f"Could not create the prompt templates file {self.path}: {e}")
+                    self.templates = self.parse_templates(self.DEFAULT_TEMPLATES)
+                    return self.templates
+
+            stat = os.stat(self.path)
+            if (stat.st_mtime_ns, stat.st_size) == self.signature:
+                return self.templates
+            try:
+                with open(self.path, 'r') as file:
+                    self.templates = self.parse_templates(json.load(file).get("templates", []))
+            except (OSError, ValueError, AttributeError) as e: # the user's file is kept as it is, the defaults are used until it is fixed
+                logging.warning(f"Could not read the prompt templates in {self.path}, using the defaults: {e}")
+                self.templates = self.parse_templates(self.DEFAULT_TEMPLATES)
+            self.signature = (stat.st_mtime_ns, stat.st_size)
+            return self.templates
+
+    def parse_templates(self, entries):
+        # Parses the placeholders of the templates, skipping the invalid ones
+        templates = []
+        for entry in entries:
+            try:
+                pieces, parameters = self.parse(entry["text"])
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning(f"Skipping invalid prompt template {entry!r}: {e}")
+                continue
+            templates.append({"name": str(entry.get("name", f"Prompt {len(templates) + 1}")), "text": entry["text"],
+                              "pieces": pieces, "parameters": parameters})
+        return templates
+
+    @staticmethod
+    def parse(text):
+        """Splits a template text into its literal text and its placeholders.
+
+        Returns:
+            tuple: (pieces, parameters). pieces is a list of (literal text, following parameter name or None), parameters lists
+            each parameter name once, in order.
+
+        Raises:
+            ValueError: If a placeholder is not a plain name, like {0}, {name!r} or {name:>10}. """
+
+        pieces = []
+        parameters = []
+        for literal, name, format_spec, conversion in string.Formatter().parse(text):
+            if name is not None and (not name.isidentifier() or format_spec or conversion):
+                raise ValueError(f"Invalid placeholder {{{name}}}, placeholders must be plain names like {{input}}")
+            pieces.append((literal, name))
+            if name is not None and name not in parameters:
+                parameters.append(name)
+        return pieces, parameters
+
+    @staticmethod
+    def split(text):
+        """Splits static template text at the points where tiktoken never joins text, so the counts of the pieces add up exactly."""
+        pieces = []
+        start = 0
+        for boundary in TokenizerService.SPLIT_POINT.finditer(text):
+            pieces.append(text[start:boundary.end()])
+            start = boundary.end()
+        pieces.append(text[start:])
+        return [piece for piece in pieces if piece]
+
+    @staticmethod
+    def is_boundary(before, after):
+        # True if no token spans the end of before and the start of after (a newline followed by a non-space character)
+        return before.endswith("\n") and not after[:1].isspace()
+
+    def piece_counts(self, pieces, model):
+        # Returns the token counts of static pieces for a model, encoding only the pieces that are not cached yet (in one batch)
+        with self.lock:
+            if self.counts is None:
+                try:
+                    with open(self.sidecar_path(), 'r') as file:
+                        self.counts = json.load(file)
+                except FileNotFoundError:
+                    self.counts = {}
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Ignoring unreadable prompt token counts {self.sidecar_path()}: {e}")
+                    self.counts = {}
+                self.saved_counts = sum(len(counts) for counts in self.counts.values())
+            model_counts = self.counts.setdefault(model, {})
+            missing = list({piece for piece in pieces if piece not in model_counts})
+        if missing:
+            lengths = self.tokenizer.encode_lengths(missing, model)
+            with self.lock:
+                model_counts.update(zip(missing, lengths))
+        return model_counts
+
+    def static_pieces(self, template):
+        # Returns the static pieces of a template
+        return [piece for literal, _ in template["pieces"] for piece in self.split(literal)]
+
+    def precompute(self, model):
+        """Computes the token counts of the static text of every template for a model, and saves them next to the templates file."""
+        self.piece_counts([piece for template in self.load() for piece in self.static_pieces(template)], model)
+        self.save_counts()
+
+    def save_counts(self):
+        """Writes the precomputed token counts to the sidecar file, if counts were added since it was last written."""
+        with self.lock:
+            if self.counts is None or sum(len(counts) for counts in self.counts.values()) == self.saved_counts:
+                return
+            text = json.dumps(self.counts)
+            total = sum(len(counts) for counts in self.counts.values())
+        try:
+            temp_path = self.sidecar_path() + ".tmp"
+            with open(temp_path, 'w') as file:
+                file.write(text)
+            os.replace(temp_path, self.sidecar_path())
+            self.saved_counts = total
+        except OSError as e:
+            logging.warning(f"Could not save the prompt token counts to {self.sidecar_path()}: {e}")
+
+    def static_tokens(self, index, model):
+        """Returns the number of tokens of a template without its parameters, from the precomputed counts (used for cost estimates).
+
+        Args:
+            index (int): The position of the template (its prompt button).
+            model (str): The GPT model being used. """
+
+        pieces = self.static_pieces(self.load()[index])
+        counts = self.piece_counts(pieces, model)
+        return sum(counts[piece] for piece in pieces)
+
+    def render(self, index, values, model):
+        """Fills in a template and counts the tokens of the result. Only the parameters, and the static pieces that share
+        a token with them, are encoded; the other pieces use their precomputed counts.
+
+        Args:
+            index (int): The position of the template (its prompt button).
+            values (dict): The value of each parameter, "input" being the user's message. Missing parameters are left empty.
+            model (str): The GPT model being used.
+
+        Returns:
+            tuple: (the rendered text, its number of tokens). """
+
+        template = self.load()[index]
+        parts = [] # (text, precomputed count or None)
+        for literal, name in template["pieces"]:
+            static = self.split(literal)
+            counts = self.piece_counts(static, model)
+            parts.extend((piece, counts[piece]) for piece in static)
+            if name is not None and values.get(name):
+                parts.append((str(values[name]), None))
+        if self.INPUT not in template["parameters"] and values.get(self.INPUT): # templates without {input} are followed by the message
+            parts.append(("\n\n" + str(values[self.INPUT]), None))
+
+        # Pieces that are not separated by a boundary are encoded together
+        groups = []
+        for text, count in parts:
+            if groups and not self.is_boundary(groups[-1][0], text):
+                groups[-1] = (groups[-1][0] + text, None)
+            else:
+                groups.append((text, count))
+        unknown = [text for text, count in groups if count is None]
+        num_tokens = sum(count for _, count in groups if count is not None)
+        if unknown:
+            num_tokens += sum(self.tokenizer.encode_lengths(unknown, model))
+        return "".join(text for text, _ in groups), num_tokens
@@ -0,0 +1,158 @@
+import asyncio, logging, random, threading, time
+from metrics import Metrics
+
+class RateLimiter:
+    """Paces completions calls to stay within the per-model rate limits, and retries calls that were throttled or failed temporarily.
+
+    Each model has two token buckets: requests per minute (RPM) and tokens per minute (TPM). A call reserves one request and its
+    token count (prompt tokens plus max_tokens, which is what OpenAI counts against the TPM limit) before it is sent, and waits until
+    the buckets have refilled if they are overdrawn. Rate limit errors, 5xx responses and connection errors are retried with
+    exponential backoff and full jitter, honoring the server's Retry-After header. The reservation of a failed attempt is given back
+    before the retry reserves again, so a retried call is only counted once. Every delay is logged. """
+
+    # (requests per minute, tokens per minute), matched on the longest prefix of the model name, so "gpt-4-turbo-preview" gets the
+    # gpt-4-turbo limits and not those of gpt-4. Usage tier 1 limits, override them with the 'rate_limits' config ({model: [rpm, tpm]})
+    # to match your account.
+    DEFAULT_LIMITS = {
+        "gpt-3.5-turbo": (3500, 60000),
+        "gpt-4": (500, 10000),
+        "gpt-4-turbo": (500, 150000),
+        "gpt-4-1106": (500, 150000), # gpt-4-1106-preview, the first gpt-4-turbo
+        "gpt-4-0125": (500, 150000), # gpt-4-0125-preview
+        "gpt-4-vision": (80, 10000),
+    }
+
+    def __init__(self, limits=None, max_retries=3, base_delay=1.0, max_delay=30.0, metrics=None):
+        """Initializes the RateLimiter.
+
+        Args:
+            limits (dict): Optional limits that replace or extend the defaults: {model: [rpm, tpm]}.
+            max_retries (int): The number of times a failed call is retried.
+            base_delay (float): The backoff delay of the first retry, in seconds. It doubles on every retry.
+            max_delay (float): The maximum backoff delay, in seconds.
+            metrics (Metrics): Optional, receives the throttling delays and retries. """
+
+        self.limits = dict(self.DEFAULT_LIMITS)
+        for model, (rpm, tpm) in (limits or {}).items():
+            self.limits[model] = (int(rpm), int(tpm))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets = {} # model -> {"requests": float, "tokens": float, "updated": float}, levels may go negative when overdrawn
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.lock = threading.Lock()
+
+    def limits_for(self, model):
+        """Returns the (rpm, tpm) limits of a model, or None if the model has no known limits (its calls are not paced)."""
+        matches = [name for name in self.limits if model == name or model.startswith(name + "-")]
+        if not matches:
+            return None
+        return self.limits[max(matches, key=len)]
+
+    def reserve(self, model, tokens):
+        """Takes one request and the given number of tokens out of the model's buckets.
+
+        Args:
+            model (str): The GPT model of the call.
+            tokens (int): The tokens the call counts against the TPM limit.
+
+        Returns:
+            float: The number of seconds to wait before sending the call (0 if the buckets had room). """
+
+        limits = self.limits_for(model)
+        if limits is None:
+            return 0.0
+        rpm, tpm = limits
+
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets.setdefault(model, {"requests": rpm, "tokens": tpm, "updated": now})
+            elapsed = now - bucket["updated"]
+            bucket["requests"] = min(rpm, bucket["requests"] + elapsed * rpm / 60)
+            bucket["tokens"] = min(tpm, bucket["tokens"] + elapsed * tpm / 60)
+            bucket["updated"] = now
+
+            bucket["requests"] -= 1
+            bucket["tokens"] -= min(tokens, tpm) # a call larger than the whole bucket only waits for a full bucket
+            wait = max(-bucket["requests"] * 60 / rpm, -bucket["tokens"] * 60 / tpm, 0.0)
+        if wait > 0:
+            self.metrics.increment("gpt_throttled_total", model=model)
+            self.metrics.increment("gpt_throttle_seconds_total", wait, model=model)
+        return wait
+
+    def refund(self, model, tokens):
+        """Gives back a reservation made by reserve() for a call that failed, so its retry does not count it a second time."""
+        limits = self.limits_for(model)
+        if limits is None:
+            return
+        rpm, tpm = limits
+        with self.lock:
+            bucket = self.buckets.get(model)
+            if bucket is not None:
+                bucket["requests"] = min(rpm, bucket["requests"] + 1)
+                bucket["tokens"] = min(tpm, bucket["tokens"] + min(tokens, tpm))
+
+    @staticmethod
+    def is_retryable(error):
+        """Returns True for errors worth retrying: rate limits, server errors (5xx), timeouts and connection errors."""
+        from openai import APIConnectionError, APIStatusError, RateLimitError
+        if isinstance(error, (RateLimitError, APIConnectionError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+
+    def retry_delay(self, attempt, error):
+        """Returns the delay before a retry: the server's Retry-After if given, otherwise exponential backoff with full jitter."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                if "retry-after-ms" in response.headers:
+                    return min(self.max_delay, float(response.headers["retry-after-ms"]) / 1000)
+                if "retry-after" in response.headers:
+                    return min(self.max_delay, float(response.headers["retry-after"]))
+            except ValueError: # Retry-After may also be an HTTP date, fall back to backoff
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, model, tokens, attempt, error):
+        # Returns the delay before retrying a failed call, or raises the error if it should not be retried.
+        # The failed attempt's reservation is given back, the retry reserves again
+        if attempt >= self.max_retries or not self.is_retryable(error):
+            raise error
+        self.refund(model, tokens)
+        delay = self.retry_delay(attempt, error)
+        self.metrics.increment("gpt_retries_total", model=model, type=type(error).__name__)
+        logging.warning(f"{model} call failed ({type(error).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s: {error}")
+        return delay
+
+    def call(self, model, tokens, create):
+        """Sends a call within the rate limits, retrying it if it fails temporarily.
+
+        Args:
+            model (str): The GPT model of the call.
+            tokens (int): The tokens the call counts against the TPM limit (prompt tokens plus max_tokens).
+            create (callable): Sends the call and returns its result.
+
+        Returns:
+            The result of create(). The last error is raised if every attempt failed. """
+
+        for attempt in range(self.max_retries + 1):
+            wait = self.reserve(model, tokens)
+            if wait > 0:
+                logging.info(f"Throttling {model} call for {wait:.2f}s to stay within the rate limits ({tokens} tokens)")
+                time.sleep(wait)
+            try:
+                return create()
+            except Exception as e:
+                time.sleep(self.next_delay(model, tokens, attempt, e))
+
+    async def acall(self, model, tokens, create):
+        """Asyncio variant of call(): create() returns a coroutine, and the delays do not block the event loop."""
+        for attempt in range(self.max_retries + 1):
+            wait = self.reserve(model, tokens)
+            if wait > 0:
+                logging.info(f"Throttling {model} call for {wait:.2f}s to stay within the rate limits ({tokens} tokens)")
+                await asyncio.sleep(wait)
+            try:
+                return await create()
+            except Exception as e:
+                await asyncio.sleep(self.next_delay(model, tokens, attempt, e))
@@ -0,0 +1,144 @@
+import itertools, logging, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from conversation_store import ConversationStore
+
+class RequestDispatcher:
+    """Runs the API calls of the GUI on background workers, between Main and ConversationLogic.
+
+    Every conversation has its own bounded send queue. The prompts of a conversation are sent one at a time, in order, so its replies
+    never interleave, while the queues of different conversations are drained in parallel on a shared pool of workers. The workers never
+    touch the widgets: every result is handed to a post_event callback, which the GUI forwards to the Tk main loop. Queued and in-flight
+    requests can be cancelled. """
+
+    def __init__(self, conversation_logic, post_event, max_pending=8, workers=4):
+        """Initializes the RequestDispatcher.
+
+        Args:
+            conversation_logic (ConversationLogic): The GUI's instance. Each request runs on a copy bound to the conversation it was sent in.
+            post_event (callable): Receives the events of the requests: post_event(event, request, data), called from a worker thread.
+                The events are "started", "chunk" (data: str), "done" (data: (response, error)) and "cancelled".
+            max_pending (int): The maximum number of requests waiting to be sent, per conversation.
+            workers (int): The maximum number of conversations sending requests at the same time. """
+
+        self.conversation_logic = conversation_logic
+        self.post_event = post_event
+        self.max_pending = max_pending
+        self.ids = itertools.count(1)
+        self.queues = {} # canonical path -> {"pending": deque of requests, "current": the request being sent, "running": bool}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatcher")
+
+    def submit(self, user_input, filename=None, template=None):
+        """Queues a prompt for a conversation.
+
+        Args:
+            user_input (str): The user's input.
+            filename (str, optional): The conversation the prompt is sent in. Defaults to the current conversation.
+            template (tuple, optional): (template index, parameter values) of a prompt template to fill in with the user's input.
+                The template is rendered on the worker, and request["user_input"] is then the rendered message.
+
+        Returns:
+            dict or None: The request ({"id", "filename", "user_input", ...}), or None if the conversation's queue is full.
+                request["filename"] is the canonical path of the conversation (see ConversationStore.canonical_path()). """
+
+        request = {
+            "id": next(self.ids),
+            "filename": ConversationStore.canonical_path(filename or self.conversation_logic.filename),
+            "user_input": user_input,
+            "template": template,
+            "logic": None, # bound to the conversation on the worker, which may first have to create the API client
+            "cancelled": threading.Event(),
+        }
+        with self.lock:
+            state = self.queues.setdefault(request["filename"], {"pending": deque(), "current": None, "running": False})
+            if len(state["pending"]) >= self.max_pending:
+                return None
+            state["pending"].append(request)
+            if not state["running"]: # start draining the queue, it stops once the queue is empty
+                state["running"] = True
+                self.executor.submit(self.run, request["filename"])
+        return request
+
+    def depth(self, filename=None):
+        """Returns the number of requests waiting or in flight, for one conversation or for all of them."""
+        with self.lock:
+            if filename is None:
+                states = list(self.queues.values())
+            else:
+                filename = ConversationStore.canonical_path(filename)
+                states = [self.queues[filename]] if filename in self.queues else []
+            return sum(len(state["pending"]) + (1 if state["current"] is not None else 0) for state in states)
+
+    def cancel(self, filename=None):
+        """Cancels the request in flight and every queued request, of one conversation or of all of them.
+
+        A streamed response stops at its next chunk and is not saved to the conversation. A non-streamed call cannot be interrupted,
+        it finishes and is saved as usual.
+
+        Returns:
+            int: The number of requests cancelled. """
+
+        if filename is not None:
+            filename = ConversationStore.canonical_path(filename)
+        queued = []
+        in_flight = 0
+        with self.lock:
+            for name, state in self.queues.items():
+                if filename is not None and name != filename:
+                    continue
+                if state["current"] is not None:
+                    state["current"]["cancelled"].set()
+                    in_flight += 1
+                queued.extend(state["pending"])
+                state["pending"].clear()
+        for request in queued:
+            request["cancelled"].set()
+            self.post_event("cancelled", request, None)
+        return in_flight + len(queued)
+
+    def run(self, filename):
+        # Worker task: sends the queued requests of one conversation, one at a time
+        state = self.queues[filename]
+        while True:
+            with self.lock:
+                if not state["pending"]:
+                    state["running"] = False
+                    return
+                request = state["current"] = state["pending"].popleft()
+            try:
+                self.send(request)
+            except Exception as e: # the worker must survive any failure of a single request
+                logging.exception(f"Request {request['id']} failed")
+                self.post_event("done", request, (None, str(e)))
+            finally:
+                with self.lock:
+                    state["current"] = None
+
+    def send(self, request):
+        # Performs one API call, streaming the chunks to the GUI if streaming is enabled
+        logic = request["logic"] = self.conversation_logic.for_conversation(request["filename"])
+        if request["template"] is not None:
+            index, values = request["template"]
+            request["user_input"] = logic.render_prompt(index, dict(values, input=request["user_input"]))
+        self.post_event("started", request, None)
+
+        if not logic.stream:
+            self.post_event("done", request, logic.chat_gpt(request["user_input"]))
+            return
+
+        chunks = []
+        stream = logic.chat_gpt_stream(request["user_input"])
+        try:
+            for chunk, error_response in stream:
+                if error_response is not None:
+                    self.post_event("done", request, (None, error_response))
+                    return
+                if request["cancelled"].is_set():
+                    self.post_event("cancelled", request, None)
+                    return # closing the generator closes the connection, and the turn is not saved
+                chunks.append(chunk)
+                self.post_event("chunk", request, chunk)
+        finally:
+            stream.close()
+        self.post_event("done", request, ("".join(chunks), None))
@@ -0,0 +1,118 @@
+import hashlib, json, logging, os, threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """Optional cache of API responses for repeated prompts (canned prompts, retries after a GUI glitch, ...).
+
+    Entries are keyed on a hash of the model, the trimmed message list and max_tokens, so a hit means the exact same request was sent before.
+    The most recently used entries are held in memory (LRU eviction), and every entry is also written to disk so the cache survives restarts.
+    The disk cache is capped in size, and the least recently used files are removed first. """
+
+    def __init__(self, directory=os.path.join('data', 'response_cache'), max_entries=256, max_disk_bytes=50 * 1024 * 1024):
+        """Initializes the ResponseCache.
+
+        Args:
+            directory (str): Where cached responses are written, one JSON file per entry.
+            max_entries (int): The number of entries held in memory.
+            max_disk_bytes (int): The maximum size of the disk cache, in bytes. """
+
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict() # key -> entry, least recently used first
+        self.disk = None # key -> file size, least recently used first. Scanned on first use.
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, messages, max_tokens):
+        """Returns the cache key of a request: a hash of the model, the (trimmed) messages and max_tokens."""
+        request = json.dumps([model, messages, max_tokens], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached entry for a key, or None on a miss.
+
+        Returns:
+            dict: The cached response with "content", "model", "stop_reason" and "usage" keys. """
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+
+            self.scan_disk()
+            if key not in self.disk:
+                return None
+            try:
+                with open(self.entry_path(key), 'r') as file:
+                    entry = json.load(file)
+                os.utime(self.entry_path(key)) # keeps the disk order by last use across restarts
+            except (OSError, ValueError) as e:
+                logging.warning(f"Dropping unreadable response cache entry {key}: {e}")
+                self.remove_disk_entry(key)
+                return None
+
+            self.disk.move_to_end(key)
+            self.remember(key, entry)
+            return entry
+
+    def put(self, key, entry):
+        """Stores a response in memory and on disk, evicting the least recently used entries past the limits."""
+        with self.lock:
+            self.remember(key, entry)
+            self.scan_disk()
+
+            data = json.dumps(entry)
+            try:
+                with open(self.entry_path(key), 'w') as file:
+                    file.write(data)
+            except OSError as e:
+                logging.warning(f"Could not write response cache entry {key}: {e}")
+                return
+
+            self.disk_bytes += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                oldest_key = next(iter(self.disk))
+                self.remove_disk_entry(oldest_key)
+
+    def remember(self, key, entry):
+        # Adds an entry to the in-memory LRU
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def scan_disk(self):
+        # Builds the disk index (ordered by last use) the first time the disk cache is needed
+        if self.disk is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+        entries.sort()
+        self.disk = OrderedDict((key, size) for _, key, size in entries)
+        self.disk_bytes = sum(self.disk.values())
+
+    def remove_disk_entry(self, key):
+        self.disk_bytes -= self.disk.pop(key, 0)
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Removes every cached response, in memory and on disk."""
+        with self.lock:
+            self.memory.clear()
+            self.scan_disk()
+            for key in list(self.disk):
+                self.remove_disk_entry(key)
@@ -0,0 +1,196 @@
+import logging, os, re, sqlite3, threading
+from conversation_index import ConversationIndex
+
+class SearchIndex:
+    """Full-text search index over the messages of the conversations in the data/ directory (a SQLite FTS5 file, data/search.sqlite3).
+
+    Every message is a row of an FTS5 table (an inverted index ranked with BM25), next to a plain table mapping the row to its
+    conversation file, message position and role. Turns are added once they are written, and refresh() only re-indexes files whose
+    mtime or size changed, like the ConversationIndex. If the SQLite build has no FTS5, search is disabled and returns no results. """
+
+    SNIPPET_TOKENS = 12 # words of context shown around the matches
+
+    def __init__(self, path):
+        """Initializes the SearchIndex.
+
+        Args:
+            path (str): The path to the SQLite search index file. """
+
+        self.path = path
+        self.connection = None # opened on first use
+        self.available = True # False if FTS5 is missing
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # Opens the database and creates the tables the first time the index is used
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL") # the index can always be rebuilt from the files
+            try:
+                connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_text USING fts5(content)")
+            except sqlite3.OperationalError as e:
+                logging.warning(f"Conversation search is disabled, SQLite has no FTS5: {e}")
+                self.available = False
+            # message_text rows share their rowid with the entries rows
+            connection.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, filename TEXT, position INTEGER, role TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_filename ON entries (filename, position)")
+            connection.execute("CREATE TABLE IF NOT EXISTS files (filename TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, message_count INTEGER)")
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    def insert_messages(self, connection, filename, messages, start):
+        # Adds messages to the index, the first one being at position start in the conversation (call with the lock held)
+        for position, message in enumerate(messages, start):
+            cursor = connection.execute("INSERT INTO entries (filename, position, role) VALUES (?, ?, ?)",
+                                        (filename, position, message.get("role", "")))
+            connection.execute("INSERT INTO message_text (rowid, content) VALUES (?, ?)", (cursor.lastrowid, message.get("content") or ""))
+
+    def delete_file(self, connection, filename):
+        # Removes every message of a file from the index (call with the lock held)
+        connection.execute("DELETE FROM message_text WHERE rowid IN (SELECT id FROM entries WHERE filename = ?)", (filename,))
+        connection.execute("DELETE FROM entries WHERE filename = ?", (filename,))
+        connection.execute("DELETE FROM files WHERE filename = ?", (filename,))
+
+    def index_conversation(self, filename, messages, signature):
+        """Replaces the indexed messages of a conversation that was just written.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The full list of messages in the conversation.
+            signature (tuple): The store signature of the file after the write. """
+
+        mtime_ns, size = ConversationIndex.file_state(signature)
+        with self.lock:
+            connection = self.connect()
+            if not self.available:
+                return
+            self.delete_file(connection, filename)
+            self.insert_messages(connection, filename, messages, 0)
+            connection.execute("INSERT INTO files VALUES (?, ?, ?, ?)", (filename, mtime_ns, size, len(messages)))
+            connection.commit()
+
+    def add_messages(self, filename, messages, signature):
+        """Indexes the messages appended to a conversation since it was last indexed, once they are written.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The messages of the conversation that are on disk, including the appended ones.
+            signature (tuple): The store signature of the file after the write.
+
+        Returns:
+            bool: False if the conversation is not indexed yet (refresh() will index all of it). """
+
+        with self.lock:
+            connection = self.connect()
+            if not self.available:
+                return False
+            row = connection.execute("SELECT message_count FROM files WHERE filename = ?", (filename,)).fetchone()
+            if row is None or row[0] > len(messages):
+                return False
+            self.insert_messages(connection, filename, messages[row[0]:], row[0])
+            connection.execute("UPDATE files SET message_count = ?, mtime_ns = ?, size = ? WHERE filename = ?",
+                               (len(messages),) + ConversationIndex.file_state(signature) + (filename,))
+            connection.commit()
+        return True
+
+    def refresh(self, directory, store):
+        """Brings the index up to date with the conversation files in a directory. Only files whose mtime or size changed are read.
+
+        Args:
+            directory (str): The data directory holding the conversation files.
+            store (ConversationStore): Used to read changed conversations and to get file signatures. """
+
+        with self.lock:
+            connection = self.connect()
+            if not self.available:
+                return
+            indexed = {filename: (mtime_ns, size) for filename, mtime_ns, size
+                       in connection.execute("SELECT filename, mtime_ns, size FROM files")}
+
+        present = set()
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.json'):
+                continue
+            filename = store.canonical_path(os.path.join(directory, entry.name)) # the key used everywhere for the file
+            present.add(filename)
+
+            signature = store.signature(filename)
+            if signature[0] is None or indexed.get(filename) == ConversationIndex.file_state(signature):
+                continue
+            try:
+                messages = store.load(filename, cache=False) # indexing does not keep every conversation in memory
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping unreadable conversation {filename} while indexing: {e}")
+                continue
+            self.index_conversation(filename, messages, signature)
+
+        removed = [filename for filename in indexed if filename not in present]
+        if removed:
+            with self.lock:
+                for filename in removed:
+                    self.delete_file(self.connection, filename)
+                self.connection.commit()
+
+    @staticmethod
+    def match_expression(query):
+        """Turns a search box query into an FTS5 MATCH expression.
+
+        Text in double quotes is a phrase, other words are terms, and every phrase and term must match. Each one is quoted, so characters
+        that are FTS5 syntax (like - or *) are searched literally. A single trailing * makes the last term a prefix.
+
+        Returns:
+            str: The expression, or "" if the query has nothing to search for. """
+
+        parts = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            text = phrase if phrase else word.replace('"', '')
+            prefix = word.endswith('*') and len(word) > 1
+            text = text.rstrip('*') if prefix else text
+            if text.strip():
+                parts.append('"' + text.replace('"', '""') + '"' + ('*' if prefix else ''))
+        return " ".join(parts)
+
+    def search(self, query, limit=50):
+        """Searches the indexed messages, best matches first (BM25).
+
+        Args:
+            query (str): Terms and "quoted phrases", see match_expression().
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: Tuples of (filename, position, role, snippet), position being the index of the message in its conversation. """
+
+        expression = self.match_expression(query)
+        with self.lock:
+            connection = self.connect()
+            if not self.available or not expression:
+                return []
+            return connection.execute(
+                "SELECT entries.filename, entries.position, entries.role, "
+                "snippet(message_text, 0, '[', ']', '...', ?) FROM message_text "
+                "JOIN entries ON entries.id = message_text.rowid "
+                "WHERE message_text MATCH ? ORDER BY rank LIMIT ?",
+                (self.SNIPPET_TOKENS, expression, limit),
+            ).fetchall()
+
+    def rename(self, old_filename, new_filename):
+        """Moves the messages of a renamed conversation."""
+        with self.lock:
+            connection = self.connect()
+            if not self.available:
+                return
+            self.delete_file(connection, new_filename)
+            connection.execute("UPDATE entries SET filename = ? WHERE filename = ?", (new_filename, old_filename))
+            connection.execute("UPDATE files SET filename = ? WHERE filename = ?", (new_filename, old_filename))
+            connection.commit()
+
+    def remove(self, filename):
+        """Removes the messages of a deleted conversation."""
+        with self.lock:
+            connection = self.connect()
+            if not self.available:
+                return
+            self.delete_file(connection, filename)
+            connection.commit()
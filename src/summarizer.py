@@ -0,0 +1,178 @@
+import json, logging, os, threading
+from conversation_store import ConversationStore
+
+class ConversationSummarizer:
+    """Folds messages that fall out of the trimming window into a rolling summary of the conversation.
+
+    The summary is stored next to the conversation (<conversation>.summary) together with the number of leading messages it covers,
+    so it is only updated when new messages fall out of the window, never re-summarized on every turn. Messages are folded in batches,
+    which keeps the number of extra summarization calls low once a conversation is longer than the window. Summaries are keyed by the
+    conversation's canonical path (see ConversationStore.canonical_path()), so every name of a file shares one summary. """
+
+    SIDECAR_EXT = '.summary'
+    TEMP_EXT = '.tmp'
+    SUMMARY_PROMPT = (
+        "You maintain a running summary of a conversation between a user and an assistant. "
+        "Merge the existing summary (if any) with the new messages into one concise summary. "
+        "Keep the instructions given to the assistant, names, facts, decisions and open questions. Reply with the summary only."
+    )
+
+    def __init__(self, token_counter, summary_max_tokens=300, batch_messages=10, chunk_tokens=3000, keep_recent=2):
+        """Initializes the ConversationSummarizer.
+
+        Args:
+            token_counter (TokenCounter): Used to size the summarization requests and to validate summaries against the conversation.
+            summary_max_tokens (int): The maximum size of the summary (max_tokens of the summarization call).
+            batch_messages (int): The minimum number of messages folded at a time.
+            chunk_tokens (int): The maximum number of conversation tokens sent in one summarization call.
+            keep_recent (int): The number of newest messages that are never folded. """
+
+        self.token_counter = token_counter
+        self.summary_max_tokens = summary_max_tokens
+        self.batch_messages = batch_messages
+        self.chunk_tokens = chunk_tokens
+        self.keep_recent = keep_recent
+        self.summaries = {} # canonical path -> {"content": str, "covered": int, "last_digest": str}
+        self.lock = threading.Lock()
+
+    def sidecar_path(self, filename):
+        """Returns the path of the summary sidecar for a conversation file."""
+        return filename + self.SIDECAR_EXT
+
+    def load(self, filename, messages):
+        """Returns the saved summary of a conversation, or None if there is none or it no longer matches the conversation (for example after a reset).
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The full list of messages of the conversation.
+
+        Returns:
+            dict: The summary, with "content" and "covered" (the number of leading messages it replaces). """
+
+        filename = ConversationStore.canonical_path(filename)
+        with self.lock:
+            if filename not in self.summaries:
+                try:
+                    with open(self.sidecar_path(filename), 'r') as file:
+                        self.summaries[filename] = json.load(file)
+                except FileNotFoundError:
+                    self.summaries[filename] = None
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Ignoring unreadable summary {self.sidecar_path(filename)}: {e}")
+                    self.summaries[filename] = None
+
+            summary = self.summaries[filename]
+            if summary is None:
+                return None
+
+            covered = summary["covered"]
+            if covered > len(messages) or self.token_counter.digest(messages[covered - 1]) != summary["last_digest"]:
+                return None # the conversation was reset or replaced since the summary was written
+            return summary
+
+    @staticmethod
+    def system_message(pinned, summary):
+        """Returns the system message that stands in for the summarized part of the conversation. The summary is added to the
+        pinned system message, so the prompt keeps a single system message at its start.
+
+        Args:
+            pinned (list): The pinned messages of the conversation (its system message, or nothing).
+            summary (dict): The summary, see load(). """
+
+        summary_text = f"Summary of the earlier conversation: {summary['content']}"
+        if not pinned:
+            return {"role": "system", "content": summary_text}
+        return {**pinned[0], "content": f"{pinned[0]['content']}\n\n{summary_text}"}
+
+    def compact(self, filename, messages, cut, model, request_summary, first=0):
+        """Folds the messages before the trimming cut into the summary, if they are not covered yet.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The full list of messages of the conversation.
+            cut (int): The index of the first message kept by trimming. Messages before it are dropped from the prompt.
+            model (str): The GPT model being used (for token counting).
+            request_summary (callable): Sends a summarization request: request_summary(messages, max_tokens) -> str.
+            first (int): The index of the first message that may be folded (messages before it, like a pinned system message, are always kept).
+
+        Returns:
+            dict or None: The up to date summary. If summarization fails the previous summary is kept. """
+
+        filename = ConversationStore.canonical_path(filename)
+        summary = self.load(filename, messages)
+        covered = summary["covered"] if summary else first
+        if cut <= covered:
+            return summary # nothing new fell out of the window
+
+        # Fold at least a batch of messages, so the next turns do not each need a summarization call
+        end = max(cut, min(covered + self.batch_messages, len(messages) - self.keep_recent))
+        content = summary["content"] if summary else ""
+
+        try:
+            for chunk in self.chunks(messages[covered:end], model):
+                content = self.summarize(content, chunk, request_summary)
+        except Exception as e: # API errors, but also an empty or malformed reply: the summary is optional, the turn must not fail
+            logging.error(f"Summarization failed, falling back to plain trimming: {e}")
+            return summary
+
+        summary = {"content": content, "covered": end, "last_digest": self.token_counter.digest(messages[end - 1])}
+        self.save(filename, summary)
+        logging.info(f"Folded messages {covered}-{end} of {filename} into its summary")
+        return summary
+
+    def chunks(self, messages, model):
+        # Splits the messages to fold into pieces that fit in one summarization call
+        chunk, chunk_tokens = [], 0
+        for message in messages:
+            message_tokens = self.token_counter.count_message(message, model)
+            if chunk and chunk_tokens + message_tokens > self.chunk_tokens:
+                yield chunk
+                chunk, chunk_tokens = [], 0
+            chunk.append(message)
+            chunk_tokens += message_tokens
+        if chunk:
+            yield chunk
+
+    def summarize(self, previous_summary, messages, request_summary):
+        # Sends one summarization request for the previous summary and a chunk of messages
+        transcript = "\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in messages)
+        user_content = f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+        summary_messages = [
+            {"role": "system", "content": self.SUMMARY_PROMPT},
+            {"role": "user", "content": user_content},
+        ]
+        summary = request_summary(summary_messages, self.summary_max_tokens)
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError(f"Empty summarization reply: {summary!r}")
+        return summary
+
+    def save(self, filename, summary):
+        """Saves the summary next to the conversation file. It is written to a temporary file and renamed over the old one,
+        so a crash never leaves a truncated summary."""
+        filename = ConversationStore.canonical_path(filename)
+        with self.lock:
+            self.summaries[filename] = summary
+            temp_path = self.sidecar_path(filename) + self.TEMP_EXT
+            try:
+                with open(temp_path, 'w') as file:
+                    json.dump(summary, file)
+                os.replace(temp_path, self.sidecar_path(filename))
+            except OSError as e:
+                logging.warning(f"Could not save summary {self.sidecar_path(filename)}: {e}")
+
+    def rename_sidecar(self, old_filename, new_filename):
+        """Moves the summary along with a renamed conversation file."""
+        old_filename, new_filename = ConversationStore.canonical_path(old_filename), ConversationStore.canonical_path(new_filename)
+        with self.lock:
+            if os.path.exists(self.sidecar_path(old_filename)):
+                os.replace(self.sidecar_path(old_filename), self.sidecar_path(new_filename))
+            self.summaries.pop(old_filename, None)
+            self.summaries.pop(new_filename, None)
+
+    def remove_sidecar(self, filename):
+        """Removes the summary of a deleted conversation file."""
+        filename = ConversationStore.canonical_path(filename)
+        with self.lock:
+            if os.path.exists(self.sidecar_path(filename)):
+                os.remove(self.sidecar_path(filename))
+            self.summaries.pop(filename, None)
@@ -0,0 +1,52 @@
+import threading
+from tokenizer_service import TokenizerService
+
+class TextTokenCounter:
+    """Counts the tokens of text that is being edited (the user input box), re-encoding only the parts that changed.
+
+    The text is split into lines (long lines into fixed-size pieces) and the count of each piece is kept, so after an edit only the
+    changed pieces are encoded again. The total is the sum of the pieces, which can differ from encoding the whole text by a token
+    or two at the piece boundaries; this is an estimate for display, the API call itself is counted as before. """
+
+    PIECE_CHARS = 2000 # long lines are split into pieces of this many characters
+
+    def __init__(self, tokenizer=None):
+        """Initializes the TextTokenCounter.
+
+        Args:
+            tokenizer (TokenizerService, optional): Encodes the changed pieces (on several threads for large pastes). """
+
+        self.tokenizer = tokenizer if tokenizer is not None else TokenizerService()
+        self.counts = {} # (model, piece) -> token count, only the pieces of the last counted text are kept
+        self.lock = threading.Lock()
+
+    def pieces(self, text):
+        # Splits the text into lines, and long lines into fixed-size pieces
+        for line in text.splitlines(keepends=True):
+            for start in range(0, len(line), self.PIECE_CHARS):
+                yield line[start:start + self.PIECE_CHARS]
+
+    def count(self, text, model):
+        """Returns the number of tokens in the text.
+
+        Args:
+            text (str): The text to count.
+            model (str): The GPT model being used.
+
+        Returns:
+            int: The (estimated) number of tokens. """
+
+        with self.lock:
+            pieces = list(self.pieces(text))
+            missing = list({piece for piece in pieces if (model, piece) not in self.counts})
+            if missing:
+                for piece, num_tokens in zip(missing, self.tokenizer.encode_lengths(missing, model)):
+                    self.counts[(model, piece)] = num_tokens
+
+            total = 0
+            counts = {}
+            for piece in pieces:
+                counts[(model, piece)] = self.counts[(model, piece)]
+                total += counts[(model, piece)]
+            self.counts = counts # drops the pieces that were edited away
+            return total
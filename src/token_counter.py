@@ -0,0 +1,182 @@
+import hashlib, json, logging, os, threading
+from collections import OrderedDict
+from tokenizer_service import TokenizerService
+
+class TokenCounter:
+    """Memoizes per-message token counts so a conversation is only tokenized once.
+
+    Counts are keyed on the model and a digest of the message fields, so an unchanged message is never re-encoded
+    between calls. New messages are encoded in one batch by the TokenizerService, which spreads large batches over several threads.
+    Counts for a conversation can be saved to a sidecar file next to it (<conversation>.tokens) so a reload does not pay the full cost again. """
+
+    SIDECAR_EXT = '.tokens'
+    TEMP_EXT = '.tmp'
+    MAX_DIGESTS = 50_000 # digests of recently counted messages kept in memory, the least recently used are dropped
+
+    def __init__(self, tokenizer=None):
+        """Initializes the TokenCounter.
+
+        Args:
+            tokenizer (TokenizerService, optional): Encodes the messages that are not cached yet. """
+
+        self.tokenizer = tokenizer if tokenizer is not None else TokenizerService()
+        self.counts = {} # model -> {digest: token count of a single message}
+        self.digests = OrderedDict() # (role, content, name) -> digest in LRU order, avoids rehashing the same message every turn
+        self.saved = {} # canonical sidecar path -> number of counts written, used to skip redundant sidecar writes
+        self.lock = threading.RLock() # guards counts and digests, which are shared with the store's flush thread
+
+    @staticmethod
+    def get_encoding(model):
+        """Returns the tiktoken encoding for the given model (shared by every TokenizerService, resolved once per model)."""
+        return TokenizerService.get_encoding(model)
+
+    def digest(self, message):
+        """Returns a stable digest of a message's fields, used as the cache key (and as the key inside sidecar files). """
+        key = (message.get("role"), message.get("content"), message.get("name"))
+        with self.lock:
+            digest = self.digests.get(key)
+            if digest is not None:
+                self.digests.move_to_end(key)
+                return digest
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        with self.lock:
+            self.digests[key] = digest
+            if len(self.digests) > self.MAX_DIGESTS:
+                self.digests.popitem(last=False)
+        return digest
+
+    def count_message(self, message, model):
+        """Counts the tokens of a single message, using the cached count when the message has been seen before.
+
+        Args:
+            message (dict): A message with "role" and "content" keys (and optionally "name").
+            model (str): The GPT model being used.
+
+        Returns:
+            int: The number of tokens in the message, excluding the reply priming tokens. """
+
+        digest = self.digest(message)
+        with self.lock:
+            num_tokens = self.counts.get(model, {}).get(digest)
+        if num_tokens is None:
+            num_tokens = self.count_each([message], model)[0]
+        return num_tokens
+
+    def count_each(self, messages, model):
+        """Counts the tokens of each message. The messages that were not seen before are encoded together, in one batch.
+
+        Args:
+            messages (list): Messages with "role" and "content" keys (and optionally "name").
+            model (str): The GPT model being used.
+
+        Returns:
+            list: The number of tokens of each message, excluding the reply priming tokens. """
+
+        digests = [self.digest(message) for message in messages]
+        with self.lock: # save_sidecar() iterates the counts on the store's flush thread
+            model_counts = self.counts.setdefault(model, {})
+            missing = {}
+            for digest, message in zip(digests, messages):
+                if digest not in model_counts and digest not in missing:
+                    missing[digest] = message
+        if missing: # encoded without the lock, other threads keep counting cached messages meanwhile
+            new_counts = dict(zip(missing, self.tokenizer.count(list(missing.values()), model)))
+            with self.lock:
+                model_counts.update(new_counts)
+        with self.lock:
+            return [model_counts[digest] for digest in digests]
+
+    def remember(self, message, model, content_tokens):
+        """Caches the count of a message whose content was already counted (a rendered prompt template), so it is not encoded
+        again when the message is sent. Only the other fields of the message are encoded.
+
+        Returns:
+            int: The number of tokens in the message, excluding the reply priming tokens. """
+
+        fields = {key: value for key, value in message.items() if key != "content"}
+        num_tokens = self.tokenizer.count([fields], model)[0] + content_tokens
+        with self.lock:
+            self.counts.setdefault(model, {})[self.digest(message)] = num_tokens
+        return num_tokens
+
+    def count(self, messages, model):
+        """Returns the total number of tokens in the messages, excluding the reply priming tokens. See count_each()."""
+        return sum(self.count_each(messages, model))
+
+    def sidecar_path(self, filename):
+        """Returns the path of the token count sidecar for a conversation file. The path is absolute and normalized like
+        ConversationStore.canonical_path(), so every name of a conversation shares one entry in saved. """
+        return os.path.normpath(os.path.abspath(filename)) + self.SIDECAR_EXT
+
+    def load_sidecar(self, filename):
+        """Loads the saved token counts of a conversation into the cache. Missing or unreadable sidecars are ignored,
+        the counts will simply be recomputed. Each sidecar is only read once.
+
+        Args:
+            filename (str): The path to the conversation file. """
+
+        path = self.sidecar_path(filename)
+        if path in self.saved:
+            return
+        try:
+            with open(path, 'r') as file:
+                saved_counts = json.load(file)
+        except FileNotFoundError:
+            self.saved[path] = 0
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable token sidecar {path}: {e}")
+            self.saved[path] = 0
+            return
+
+        with self.lock:
+            total = 0
+            for model, counts in saved_counts.items():
+                self.counts.setdefault(model, {}).update(counts)
+                total += len(counts)
+            self.saved[path] = total
+
+    def save_sidecar(self, filename, messages):
+        """Saves the cached token counts of a conversation's messages next to the conversation file. The sidecar is written to
+        a temporary file and renamed over the old one, so a crash never leaves a truncated sidecar. Nothing is written if no new
+        counts were added since the last save.
+
+        Args:
+            filename (str): The path to the conversation file.
+            messages (list): The messages of the conversation. """
+
+        path = self.sidecar_path(filename)
+        with self.lock:
+            digests = [self.digest(message) for message in messages]
+            saved_counts = {}
+            for model, model_counts in self.counts.items():
+                counts = {digest: model_counts[digest] for digest in digests if digest in model_counts}
+                if counts:
+                    saved_counts[model] = counts
+
+            total = sum(len(counts) for counts in saved_counts.values())
+            if total == self.saved.get(path):
+                return
+
+            try:
+                temp_path = path + self.TEMP_EXT
+                with open(temp_path, 'w') as file:
+                    json.dump(saved_counts, file)
+                os.replace(temp_path, path)
+                self.saved[path] = total
+            except OSError as e:
+                logging.warning(f"Could not save token sidecar {path}: {e}")
+
+    def rename_sidecar(self, old_filename, new_filename):
+        """Moves the sidecar along with a renamed conversation file."""
+        old_path, new_path = self.sidecar_path(old_filename), self.sidecar_path(new_filename)
+        if os.path.exists(old_path):
+            os.replace(old_path, new_path)
+            self.saved[new_path] = self.saved.pop(old_path, None)
+
+    def remove_sidecar(self, filename):
+        """Removes the sidecar of a deleted conversation file."""
+        path = self.sidecar_path(filename)
+        if os.path.exists(path):
+            os.remove(path)
+        self.saved.pop(path, None)
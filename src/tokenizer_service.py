@@ -0,0 +1,116 @@
+import os, re, threading
+
+class TokenizerService:
+    """Encodes text with tiktoken, in batches, spreading large inputs over several threads.
+
+    Small inputs are encoded on the calling thread. Once a batch holds more than parallel_chars characters, it is split into chunks that
+    are encoded with tiktoken's encode_ordinary_batch() on its thread pool: tiktoken encodes in native code without holding the GIL,
+    so the chunks run in parallel on several cores.
+    Long texts are only split right after a newline that is followed by a non-space character. tiktoken's pre-tokenizer never joins
+    text across such a boundary, so the summed counts are exactly those of encoding the whole text. Resolved encoders are shared by
+    every instance (one encoder per model). """
+
+    PARALLEL_CHARS = 200_000 # batches smaller than this are encoded on the calling thread
+    CHUNK_CHARS = 50_000 # target size of the chunks sent to the pool
+    SPLIT_POINT = re.compile(r"\n(?=\S)")
+    _encoders = {} # model -> tiktoken encoding, shared across instances
+    _encoders_lock = threading.Lock()
+
+    def __init__(self, workers=None, parallel_chars=PARALLEL_CHARS):
+        """Initializes the TokenizerService.
+
+        Args:
+            workers (int, optional): The number of threads encoding a large batch. Defaults to the number of CPUs (at most 8).
+            parallel_chars (int): Batches of at least this many characters are encoded on several threads. """
+
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.parallel_chars = parallel_chars
+
+    @classmethod
+    def get_encoding(cls, model):
+        """Returns the tiktoken encoding for the given model, resolving it only once per model.
+
+        Args:
+            model (str): The GPT model being used.
+
+        Returns:
+            tiktoken.Encoding: The encoder for the model (cl100k_base if the model is unknown to tiktoken). """
+
+        encoding = cls._encoders.get(model)
+        if encoding is None:
+            with cls._encoders_lock:
+                encoding = cls._encoders.get(model)
+                if encoding is None:
+                    import tiktoken # imported on first use (usually by the startup warm-up), loading it and its BPE file is slow
+                    try:
+                        encoding = tiktoken.encoding_for_model(model)
+                    except KeyError:
+                        encoding = tiktoken.get_encoding("cl100k_base")
+                    cls._encoders[model] = encoding
+        return encoding
+
+    def split(self, text):
+        """Splits a text into chunks of about CHUNK_CHARS characters whose token counts add up to the count of the whole text."""
+        if len(text) <= self.CHUNK_CHARS:
+            return [text]
+        chunks = []
+        start = 0
+        while len(text) - start > self.CHUNK_CHARS:
+            boundary = self.SPLIT_POINT.search(text, start + self.CHUNK_CHARS)
+            if boundary is None:
+                break # no safe boundary left, the rest is one chunk
+            chunks.append(text[start:boundary.end()])
+            start = boundary.end()
+        chunks.append(text[start:])
+        return chunks
+
+    def encode_lengths(self, texts, model):
+        """Counts the tokens of several texts in one batch. Special tokens like <|endoftext|> are counted as plain text, like the API does.
+
+        Args:
+            texts (list): The texts to count.
+            model (str): The GPT model being used.
+
+        Returns:
+            list: The number of tokens of each text. """
+
+        encoding = self.get_encoding(model)
+        if sum(len(text) for text in texts) < self.parallel_chars:
+            return [len(encoding.encode_ordinary(text)) for text in texts]
+
+        owners = [] # index of the text each chunk belongs to
+        chunks = []
+        for i, text in enumerate(texts):
+            for chunk in self.split(text):
+                owners.append(i)
+                chunks.append(chunk)
+        lengths = [0] * len(texts)
+        for owner, tokens in zip(owners, encoding.encode_ordinary_batch(chunks, num_threads=self.workers)):
+            lengths[owner] += len(tokens)
+        return lengths
+
+    def count_text(self, text, model):
+        """Returns the number of tokens in a text."""
+        return self.encode_lengths([text], model)[0]
+
+    def count(self, messages, model):
+        """Counts the tokens of chat messages, with the per-message overhead of the chat format (but not the reply priming).
+
+        Args:
+            messages (list): Messages with "role" and "content" keys (and optionally "name").
+            model (str): The GPT model being used.
+
+        Returns:
+            list: The number of tokens of each message. """
+
+        values = [value for message in messages for value in message.values()]
+        lengths = iter(self.encode_lengths(values, model))
+        counts = []
+        for message in messages:
+            num_tokens = 4 # Every message follows <im_start>{role/name}\n{content}<im_end>\n
+            for key in message:
+                num_tokens += next(lengths)
+                if key == "name": # If there's a name, the role is omitted
+                    num_tokens += -1 # Role is always required and always 1 token
+            counts.append(num_tokens)
+        return counts
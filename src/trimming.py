@@ -0,0 +1,58 @@
+from bisect import bisect_left
+
+class TokenPrefixIndex:
+    """Cumulative token counts (prefix sums) of a conversation's messages, used to find the trimming cut point by binary search.
+
+    prefix[i] is the number of tokens in messages[0:i]. The index is extended incrementally as messages are appended, and is rebuilt
+    when the conversation it was built for changed in another way: the store's generation of the conversation changed (after a reset,
+    an import, a rename or a change made outside of the app), or the last indexed message is not the same anymore. """
+
+    def __init__(self):
+        self.prefix = [0]
+        self.last_digest = None # digest of the last indexed message, used to check the conversation was only appended to
+        self.generation = None # the store generation of the conversation the index was built for
+
+    def sync(self, messages, count_messages, digest, generation=None):
+        """Brings the index up to date with the messages, counting only the messages appended since the last call.
+
+        Args:
+            messages (list): The full list of messages in the conversation.
+            count_messages (callable): Returns the token count of each message of a list (the new messages are counted in one batch).
+            digest (callable): Returns a stable digest of a single message.
+            generation (int, optional): The store generation of the conversation (see ConversationStore.generation()). """
+
+        indexed = len(self.prefix) - 1
+        if (generation != self.generation or indexed > len(messages)
+                or (indexed and digest(messages[indexed - 1]) != self.last_digest)):
+            self.prefix = [0] # the conversation was modified, not appended to
+            indexed = 0
+        self.generation = generation
+
+        total = self.prefix[-1]
+        for num_tokens in count_messages(messages[indexed:]):
+            total += num_tokens
+            self.prefix.append(total)
+        if messages:
+            self.last_digest = digest(messages[-1])
+
+    def invalidate(self):
+        """Drops the prefix sums, the next sync() counts the whole conversation again."""
+        self.prefix = [0]
+        self.last_digest = None
+
+    def cut_index(self, start, end, budget):
+        """Returns the smallest index i in [start, end] such that messages[i:end] fit within the budget.
+
+        Args:
+            start (int): The first message that may be kept.
+            end (int): The number of messages considered.
+            budget (int): The number of tokens available for messages[i:end].
+
+        Returns:
+            int: The cut point. messages[i:end] is the longest suffix that fits (end if nothing fits). """
+
+        return bisect_left(self.prefix, self.prefix[end] - budget, lo=start, hi=end)
+
+    def tokens(self, start, end):
+        """Returns the number of tokens in messages[start:end]."""
+        return self.prefix[end] - self.prefix[start]
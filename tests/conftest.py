@@ -0,0 +1,55 @@
+"""Shared fixtures. The modules in src/ import each other by bare name, so src/ is put on the path like the benchmarks do.
+
+Token counts come from WordTokenizer, which counts words instead of loading tiktoken, so the tests run offline. The tests of the exact
+counts use the cl100k_base fixture, and are skipped when tiktoken cannot load the encoding (no network and no TIKTOKEN_CACHE_DIR). """
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from conversation_store import ConversationStore
+from message_store import MessageStore
+from tokenizer_service import TokenizerService
+from token_counter import TokenCounter
+
+class WordTokenizer(TokenizerService):
+    """A TokenizerService counting one token per word, with the chat format overhead of the real one (see TokenizerService.count())."""
+
+    def encode_lengths(self, texts, model):
+        return [len(text.split()) for text in texts]
+
+class StaticConfig:
+    """Stands in for ConfigManager, without reading or writing configs.json."""
+
+    def __init__(self, config):
+        self.config = config
+
+def conversation(count, start=0):
+    """Returns count user/assistant messages, numbered from start."""
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message number {i}"} for i in range(start, start + count)]
+
+@pytest.fixture
+def token_counter():
+    return TokenCounter(WordTokenizer())
+
+@pytest.fixture(scope="session")
+def cl100k_base():
+    # The encoding of the gpt-4 and gpt-3.5-turbo models
+    try:
+        return TokenizerService.get_encoding("gpt-4")
+    except Exception as e: # downloading the BPE file failed
+        pytest.skip(f"cl100k_base is not available: {e}")
+
+@pytest.fixture
+def store():
+    # Flushes only when asked to, so the tests decide what is on disk
+    return ConversationStore(flush_interval=3600)
+
+@pytest.fixture
+def message_store(tmp_path):
+    message_store = MessageStore(str(tmp_path / "messages.sqlite3"))
+    yield message_store
+    if message_store.connection is not None:
+        message_store.connection.close()
@@ -0,0 +1,34 @@
+import asyncio, os
+
+import pytest
+
+from async_conversation_logic import AsyncConversationLogic
+from conftest import StaticConfig
+
+@pytest.fixture
+def logic(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    monkeypatch.setattr(AsyncConversationLogic, "_clients", {})
+    return AsyncConversationLogic(StaticConfig({"filename": os.path.join("data", "a.json"), "OPENAI_API_KEY": "sk-test"}))
+
+def test_every_event_loop_gets_its_own_client(logic):
+    async def clients():
+        return logic.client, logic.for_conversation(os.path.join("data", "b.json")).client
+
+    first, shared = asyncio.run(clients())
+    assert first is shared # instances on one loop share the client
+
+    second, _ = asyncio.run(clients())
+    assert second is not first # the first loop is closed, its connections cannot be reused
+    assert first not in AsyncConversationLogic._clients.values()
+
+def test_close_clients_closes_the_clients_of_the_running_loop(logic):
+    async def run():
+        client = logic.client
+        await AsyncConversationLogic.close_clients()
+        return client
+
+    client = asyncio.run(run())
+    assert client.is_closed()
+    assert AsyncConversationLogic._clients == {}
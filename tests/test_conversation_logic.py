@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from conftest import StaticConfig, WordTokenizer, conversation
+from conversation_logic import ConversationLogic
+from token_counter import TokenCounter
+
+SYSTEM = {"role": "system", "content": "you are a test"}
+
+@pytest.fixture
+def logic(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    logic = ConversationLogic(StaticConfig({"filename": os.path.join("data", "a.json"), "model": "gpt-4", "flush_interval": 3600}))
+    logic.token_counter = TokenCounter(WordTokenizer())
+    logic.save_conversation_to_file(logic.filename, [SYSTEM] + conversation(20))
+    yield logic
+    for database in (logic.index, logic.search_index):
+        if database.connection is not None:
+            database.connection.close()
+
+def expected_cut(logic, messages, remaining_tokens):
+    # The first message after the system message from which the rest fits, counted without the prefix sums
+    budget = remaining_tokens - logic.token_counter.count([SYSTEM], logic.model) - 2
+    return next((cut for cut in range(1, len(messages)) if logic.token_counter.count(messages[cut:], logic.model) <= budget), len(messages))
+
+def test_trim_cut_pins_the_system_message(logic):
+    messages = logic.load_conversation()["messages"]
+    for remaining_tokens in (0, 20, 50, 100, 1000):
+        pinned, cut = logic.find_trim_cut(messages, remaining_tokens)
+        assert pinned == [SYSTEM]
+        assert cut == expected_cut(logic, messages, remaining_tokens)
+
+def test_trim_cut_follows_appends_and_resets(logic):
+    messages = logic.load_conversation()["messages"]
+    logic.find_trim_cut(messages, 60)
+
+    # An alias of the same file extends the same prefix sums
+    logic.for_conversation(os.path.join(".", "data", "a.json")).update_conversation("message number 20", "message number 21")
+    messages = logic.load_conversation()["messages"]
+    assert logic.find_trim_cut(messages, 60)[1] == expected_cut(logic, messages, 60)
+    assert len(logic.prefix_indexes) == 1
+
+    # A reset replaces the messages, the prefix sums are rebuilt
+    logic.save_conversation_to_file(logic.filename, [SYSTEM] + [{"role": "user", "content": "a b c d e f g h i j"}] * 10)
+    messages = logic.load_conversation()["messages"]
+    assert logic.find_trim_cut(messages, 60)[1] == expected_cut(logic, messages, 60)
+
+def test_index_rows_follow_the_flushed_messages(logic):
+    key = logic.index_key(logic.filename)
+    logic.update_conversation("message number 20", "message number 21")
+
+    # Appended messages are only indexed once they are on disk
+    assert logic.index.list()[0][:2] == (key, 21)
+    assert logic.search_index.search('"message number 21"') == []
+
+    logic.flush()
+    expected_tokens = logic.token_counter.count([SYSTEM] + conversation(22), logic.model)
+    assert logic.index.list()[0][:3] == (key, 23, expected_tokens)
+    assert len(logic.search_index.search('"message number 21"')) == 1
@@ -0,0 +1,169 @@
+import json, os
+
+import pytest
+
+from conftest import conversation
+from conversation_store import ConversationStore
+
+def log_lines(filename):
+    with open(filename + ConversationStore.LOG_EXT, 'r') as file:
+        return [json.loads(line) for line in file]
+
+def test_append_is_kept_in_memory_until_flushed(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(2, start=3))
+
+    assert store.load(filename) == conversation(5)
+    assert not os.path.exists(filename + ConversationStore.LOG_EXT)
+
+    store.flush()
+    assert [entry["position"] for entry in log_lines(filename)] == [3, 4]
+
+def test_flush_reports_the_durable_message_count(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    flushed = []
+    store.add_flush_listener(lambda name, signature, count: flushed.append((name, count)))
+
+    store.append(filename, conversation(2, start=3))
+    store.flush()
+    assert flushed == [(ConversationStore.canonical_path(filename), 5)]
+
+def test_reload_reads_the_snapshot_and_the_log(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(2, start=3))
+    store.flush()
+
+    reloaded = ConversationStore(flush_interval=3600)
+    assert reloaded.load(filename) == conversation(5)
+    assert reloaded.load_tail(filename, 2) == (conversation(2, start=3), 5)
+
+def test_load_returns_a_copy(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.load(filename).append({"role": "user", "content": "not saved"})
+    assert store.load(filename) == conversation(3)
+
+def test_compact_snapshot_round_trip(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(50), snapshot_format="compact")
+    store.append(filename, conversation(1, start=50))
+    store.flush()
+
+    reloaded = ConversationStore(flush_interval=3600)
+    assert reloaded.snapshot_format_of(filename) == "compact"
+    assert reloaded.load_tail(filename, 3) == (conversation(3, start=48), 51)
+    assert reloaded.load(filename) == conversation(51)
+
+def test_save_replaces_the_log(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(2, start=3))
+    store.flush()
+
+    store.save(filename, conversation(1))
+    assert not os.path.exists(filename + ConversationStore.LOG_EXT)
+    assert ConversationStore(flush_interval=3600).load(filename) == conversation(1)
+
+def test_rename_moves_the_snapshot_and_the_log(tmp_path, store):
+    old_filename, new_filename = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    store.save(old_filename, conversation(3))
+    store.append(old_filename, conversation(2, start=3)) # pending, flushed by rename()
+
+    store.rename(old_filename, new_filename)
+    assert not os.path.exists(old_filename) and not os.path.exists(old_filename + ConversationStore.LOG_EXT)
+    assert store.load(new_filename) == conversation(5)
+    assert ConversationStore(flush_interval=3600).load(new_filename) == conversation(5)
+
+def test_rename_drops_the_conversation_it_replaces(tmp_path, store):
+    old_filename, new_filename = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    store.save(old_filename, conversation(3))
+    store.save(new_filename, conversation(7))
+    store.load(new_filename)
+
+    store.rename(old_filename, new_filename)
+    assert store.load(new_filename) == conversation(3)
+
+def test_remove_deletes_the_snapshot_and_the_log(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(1, start=3))
+    store.flush()
+
+    store.remove(filename)
+    assert not os.path.exists(filename) and not os.path.exists(filename + ConversationStore.LOG_EXT)
+    with pytest.raises(FileNotFoundError):
+        store.load(filename)
+
+def test_generation_changes_on_reads_and_saves_only(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    saved = store.generation(filename)
+
+    store.append(filename, conversation(1, start=3))
+    assert store.generation(filename) == saved
+
+    store.save(filename, conversation(2))
+    assert store.generation(filename) != saved
+
+def test_partial_last_line_is_ignored(tmp_path, store):
+    # A crash in the middle of a write leaves a truncated last line
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(1, start=3))
+    store.flush()
+    with open(filename + ConversationStore.LOG_EXT, 'a') as file:
+        file.write('{"position": 4, "message": {"role": "us')
+
+    recovered = ConversationStore(flush_interval=3600)
+    assert recovered.load(filename) == conversation(4)
+
+    # The next write starts on a new line instead of being glued to the partial one
+    recovered.append(filename, conversation(1, start=4))
+    recovered.flush()
+    assert ConversationStore(flush_interval=3600).load(filename) == conversation(5)
+
+def test_lines_already_in_the_snapshot_are_skipped(tmp_path, store):
+    # A crash after a log was folded into the snapshot, but before the log was removed
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(5))
+    with open(filename + ConversationStore.LOG_EXT, 'w') as file:
+        for position, message in enumerate(conversation(2, start=3), start=3):
+            file.write(json.dumps({"position": position, "message": message}) + "\n")
+
+    assert ConversationStore(flush_interval=3600).load(filename) == conversation(5)
+
+def test_repeated_lines_are_folded(tmp_path, store):
+    # A write retried after a partial failure repeats lines that were already written
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(2, start=3))
+    store.flush()
+    with open(filename + ConversationStore.LOG_EXT, 'r') as file:
+        text = file.read()
+    with open(filename + ConversationStore.LOG_EXT, 'a') as file:
+        file.write(text)
+
+    assert ConversationStore(flush_interval=3600).load(filename) == conversation(5)
+
+def test_two_messages_at_one_position_fail_the_load(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    store.append(filename, conversation(1, start=3))
+    store.flush()
+    with open(filename + ConversationStore.LOG_EXT, 'a') as file:
+        file.write(json.dumps({"position": 3, "message": {"role": "user", "content": "something else"}}) + "\n")
+
+    with pytest.raises(ValueError, match="two different messages"):
+        ConversationStore(flush_interval=3600).load(filename)
+
+def test_missing_positions_fail_the_load(tmp_path, store):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(3))
+    with open(filename + ConversationStore.LOG_EXT, 'w') as file:
+        file.write(json.dumps({"position": 5, "message": conversation(1)[0]}) + "\n")
+
+    with pytest.raises(ValueError, match="missing"):
+        ConversationStore(flush_interval=3600).load(filename)
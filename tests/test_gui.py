@@ -0,0 +1,54 @@
+import queue
+
+import pytest
+
+from gui import Main
+
+class QueueOwner:
+    """Holds the attributes Main.process_ui_queue() uses, without creating any widget (the tests run without a display)."""
+
+    UI_POLL_MS = Main.UI_POLL_MS
+
+    def __init__(self):
+        self.ui_queue = queue.Queue()
+        self.scheduled = []
+
+    def after(self, delay, callback):
+        self.scheduled.append((delay, callback))
+
+    def process_ui_queue(self):
+        Main.process_ui_queue(self)
+
+def test_a_failing_callback_does_not_stop_the_ui_queue():
+    owner = QueueOwner()
+    ran = []
+    def failing():
+        raise RuntimeError("invalid command name")
+    owner.ui_queue.put(failing)
+    owner.ui_queue.put(lambda: ran.append("next"))
+
+    owner.process_ui_queue()
+    assert ran == ["next"]
+    assert owner.scheduled == [(Main.UI_POLL_MS, owner.process_ui_queue)] # polling goes on
+
+class FailingLogic:
+    def list_conversations(self, sort_by, descending):
+        raise RuntimeError("corrupt index")
+
+class StatusVar:
+    def __init__(self):
+        self.value = ""
+
+    def set(self, value):
+        self.value = value
+
+def test_a_failing_conversation_list_is_reported():
+    owner = QueueOwner()
+    owner.treeview_sort = ("updated_at", True)
+    owner.conversation_logic = FailingLogic()
+    owner.status_var = StatusVar()
+    owner.populate_treeview = lambda conversations: pytest.fail("nothing to show")
+
+    Main.refresh_treeview(owner)
+    owner.ui_queue.get(timeout=5)()
+    assert "corrupt index" in owner.status_var.value
@@ -0,0 +1,90 @@
+import json
+
+from conversation_store import ConversationStore
+
+def body_count(message_store):
+    return message_store.connect().execute("SELECT COUNT(*) FROM bodies").fetchone()[0]
+
+SHARED = [{"role": "system", "content": "a default system message long enough to be stored by reference"}]
+
+def long_messages(count, start=0):
+    return [{"role": "user", "content": f"message number {i}, long enough to be stored by reference"} for i in range(start, start + count)]
+
+def test_reference_round_trip(tmp_path, message_store):
+    filename = str(tmp_path / "a.json")
+    messages = SHARED + [{"role": "user", "content": "short"}]
+    stored = message_store.reference(filename, messages)
+
+    assert message_store.is_reference(stored[0])
+    assert stored[1] == messages[1] # shorter than a reference, kept inline
+    assert message_store.dereference(stored) == messages
+
+def test_shared_bodies_are_stored_once(tmp_path, message_store):
+    for name in ("a.json", "b.json"):
+        stored = message_store.reference(str(tmp_path / name), SHARED + long_messages(2))
+        message_store.retain(str(tmp_path / name), stored)
+    assert body_count(message_store) == 3
+
+def test_retain_collects_bodies_no_file_refers_to(tmp_path, message_store):
+    a, b = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    message_store.retain(a, message_store.reference(a, SHARED + long_messages(2)))
+    message_store.retain(b, message_store.reference(b, SHARED))
+
+    # a is rewritten without its own messages: they are deleted, the shared one is kept for b
+    assert message_store.retain(a, message_store.reference(a, SHARED)) == 2
+    assert body_count(message_store) == 1
+
+    assert message_store.release(a) == 0
+    assert message_store.release(b) == 1
+    assert body_count(message_store) == 0
+
+def test_rename_moves_the_references(tmp_path, message_store):
+    a, b = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    message_store.retain(a, message_store.reference(a, SHARED + long_messages(1)))
+    message_store.retain(b, message_store.reference(b, long_messages(1, start=5)))
+
+    message_store.rename(a, b) # b is replaced, its message is collected
+    assert body_count(message_store) == 2
+    assert message_store.release(a) == 0
+    assert message_store.release(b) == 2
+
+def test_references_are_keyed_by_canonical_path(tmp_path, monkeypatch, message_store):
+    monkeypatch.chdir(tmp_path)
+    stored = message_store.reference("a.json", SHARED)
+    message_store.retain("a.json", stored)
+    assert message_store.release(str(tmp_path / "a.json")) == 1
+
+def test_store_garbage_collects_on_save_and_remove(tmp_path, message_store):
+    store = ConversationStore(flush_interval=3600, message_store=message_store, deduplicate=True)
+    a, b = str(tmp_path / "a.json"), str(tmp_path / "b.json")
+    store.save(a, SHARED + long_messages(3))
+    store.save(b, SHARED + long_messages(1, start=10))
+    assert body_count(message_store) == 5
+    with open(a, 'r') as file:
+        assert all(message_store.is_reference(message) for message in json.load(file)["messages"])
+
+    store.save(a, SHARED + long_messages(1)) # the two dropped messages are collected
+    assert body_count(message_store) == 3
+
+    store.remove(a)
+    assert body_count(message_store) == 2
+    assert ConversationStore(flush_interval=3600, message_store=message_store).load(b) == SHARED + long_messages(1, start=10)
+
+def test_inline_save_releases_the_bodies(tmp_path, message_store):
+    # Rewriting without deduplication (main.py --inline) puts the messages back in the file
+    filename = str(tmp_path / "a.json")
+    ConversationStore(flush_interval=3600, message_store=message_store, deduplicate=True).save(filename, SHARED + long_messages(2))
+
+    store = ConversationStore(flush_interval=3600, message_store=message_store)
+    store.convert(filename)
+    assert body_count(message_store) == 0
+    assert ConversationStore(flush_interval=3600).load(filename) == SHARED + long_messages(2)
+
+def test_logged_messages_stay_inline(tmp_path, message_store):
+    store = ConversationStore(flush_interval=3600, message_store=message_store, deduplicate=True)
+    filename = str(tmp_path / "a.json")
+    store.save(filename, SHARED)
+    store.append(filename, long_messages(1))
+    store.flush()
+    assert body_count(message_store) == 1
+    assert ConversationStore(flush_interval=3600, message_store=message_store).load(filename) == SHARED + long_messages(1)
@@ -0,0 +1,121 @@
+import os, threading
+
+from conftest import conversation
+from conversation_index import ConversationIndex
+from conversation_store import ConversationStore
+from request_dispatcher import RequestDispatcher
+from summarizer import ConversationSummarizer
+
+def aliases(tmp_path):
+    # Three names of one file: relative, relative with a dot segment, and absolute
+    return os.path.join("data", "a.json"), os.path.join(".", "data", "..", "data", "a.json"), str(tmp_path / "data" / "a.json")
+
+def test_aliases_share_one_canonical_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert len({ConversationStore.canonical_path(name) for name in aliases(tmp_path)}) == 1
+
+def test_aliases_share_one_conversation(tmp_path, monkeypatch, store):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    relative, dotted, absolute = aliases(tmp_path)
+    store.save(relative, conversation(3))
+
+    store.append(dotted, conversation(1, start=3))
+    store.append(absolute, conversation(1, start=4))
+    assert store.load(relative) == conversation(5)
+    assert store.generation(dotted) == store.generation(absolute)
+
+    store.flush()
+    assert len(store.conversations) == 1
+    assert ConversationStore(flush_interval=3600).load(absolute) == conversation(5)
+
+def test_index_rows_are_keyed_by_canonical_path(tmp_path, monkeypatch, store, token_counter):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    relative, dotted, absolute = aliases(tmp_path)
+    store.save(relative, conversation(3))
+    index = ConversationIndex(str(tmp_path / "index.sqlite3"))
+    count_tokens = lambda messages: token_counter.count(messages, "gpt-4")
+    store.add_flush_listener(lambda name, signature, count: index.record_append(name, store.load(name)[:count], signature, count_tokens))
+
+    index.refresh("data", store, lambda filename, messages: count_tokens(messages))
+    store.append(dotted, conversation(2, start=3))
+    store.flush()
+
+    rows = index.list()
+    assert [(row[0], row[1], row[2]) for row in rows] == [(absolute, 5, count_tokens(conversation(5)))]
+
+    index.refresh("data", store, lambda filename, messages: count_tokens(messages)) # up to date, nothing is added
+    assert len(index.list()) == 1
+
+def test_aliases_share_one_summary(tmp_path, monkeypatch, token_counter):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    relative, dotted, absolute = aliases(tmp_path)
+    summarizer = ConversationSummarizer(token_counter, batch_messages=2, keep_recent=2)
+    messages = conversation(10)
+    requests = []
+    def request_summary(summary_messages, max_tokens):
+        requests.append(summary_messages)
+        return "the summary"
+
+    summary = summarizer.compact(relative, messages, 3, "gpt-4", request_summary)
+    assert summarizer.compact(dotted, messages, 3, "gpt-4", request_summary) == summary
+    assert summarizer.compact(absolute, messages, 3, "gpt-4", request_summary) == summary
+    assert len(requests) == 1 # the covered messages were not summarized again under another name
+    assert list(summarizer.summaries) == [absolute]
+
+    summarizer.remove_sidecar(dotted)
+    assert summarizer.summaries == {} and not os.path.exists(absolute + summarizer.SIDECAR_EXT)
+
+class BlockingLogic:
+    """Stands in for ConversationLogic in the dispatcher: every call waits until release is set."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stream = False
+        self.release = threading.Event()
+
+    def for_conversation(self, filename):
+        return self
+
+    def chat_gpt(self, user_input):
+        self.release.wait(5)
+        return user_input, None
+
+def test_dispatcher_queues_are_keyed_by_canonical_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    relative, dotted, absolute = aliases(tmp_path)
+    logic = BlockingLogic(relative)
+    done = []
+    finished = threading.Event()
+    def post_event(event, request, data):
+        if event == "done":
+            done.append(request["user_input"])
+            if len(done) == 3:
+                finished.set()
+    dispatcher = RequestDispatcher(logic, post_event)
+
+    requests = [dispatcher.submit("first"), dispatcher.submit("second", dotted), dispatcher.submit("third", absolute)]
+    assert {request["filename"] for request in requests} == {absolute}
+    assert list(dispatcher.queues) == [absolute]
+    assert dispatcher.depth(relative) == dispatcher.depth(dotted) == 3
+
+    logic.release.set()
+    assert finished.wait(5)
+    assert done == ["first", "second", "third"] # one queue, so the prompts were sent in order
+    dispatcher.executor.shutdown()
+
+def test_aliases_share_one_token_sidecar(tmp_path, monkeypatch, token_counter):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    relative, dotted, absolute = aliases(tmp_path)
+    messages = conversation(4)
+    token_counter.count(messages, "gpt-4")
+
+    token_counter.save_sidecar(relative, messages)
+    modified = os.stat(absolute + token_counter.SIDECAR_EXT).st_mtime_ns
+    os.utime(absolute + token_counter.SIDECAR_EXT, ns=(0, 0))
+    token_counter.save_sidecar(dotted, messages) # the counts were saved under another name, nothing is written
+    assert os.stat(absolute + token_counter.SIDECAR_EXT).st_mtime_ns == 0 != modified
+    assert list(token_counter.saved) == [absolute + token_counter.SIDECAR_EXT]
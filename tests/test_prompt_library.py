@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from prompt_library import PromptLibrary
+from tokenizer_service import TokenizerService
+
+VALUES = [
+    {"input": "plain text", "count": "3", "language": "Python"},
+    {"input": "  starts with spaces\nand ends with spaces  ", "count": " 5 ", "language": " French"},
+    {"input": "\nstarts with a newline\n\nends with one\n", "count": "\n4", "language": "Go\n"},
+    {"input": "\r\nCRLF\r\n    indented\ncafé 日本語 🙂\n", "count": "", "language": "\tRust\t"},
+]
+
+@pytest.fixture
+def library(tmp_path):
+    return PromptLibrary(str(tmp_path / "prompts.json"), TokenizerService())
+
+@pytest.mark.parametrize("values", VALUES)
+def test_rendered_counts_are_exact(library, values, cl100k_base):
+    for index, template in enumerate(library.load()):
+        text, num_tokens = library.render(index, values, "gpt-4")
+        assert num_tokens == len(cl100k_base.encode_ordinary(text)), (template["name"], text)
+
+@pytest.mark.parametrize("values", VALUES)
+def test_templates_without_input_are_followed_by_the_message(tmp_path, values, cl100k_base):
+    path = tmp_path / "prompts.json"
+    path.write_text(json.dumps({"templates": [
+        {"name": "No input", "text": "Answer in {language}.\nBe brief."},
+        {"name": "Input after a newline", "text": "Context:\n{input}\nQuestion:\n{language}"},
+    ]}))
+    library = PromptLibrary(str(path), TokenizerService())
+
+    text, num_tokens = library.render(0, values, "gpt-4")
+    assert text.endswith("\n\n" + values["input"])
+    assert num_tokens == len(cl100k_base.encode_ordinary(text))
+
+    text, num_tokens = library.render(1, values, "gpt-4")
+    assert num_tokens == len(cl100k_base.encode_ordinary(text))
+
+class NoTokenizer(TokenizerService):
+    def encode_lengths(self, texts, model):
+        raise AssertionError(f"encoded {texts!r}")
+
+def test_static_counts_come_from_the_sidecar(library, cl100k_base):
+    library.precompute("gpt-4")
+    reloaded = PromptLibrary(library.path, NoTokenizer())
+    for index, template in enumerate(reloaded.load()):
+        literals = [literal for literal, _ in template["pieces"]]
+        assert reloaded.static_tokens(index, "gpt-4") == sum(len(cl100k_base.encode_ordinary(literal)) for literal in literals)
+
+def test_boundaries_are_newlines_followed_by_text():
+    assert PromptLibrary.is_boundary("line\n", "next")
+    assert not PromptLibrary.is_boundary("line\n", " indented")
+    assert not PromptLibrary.is_boundary("line\n", "\nblank")
+    assert not PromptLibrary.is_boundary("line", "\nnext")
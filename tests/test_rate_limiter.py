@@ -0,0 +1,97 @@
+import pytest
+
+from rate_limiter import RateLimiter
+
+class Clock:
+    """A monotonic clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("rate_limiter.time.monotonic", clock)
+    return clock
+
+def test_limits_match_the_longest_model_prefix():
+    limiter = RateLimiter()
+    assert limiter.limits_for("gpt-4") == (500, 10000)
+    assert limiter.limits_for("gpt-4-0613") == (500, 10000)
+    assert limiter.limits_for("gpt-4-turbo-preview") == (500, 150000)
+    assert limiter.limits_for("gpt-4-1106-preview") == (500, 150000)
+    assert limiter.limits_for("gpt-4-0125-preview") == (500, 150000)
+    assert limiter.limits_for("gpt-3.5-turbo-1106") == (3500, 60000)
+    assert limiter.limits_for("gpt-40") is None # a prefix only matches whole name parts
+    assert limiter.limits_for("davinci-002") is None
+
+def test_configured_limits_override_the_defaults():
+    limiter = RateLimiter({"gpt-4": [10, 600], "my-model": [1, 100]})
+    assert limiter.limits_for("gpt-4-0613") == (10, 600)
+    assert limiter.limits_for("gpt-4-turbo") == (500, 150000)
+    assert limiter.limits_for("my-model") == (1, 100)
+
+def test_reserve_waits_for_the_overdrawn_bucket(clock):
+    limiter = RateLimiter({"gpt-4": [60, 6000]})
+    assert limiter.reserve("gpt-4", 5000) == 0.0
+    assert limiter.reserve("gpt-4", 2000) == pytest.approx(10.0) # 1000 tokens overdrawn at 100 tokens per second
+
+    clock.now += 10.0 # refilled back to 0
+    assert limiter.reserve("gpt-4", 100) == pytest.approx(1.0)
+
+def test_buckets_refill_up_to_their_size(clock):
+    limiter = RateLimiter({"gpt-4": [2, 6000]})
+    limiter.reserve("gpt-4", 0)
+    limiter.reserve("gpt-4", 0)
+    assert limiter.reserve("gpt-4", 0) == pytest.approx(30.0) # one request overdrawn at 2 per minute
+
+    clock.now += 3600.0
+    assert limiter.reserve("gpt-4", 0) == 0.0
+    assert limiter.reserve("gpt-4", 0) == 0.0
+    assert limiter.reserve("gpt-4", 0) == pytest.approx(30.0) # the idle hour did not bank more than two requests
+
+def test_calls_larger_than_the_bucket_wait_for_a_full_bucket(clock):
+    limiter = RateLimiter({"gpt-4": [60, 6000]})
+    limiter.reserve("gpt-4", 6000)
+    assert limiter.reserve("gpt-4", 50000) == pytest.approx(60.0)
+
+def test_refund_gives_back_a_reservation(clock):
+    limiter = RateLimiter({"gpt-4": [60, 6000]})
+    limiter.reserve("gpt-4", 5000)
+    limiter.refund("gpt-4", 5000)
+    assert limiter.buckets["gpt-4"]["requests"] == pytest.approx(60)
+    assert limiter.buckets["gpt-4"]["tokens"] == pytest.approx(6000)
+    assert limiter.reserve("gpt-4", 6000) == 0.0
+
+def test_models_without_limits_are_not_paced():
+    limiter = RateLimiter()
+    assert limiter.reserve("davinci-002", 10**9) == 0.0
+    limiter.refund("davinci-002", 10**9)
+    assert limiter.buckets == {}
+
+def test_a_retried_call_is_counted_once(clock, monkeypatch):
+    import httpx
+    from openai import APIConnectionError
+    monkeypatch.setattr("rate_limiter.time.sleep", lambda seconds: None)
+    limiter = RateLimiter({"gpt-4": [60, 6000]}, max_retries=3, base_delay=0.0)
+    attempts = []
+    def create():
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+        return "reply"
+
+    assert limiter.call("gpt-4", 4000, create) == "reply"
+    assert len(attempts) == 3
+    assert limiter.buckets["gpt-4"]["requests"] == pytest.approx(59)
+    assert limiter.buckets["gpt-4"]["tokens"] == pytest.approx(2000)
+
+def test_errors_that_are_not_retryable_are_raised(clock):
+    limiter = RateLimiter({"gpt-4": [60, 6000]})
+    def create():
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        limiter.call("gpt-4", 100, create)
@@ -0,0 +1,42 @@
+import os
+
+from conftest import conversation
+from summarizer import ConversationSummarizer
+
+SYSTEM = {"role": "system", "content": "you are a test"}
+
+def test_compact_folds_a_batch_and_saves_the_sidecar(tmp_path, token_counter):
+    summarizer = ConversationSummarizer(token_counter, batch_messages=4, keep_recent=2)
+    filename = str(tmp_path / "a.json")
+    messages = [SYSTEM] + conversation(10)
+    requests = []
+    def request_summary(summary_messages, max_tokens):
+        requests.append(summary_messages)
+        return "the summary"
+
+    summary = summarizer.compact(filename, messages, 3, "gpt-4", request_summary, first=1)
+    assert summary["content"] == "the summary" and summary["covered"] == 5
+    assert os.listdir(tmp_path) == ["a.json.summary"] # written through a temporary file, renamed over the sidecar
+
+    # Covered messages are not summarized again, and the summary is read back from the sidecar
+    assert summarizer.compact(filename, messages, 4, "gpt-4", request_summary, first=1) == summary
+    assert ConversationSummarizer(token_counter).load(filename, messages) == summary
+    assert len(requests) == 1
+
+def test_failures_fall_back_to_the_previous_summary(tmp_path, token_counter):
+    summarizer = ConversationSummarizer(token_counter, batch_messages=2)
+    filename = str(tmp_path / "a.json")
+    messages = [SYSTEM] + conversation(10)
+    def failing(summary_messages, max_tokens):
+        raise RuntimeError("no connection")
+
+    assert summarizer.compact(filename, messages, 3, "gpt-4", failing, first=1) is None
+    assert summarizer.compact(filename, messages, 3, "gpt-4", lambda summary_messages, max_tokens: "", first=1) is None
+    summary = summarizer.compact(filename, messages, 3, "gpt-4", lambda summary_messages, max_tokens: "kept", first=1)
+    assert summarizer.compact(filename, messages, 7, "gpt-4", failing, first=1) == summary
+
+def test_the_summary_joins_the_system_message(token_counter):
+    summary = {"content": "the summary", "covered": 3}
+    merged = ConversationSummarizer.system_message([SYSTEM], summary)
+    assert merged["role"] == "system" and merged["content"].startswith(SYSTEM["content"]) and "the summary" in merged["content"]
+    assert ConversationSummarizer.system_message([], summary)["role"] == "system"
@@ -0,0 +1,38 @@
+import pytest
+
+from tokenizer_service import TokenizerService
+
+TEXTS = [
+    "trailing spaces   \nbefore a newline  \n\tand a tab\nx",
+    "paragraphs\n\nseparated\n\n\nby blank lines\n \n  \nend",
+    "windows\r\nline endings\r\n\r\nwith CRLF\r\n",
+    "def indented():\n    return [\n        1,\n    ]\n\nclass Next:\n  pass\n",
+    "non-ASCII: café, naïve, Ελληνικά\n日本語のテキスト\n🙂 emoji\n— dash\n",
+    "punctuation!!\n?? and numbers 12345\n67890\n'quoted'\n's\n",
+]
+
+@pytest.fixture
+def service():
+    # Encodes every batch on the pool, in chunks small enough that every text is split
+    service = TokenizerService(workers=2, parallel_chars=0)
+    service.CHUNK_CHARS = 8
+    return service
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_split_counts_add_up_to_the_whole_text(text, service, cl100k_base):
+    chunks = service.split(text)
+    assert "".join(chunks) == text and len(chunks) > 1
+    assert sum(len(cl100k_base.encode_ordinary(chunk)) for chunk in chunks) == len(cl100k_base.encode_ordinary(text))
+
+def test_every_split_point_is_exact(cl100k_base):
+    # Cutting at any single split point, not only those split() picks, leaves the count unchanged
+    text = "".join(TEXTS) * 3
+    whole = len(cl100k_base.encode_ordinary(text))
+    for boundary in TokenizerService.SPLIT_POINT.finditer(text):
+        cut = boundary.end()
+        assert len(cl100k_base.encode_ordinary(text[:cut])) + len(cl100k_base.encode_ordinary(text[cut:])) == whole, repr(text[cut - 5:cut + 5])
+
+def test_batched_counts_are_exact(service, cl100k_base):
+    texts = TEXTS + ["".join(TEXTS) * 50, "", "<|endoftext|> is counted as text"]
+    assert service.encode_lengths(texts, "gpt-4") == [len(cl100k_base.encode_ordinary(text)) for text in texts]
+    assert service.count_text(texts[-1], "gpt-4") == len(cl100k_base.encode_ordinary(texts[-1]))
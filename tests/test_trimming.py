@@ -0,0 +1,88 @@
+import random
+
+from conftest import conversation
+from trimming import TokenPrefixIndex
+
+class CountingTokens:
+    """Counts the tokens of messages with a TokenCounter and records how many messages it was asked for."""
+
+    def __init__(self, token_counter):
+        self.token_counter = token_counter
+        self.counted = 0
+
+    def __call__(self, messages):
+        self.counted += len(messages)
+        return self.token_counter.count_each(messages, "gpt-4")
+
+def test_sync_counts_only_appended_messages(token_counter):
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    messages = conversation(10)
+    index.sync(messages, count, token_counter.digest, generation=1)
+    assert count.counted == 10
+
+    messages += conversation(3, start=10)
+    index.sync(messages, count, token_counter.digest, generation=1)
+    assert count.counted == 13
+    assert index.tokens(0, 13) == token_counter.count(messages, "gpt-4")
+
+def test_sync_rebuilds_when_the_generation_changes(token_counter):
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    messages = conversation(10)
+    index.sync(messages, count, token_counter.digest, generation=1)
+
+    # Same length and same last message, but the conversation was replaced (a reset or an outside edit)
+    replaced = [{"role": "system", "content": "a much longer system message than before"}] + messages[1:]
+    index.sync(replaced, count, token_counter.digest, generation=2)
+    assert count.counted == 20
+    assert index.tokens(0, 10) == token_counter.count(replaced, "gpt-4")
+
+def test_sync_rebuilds_when_the_last_message_changed(token_counter):
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    messages = conversation(10)
+    index.sync(messages, count, token_counter.digest, generation=1)
+
+    edited = messages[:9] + [{"role": "assistant", "content": "edited reply"}] + conversation(2, start=10)
+    index.sync(edited, count, token_counter.digest, generation=1)
+    assert count.counted == 22
+    assert index.tokens(0, 12) == token_counter.count(edited, "gpt-4")
+
+def test_sync_rebuilds_when_the_conversation_got_shorter(token_counter):
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    index.sync(conversation(10), count, token_counter.digest, generation=1)
+    index.sync(conversation(4), count, token_counter.digest, generation=1)
+    assert index.tokens(0, 4) == token_counter.count(conversation(4), "gpt-4")
+
+def test_invalidate_counts_everything_again(token_counter):
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    index.sync(conversation(10), count, token_counter.digest, generation=1)
+    index.invalidate()
+    index.sync(conversation(10), count, token_counter.digest, generation=1)
+    assert count.counted == 20
+
+def test_sync_follows_the_store_generation(tmp_path, store, token_counter):
+    filename = str(tmp_path / "a.json")
+    store.save(filename, conversation(6))
+    index, count = TokenPrefixIndex(), CountingTokens(token_counter)
+    index.sync(store.load(filename), count, token_counter.digest, store.generation(filename))
+
+    store.append(filename, conversation(2, start=6))
+    index.sync(store.load(filename), count, token_counter.digest, store.generation(filename))
+    assert count.counted == 8 # appended messages extend the index
+
+    store.save(filename, conversation(8))
+    index.sync(store.load(filename), count, token_counter.digest, store.generation(filename))
+    assert count.counted == 16 # a saved snapshot rebuilds it
+
+def test_cut_index_keeps_the_longest_suffix_that_fits():
+    rng = random.Random(7)
+    index = TokenPrefixIndex()
+    sizes = [rng.randint(1, 20) for _ in range(40)]
+    index.sync(sizes, lambda new_sizes: new_sizes, str)
+
+    for start in (0, 1, 5):
+        for budget in range(-5, sum(sizes) + 5):
+            cut = index.cut_index(start, len(sizes), budget)
+            # Brute force: the first i >= start with sum(sizes[i:]) <= budget, or the end if nothing fits
+            expected = next((i for i in range(start, len(sizes) + 1) if sum(sizes[i:]) <= budget), len(sizes))
+            assert cut == expected, (start, budget)
+            assert index.tokens(cut, len(sizes)) <= max(budget, 0)